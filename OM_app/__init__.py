@@ -0,0 +1 @@
+default_app_config = 'OM_app.apps.OmAppConfig'
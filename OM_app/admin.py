@@ -49,4 +49,5 @@ admin.site.register(Message)
 admin.site.register(JobOffer)
 admin.site.register(JobOfferCategory)
 admin.site.register(FavouriteOffer)
-admin.site.register(FavouriteJobOffer)
\ No newline at end of file
+admin.site.register(FavouriteJobOffer)
+admin.site.register(OutgoingEmail)
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+JWT authentication without a User query per request.
+
+Access tokens carry the user's id, username, is_staff, is_superuser and
+token version (see VersionedTokenObtainPairSerializer). Safe requests get a
+ClaimsUser built from those claims; only the token version is checked, against
+the Django cache, which falls back to a single-column query on a miss. Write
+requests load the full User from the database and compare the version there.
+
+Changing the password or deleting the account bumps the version, so every
+token issued before stops working. It also bumps the shared GENERATION
+(OM_app/generations.py) the cached versions are keyed with, so every process
+reads the versions from the user rows again within CHECK_INTERVAL seconds,
+whatever cache backend it runs with.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .. import generations
+from ..models import User
+
+DEFAULTS = {
+    'USER_CACHE_SIZE': 1024,    # full User objects kept per process
+    'USER_CACHE_TTL': 60,       # seconds
+    'VERSION_TTL': 300,         # seconds a token version stays in the Django cache
+}
+
+VERSION_CLAIM = 'ver'    # tokens issued before the claim existed count as version 0
+DELETED = -1    # cached version of a deleted user, no token matches it
+GENERATION = 'jwt-token-versions'
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'JWT_FAST_PATH', {}))
+    return config
+
+
+class UserCache:
+    """
+    Small thread safe LRU of User objects whose entries expire after `ttl` seconds.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user):
+        with self.lock:
+            self.entries[user.id] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+user_cache = UserCache(get_config()['USER_CACHE_SIZE'], get_config()['USER_CACHE_TTL'])
+
+
+def version_key(user_id):
+    return 'jwt-token-version:{}:{}'.format(generations.current(GENERATION), user_id)
+
+
+def current_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = User.objects.filter(id=user_id, is_active=True).values_list('token_version', flat=True).first()
+        if version is None:
+            version = DELETED
+        cache.set(version_key(user_id), version, get_config()['VERSION_TTL'])
+    return version
+
+
+def remember_version(user_id, version):
+    cache.set(version_key(user_id), version, get_config()['VERSION_TTL'])
+    user_cache.evict(user_id)
+
+
+def token_version_changed(user_id, version=None):
+    """
+    Publish a bumped version, None when the account was deleted, to every process.
+    """
+    generations.bump(GENERATION)
+    remember_version(user_id, DELETED if version is None else version)
+
+
+def bump_token_version(user):
+    """
+    Invalidate every token of `user`, the caller saves the user afterwards.
+    """
+    user.token_version += 1
+
+
+def get_user(user_id, version):
+    """
+    Full user for a token of `version`, from the cache when possible, None when the token is stale.
+    """
+    user = user_cache.get(user_id)
+    if user is None or user.token_version != version:
+        user = User.objects.filter(id=user_id, is_active=True).first()
+        if user is None or user.token_version != version:
+            return None
+        user_cache.set(user)
+    return user
+
+
+def user_for_token(raw_token):
+    """
+    User of a raw access token (websockets), None for invalid or stale tokens.
+    """
+    try:
+        token = AccessToken(raw_token)
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+    version = token.get(VERSION_CLAIM, 0)
+    if version != current_version(user_id):
+        return None
+    return get_user(user_id, version)
+
+
+class ClaimsUser(TokenUser):
+    """
+    User built from token claims, attributes that are not claims come from the cached full User.
+    """
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'token':
+            raise AttributeError(name)
+        user = get_user(self.id, self.token.get(VERSION_CLAIM, 0))
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that only reads the User from the database for write requests.
+    """
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        version = validated_token.get(VERSION_CLAIM, 0)
+
+        if request.method in SAFE_METHODS:
+            if version != current_version(user_id):
+                raise AuthenticationFailed('Token is no longer valid', code='token_not_valid')
+            return ClaimsUser(validated_token), validated_token
+
+        user = User.objects.filter(id=user_id).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if version != user.token_version:
+            remember_version(user_id, user.token_version)
+            raise AuthenticationFailed('Token is no longer valid', code='token_not_valid')
+        return user, validated_token
@@ -0,0 +1,190 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import django_filters
+from bson.decimal128 import Decimal128
+from django import forms
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.filters import SearchFilter, OrderingFilter
+
+from .. import geo, search
+from ..mongo import column
+from ..models import Offer, JobOffer
+
+
+class IndexedSearchFilter(SearchFilter):
+    """
+    `?search=` answered from the inverted index instead of icontains scans.
+    The view names its index with `search_index`. With an explicit ordering
+    every match is listed; without one the best search.MAX_RESULTS matches
+    come back ranked, so this backend goes last.
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        kind = getattr(view, 'search_index', None)
+        if not terms or kind is None:
+            return queryset
+
+        if OrderingFilter().get_ordering(request, queryset, view):
+            return queryset.filter(id__in=search.search(kind, ' '.join(terms), limit=None))
+        ranked = search.search(kind, ' '.join(terms))
+        queryset = queryset.filter(id__in=ranked)
+
+        rank = {pk: i for i, pk in enumerate(ranked)}
+        return sorted(queryset, key=lambda obj: rank[obj.pk])
+
+
+class LatLngField(forms.Field):
+    default_error_messages = {
+        'invalid': 'Expected "latitude,longitude" in degrees.',
+    }
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            lat, lng = (float(part) for part in value.split(','))
+        except ValueError:
+            raise forms.ValidationError(self.error_messages['invalid'], code='invalid')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise forms.ValidationError(self.error_messages['invalid'], code='invalid')
+        return lat, lng
+
+
+class LatLngFilter(django_filters.Filter):
+    field_class = LatLngField
+
+
+class CityAreaFilterSet(django_filters.FilterSet):
+    """
+    `near=lat,lng` (with `radius_km`, DEFAULT_RADIUS_KM by default) and
+    `voivodeship_id` turn into a `city_id IN (...)` condition, the city ids
+    come from the in-process index in OM_app/geo.py.
+    """
+    DEFAULT_RADIUS_KM = 25
+
+    near = LatLngFilter(method='filter_near')
+    radius_km = django_filters.NumberFilter(method='filter_radius_km', min_value=0)
+    voivodeship_id = django_filters.NumberFilter(method='filter_voivodeship_id')
+
+    def filter_near(self, queryset, name, value):
+        radius_km = self.form.cleaned_data.get('radius_km')
+        if radius_km is None:
+            radius_km = self.DEFAULT_RADIUS_KM
+        return self.in_cities(queryset, geo.cities_near(value[0], value[1], float(radius_km)))
+
+    def filter_radius_km(self, queryset, name, value):
+        return queryset     # read by filter_near
+
+    def filter_voivodeship_id(self, queryset, name, value):
+        return self.in_cities(queryset, geo.cities_in_voivodeship(int(value)))
+
+    def in_cities(self, queryset, city_ids):
+        if city_ids is None:
+            return queryset
+        if not city_ids:
+            return queryset.none()
+        return queryset.filter(city_id__in=sorted(city_ids))
+
+    # the same filters as MongoDB conditions, for aggregations (see OM_app/facets.py)
+
+    def mongo_conditions(self):
+        """
+        [(field, condition)] of the validated filter state. `field` is the
+        column the filter restricts (city_id for every location filter), or
+        None when it does not restrict a single facet.
+        """
+        model = self._meta.model
+        conditions = []
+        for name, value in self.form.cleaned_data.items():
+            if value is None or value == '':
+                continue
+            method = getattr(self, 'mongo_' + name, None) if self.filters[name].method else None
+            if method is not None:
+                result = method(value)
+                if result is not None:
+                    conditions.append(result)
+                continue
+            field_name, lookup = self.filters[name].field_name, self.filters[name].lookup_expr
+            value = to_mongo(value, model._meta.get_field(field_name))
+            condition = value if lookup == 'exact' else {'$' + lookup: value}
+            conditions.append((field_name if lookup == 'exact' else None, {column(model, field_name): condition}))
+        return conditions
+
+    def mongo_near(self, value):
+        radius_km = self.form.cleaned_data.get('radius_km')
+        city_ids = geo.cities_near(value[0], value[1], float(self.DEFAULT_RADIUS_KM if radius_km is None else radius_km))
+        return None if city_ids is None else ('city_id', {'city_id': {'$in': sorted(city_ids)}})
+
+    def mongo_radius_km(self, value):
+        return None
+
+    def mongo_voivodeship_id(self, value):
+        return ('city_id', {'city_id': {'$in': sorted(geo.cities_in_voivodeship(int(value)))}})
+
+
+def to_mongo(value, field=None):
+    """
+    Python value as djongo stores it in `field`. Like the ORM, a date compared
+    with a DateTimeField means midnight in TIME_ZONE and naive datetimes are in
+    TIME_ZONE, stored converted to UTC; DateField values are stored as UTC
+    midnight of the date (djongo's adapt_datefield_value).
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else Decimal128(value)
+    if hasattr(value, 'pk'):
+        return value.pk
+    if field is not None and field.get_internal_type() == 'DateTimeField' and isinstance(value, date):
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, time.min)
+        if settings.USE_TZ:
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            value = timezone.make_naive(value, timezone.utc)    # pymongo reads naive datetimes as UTC
+        return value
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, time.min)
+    return value
+
+
+class OfferFilter(CityAreaFilterSet):
+    """
+    Equality filters, the city area filters, `min_price`/`max_price` and a
+    `created_after`/`created_before` window.
+    """
+    min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    created_after = django_filters.DateFilter(field_name='creation_date', lookup_expr='gte')
+    created_before = django_filters.DateFilter(field_name='creation_date', lookup_expr='lte')
+
+    class Meta:
+        model = Offer
+        fields = ('city_id', 'user_id', 'category_id')
+
+
+class JobOfferFilter(CityAreaFilterSet):
+    """
+    `salary_min`/`salary_max` keep the offers whose salary range overlaps the
+    requested one, an offer without `max_salary` pays exactly `min_salary`.
+    `min_salary_f` is the older "min_salary at least" filter.
+    """
+    salary_min = django_filters.NumberFilter(method='filter_salary_min')
+    salary_max = django_filters.NumberFilter(field_name='min_salary', lookup_expr='lte')
+    min_salary_f = django_filters.NumberFilter(field_name='min_salary', lookup_expr='gte')
+    created_after = django_filters.DateFilter(field_name='creation_date', lookup_expr='gte')
+    created_before = django_filters.DateFilter(field_name='creation_date', lookup_expr='lte')
+
+    class Meta:
+        model = JobOffer
+        fields = ('city_id', 'user_id', 'category_id', 'remote')
+
+    def filter_salary_min(self, queryset, name, value):
+        return queryset.filter(Q(max_salary__gte=value) | Q(max_salary__isnull=True, min_salary__gte=value))
+
+    def mongo_salary_min(self, value):
+        return (None, {'$or': [
+            {'max_salary': {'$gte': to_mongo(value)}},
+            {'max_salary': None, 'min_salary': {'$gte': to_mongo(value)}},
+        ]})
@@ -0,0 +1,104 @@
+from django.http import Http404
+from rest_framework.response import Response
+
+from .. import metrics, repository, response_cache
+from ..mongo import primary_reads, read_alias
+
+
+class InstrumentedViewMixin:
+    """
+    Reports the time spent producing `serializer.data` of list and retrieve
+    as the `serializer` timing of PerformanceMetricsMiddleware.
+    """
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            with metrics.timing(request, 'serializer'):
+                data = serializer.data
+            return self.get_paginated_response(data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        with metrics.timing(request, 'serializer'):
+            data = serializer.data
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        with metrics.timing(request, 'serializer'):
+            data = serializer.data
+        return Response(data)
+
+
+
+class NativeRetrieveMixin:
+    """
+    GET of a single object reads it with pymongo (OM_app/repository.py),
+    the other methods load it through the ORM.
+    """
+    def get_object(self):
+        if self.request.method != 'GET' or not repository.enabled():
+            return super().get_object()
+        try:
+            pk = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except (TypeError, ValueError):
+            raise Http404
+        obj = repository.get_instance(self.get_queryset().model, pk)
+        if obj is None:
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class LeanListMixin:
+    """
+    GET list through `list_serializer_class` (a LeanListSerializer): only the
+    columns it needs are loaded and rows skip the ModelSerializer machinery.
+    The rows are read through the read preference alias (secondaries), the
+    primary for pages of the response cache, with pymongo unless the request
+    searches (OM_app/repository.py).
+    Other methods keep using `serializer_class`.
+    """
+    list_serializer_class = None
+    fields_query_param = 'fields'
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.list_serializer_class
+        fields = serializer_class.select_fields(request.query_params.get(self.fields_query_param))
+        # keyset pagination reads the sort key of the last row
+        columns = serializer_class.columns(fields) | {'id'} | set(getattr(self, 'ordering_fields', ()))
+        queryset = repository.list_documents(self, request, columns)
+        if queryset is None:
+            queryset = self.filter_queryset(self.get_queryset().using(read_alias()).only(*columns))
+
+        page = self.paginate_queryset(queryset)
+        serializer = serializer_class(page if page is not None else queryset, fields, context=self.get_serializer_context())
+        with metrics.timing(request, 'serializer'):
+            data = serializer.data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ResponseCacheMixin:
+    """
+    Serves anonymous GETs from the shared response cache (OM_app/response_cache.py).
+    `response_cache_kind` names the generation counter the model signals bump.
+    Pages are computed from the primary, see primary_reads().
+    """
+    response_cache_kind = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if not response_cache.cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        def compute():
+            with primary_reads():
+                response = super(ResponseCacheMixin, self).dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+
+        return response_cache.fetch(self.response_cache_kind, request, compute)
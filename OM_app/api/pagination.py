@@ -0,0 +1,136 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from ..repository import DocumentQuery
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination with an opt-in keyset (cursor) mode.
+
+    Sending ``cursor`` (empty for the first page) switches to keyset mode:
+    a page is read with "(ordering field, id) after the last row" instead of
+    skipping ``offset`` documents, so deep pages cost the same as the first.
+    The total ``count`` is only computed in keyset mode when ``count=true``.
+    Native reads (OM_app/repository.py) are paginated the same way.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    keyset_default_limit = 20
+    default_ordering = '-creation_date'
+    invalid_cursor_message = 'Invalid cursor'
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # ranked search results are a bounded list, they keep limit/offset
+        if self.cursor_query_param not in request.query_params or not isinstance(queryset, (QuerySet, DocumentQuery)):
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.display_page_controls = False
+        self.limit = self.get_limit(request) or self.keyset_default_limit
+        self.field, self.descending = self.get_key(request, queryset, view)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.count()
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = self.filter_after(queryset, *position)
+
+        ordering = ['-id' if self.descending else 'id']
+        if self.field != 'id':
+            ordering.insert(0, ('-' if self.descending else '') + self.field)
+
+        page = list(queryset.order_by(*ordering)[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.last = page[-1] if page else None
+        return page
+
+    def get_key(self, request, queryset, view):
+        """
+        Leading key column taken from the view's OrderingFilter, `id` breaks ties.
+        """
+        ordering = None
+        if view is not None:
+            ordering = OrderingFilter().get_ordering(request, queryset, view)
+        term = ordering[0] if ordering else self.default_ordering
+        return term.lstrip('-'), term.startswith('-')
+
+    def filter_after(self, queryset, value, pk):
+        field = self.field
+        if isinstance(queryset, DocumentQuery):
+            return queryset.after(field, self.descending, value, pk)
+        after_pk = Q(id__lt=pk) if self.descending else Q(id__gt=pk)
+        if field == 'id':
+            return queryset.filter(after_pk)
+
+        nullable = queryset.model._meta.get_field(field).null
+        # MongoDB sorts nulls first in ascending and last in descending order
+        if value is None:
+            position = Q(**{field + '__isnull': True}) & after_pk
+            if not self.descending:
+                position |= Q(**{field + '__isnull': False})
+            return queryset.filter(position)
+
+        lookup = '__lt' if self.descending else '__gt'
+        position = Q(**{field + lookup: value}) | (Q(**{field: value}) & after_pk)
+        if self.descending and nullable:
+            position |= Q(**{field + '__isnull': True})
+        return queryset.filter(position)
+
+    def encode_cursor(self, value, pk):
+        if value is not None and not isinstance(value, int):
+            value = str(value)
+        raw = json.dumps([value, pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            pk = int(pk)
+            if value is not None and self.field != 'id':
+                value = model._meta.get_field(self.field).to_python(value)
+        except (TypeError, ValueError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        value = None if self.field == 'id' else getattr(self.last, self.field)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(value, self.last.pk))
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return None
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        fields = [('next', self.get_next_link()), ('results', data)]
+        if self.count is not None:
+            fields.insert(0, ('count', self.count))
+        return Response(OrderedDict(fields))
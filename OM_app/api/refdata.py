@@ -0,0 +1,59 @@
+"""
+Prebuilt payloads of the nearly static reference data (voivodeships with
+cities, offer and job offer categories). They are kept in the Django cache
+together with a strong ETag, under the shared generation of their name
+(OM_app/generations.py) that the model signals in OM_app/signals.py bump.
+Entries also expire after CACHE_TTL seconds, which bounds how long a change
+made without the signals (a raw update or an edit of the database) is served
+stale.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .. import generations
+from ..models import Voivodeship, OfferCategory, JobOfferCategory
+from .serializers import VoivodeshipCitiesSerializer, OffersCategoriesSerializer, JobOffersCategoriesSerializer
+
+CACHE_PREFIX = 'refdata:'
+CACHE_TTL = 600     # seconds
+
+
+def build_voivodeships_cities():
+    # cities come from one prefetch query instead of one query per voivodeship
+    voivodeships = Voivodeship.objects.prefetch_related('cities').order_by('name')
+    return VoivodeshipCitiesSerializer(voivodeships, many=True).data
+
+def build_offers_categories():
+    categories = OfferCategory.objects.all().order_by('name')
+    return OffersCategoriesSerializer(categories, many=True).data
+
+def build_job_offers_categories():
+    categories = JobOfferCategory.objects.all().order_by('name')
+    return JobOffersCategoriesSerializer(categories, many=True).data
+
+BUILDERS = {
+    'voivodeships-cities': build_voivodeships_cities,
+    'offers-categories': build_offers_categories,
+    'job-offers-categories': build_job_offers_categories,
+}
+
+
+def get(name):
+    """
+    (payload, etag) of the reference data `name`, built on the first call.
+    """
+    key = '{}{}:{}'.format(CACHE_PREFIX, name, generations.current(CACHE_PREFIX + name))
+    entry = cache.get(key)
+    if entry is None:
+        payload = json.loads(json.dumps(BUILDERS[name](), cls=DjangoJSONEncoder))
+        raw = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        entry = (payload, '"{}"'.format(hashlib.sha1(raw).hexdigest()))
+        cache.set(key, entry, CACHE_TTL)
+    return entry
+
+
+def invalidate(name):
+    generations.bump(CACHE_PREFIX + name)
@@ -1,9 +1,16 @@
+from decimal import Decimal
+
 from django.core.exceptions import ValidationError
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
 from ..models import *
+from .. import favourites, images
 from ..chat_utils import create_chat_contact
+from .authentication import VERSION_CLAIM
 
 # user
 class UserSerializer(serializers.ModelSerializer):
@@ -42,10 +49,37 @@ class ChangePasswordSerializer(serializers.Serializer):
         validate_password(value)
         return value
 
+# tokens
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds the claims ClaimsJWTAuthentication builds the request user from.
+    """
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token[VERSION_CLAIM] = user.token_version
+        return token
+
+class VersionedTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuses refresh tokens issued before the last password change.
+    """
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        version = User.objects.filter(
+            id=refresh[api_settings.USER_ID_CLAIM], is_active=True
+        ).values_list('token_version', flat=True).first()
+        if version is None or version != refresh.get(VERSION_CLAIM, 0):
+            raise serializers.ValidationError({'refresh': ['Token is no longer valid.']})
+        return super().validate(attrs)
+
 class CitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'latitude', 'longitude')
 # nested serializer
 class VoivodeshipCitiesSerializer(serializers.ModelSerializer):
     cities = CitySerializer(many=True, read_only=True)
@@ -53,12 +87,169 @@ class VoivodeshipCitiesSerializer(serializers.ModelSerializer):
         model = Voivodeship
         fields = ('name', 'cities')
 
+# sparse fieldsets and lean list serializers
+
+class SparseFieldsMixin:
+    """
+    `?fields=a,b` on a GET limits the representation to those fields.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = set(request.query_params.get('fields', '').split(',')) & set(self.fields)
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+def decimal_to_string(places):
+    quantum = Decimal(1).scaleb(-places)
+    def convert(value):
+        return None if value is None else '{:f}'.format(Decimal(value).quantize(quantum))
+    return convert
+
+def date_to_string(value):
+    return None if value is None else value.isoformat()
+
+class LeanListSerializer:
+    """
+    Read only serializer for feed pages. Reads model attributes and runs a
+    converter per field instead of building DRF fields for every row, and
+    tells the view which columns to load with `.only()`.
+
+    `fields` lists what can be requested with `?fields=`, `default_fields` what
+    a page has without it. `computed` maps extra names to (function, columns),
+    a None function means the serializer's `get_<name>` method.
+    """
+    model = None
+    favourite_kind = None
+    fields = ()
+    default_fields = ()
+    converters = {}
+    computed = {}
+
+    def __init__(self, instances, fields, context=None):
+        self.instances = instances
+        self.selected = fields
+        self.context = context or {}
+
+    @classmethod
+    def select_fields(cls, requested):
+        requested = set((requested or '').split(','))
+        return tuple(name for name in cls.fields if name in requested) or cls.default_fields
+
+    @classmethod
+    def columns(cls, fields):
+        columns = set()
+        for name in fields:
+            columns.update(cls.computed[name][1] if name in cls.computed else (name,))
+        return columns
+
+    def getters(self):
+        getters = []
+        for name in self.selected:
+            if name in self.computed:
+                getters.append((name, self.computed[name][0] or getattr(self, 'get_' + name)))
+            else:
+                attname = self.model._meta.get_field(name).attname
+                convert = self.converters.get(name)
+                if convert is None:
+                    getters.append((name, lambda obj, attname=attname: getattr(obj, attname)))
+                else:
+                    getters.append((name, lambda obj, attname=attname, convert=convert: convert(getattr(obj, attname))))
+        return getters
+
+    def get_is_favourite(self, obj):
+        # one lookup per page: the user's favourite ids are cached as a set
+        if not hasattr(self, 'favourite_ids'):
+            request = self.context.get('request')
+            user = getattr(request, 'user', None)
+            self.favourite_ids = frozenset()
+            if user is not None and user.is_authenticated:
+                self.favourite_ids = favourites.favourite_ids(self.favourite_kind, user.id)
+        return obj.id in self.favourite_ids
+
+    @property
+    def data(self):
+        getters = self.getters()
+        return [{name: get(obj) for name, get in getters} for obj in self.instances]
+
+class OfferListSerializer(LeanListSerializer):
+    model = Offer
+    favourite_kind = 'offer'
+    fields = (
+        'id', 'user_id', 'city_id', 'category_id', 'name', 'price', 'description', 'creation_date', 'image',
+        'image_variants', 'favourite_count', 'is_favourite'
+    )
+    default_fields = (
+        'id', 'user_id', 'city_id', 'category_id', 'name', 'price', 'creation_date', 'image', 'image_variants',
+        'favourite_count', 'is_favourite'
+    )
+    converters = {
+        'price': decimal_to_string(2),
+        'creation_date': date_to_string,
+    }
+    computed = {
+        'image': (None, ('image',)),
+        'image_variants': (lambda offer: images.variant_urls(offer), ('id', 'image_status', 'image_version')),
+        'is_favourite': (None, ('id',)),
+    }
+
+    def get_image(self, offer):
+        # what OfferSerializer's ImageField returns; native reads hold the file name itself
+        name = getattr(offer.image, 'name', offer.image)
+        if not name:
+            return None
+        url = Offer.image.field.storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+class JobOfferListSerializer(LeanListSerializer):
+    model = JobOffer
+    favourite_kind = 'joboffer'
+    fields = (
+        'id', 'user_id', 'city_id', 'category_id', 'name', 'min_salary', 'max_salary',
+        'description', 'creation_date', 'company', 'remote', 'favourite_count', 'is_favourite'
+    )
+    default_fields = (
+        'id', 'user_id', 'city_id', 'category_id', 'name', 'min_salary', 'max_salary',
+        'creation_date', 'company', 'remote', 'favourite_count', 'is_favourite'
+    )
+    converters = {
+        'creation_date': date_to_string,
+    }
+    computed = {
+        'is_favourite': (None, ('id',)),
+    }
+
 # offers
 
-class OfferSerializer(serializers.ModelSerializer):
+class OfferSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Offer
         fields = '__all__'
+        read_only_fields = ('image_status', 'image_version', 'favourite_count')
+
+    def get_image_variants(self, offer):
+        return images.variant_urls(offer)
+
+    # the upload is only staged here, OM_app/images.py processes it in the background
+    def create(self, validated_data):
+        upload = validated_data.pop('image', None)
+        offer = super().create(validated_data)
+        if upload:
+            images.accept_upload(offer, upload)
+        return offer
+
+    def update(self, instance, validated_data):
+        upload = validated_data.pop('image', None)
+        offer = super().update(instance, validated_data)
+        if upload:
+            images.accept_upload(offer, upload)
+        return offer
 
 class OffersCategoriesSerializer(serializers.ModelSerializer):
     class Meta:
@@ -67,10 +258,11 @@ class OffersCategoriesSerializer(serializers.ModelSerializer):
 
 # job offers
 
-class JobOfferSerializer(serializers.ModelSerializer):
+class JobOfferSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = JobOffer
         fields = '__all__'
+        read_only_fields = ('favourite_count',)
 
 class JobOffersCategoriesSerializer(serializers.ModelSerializer):
     class Meta:
@@ -103,6 +295,13 @@ class ChatSerializer(serializers.ModelSerializer):
         chat.save()
         return chat
 
+class MessageSerializer(serializers.ModelSerializer):
+    author = serializers.IntegerField(source='contact.user_id', read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ('id', 'author', 'content', 'timestamp')
+
 # favourites
 
 class FavouriteOfferSerialzier(serializers.ModelSerializer):
@@ -3,11 +3,6 @@ from django.urls import (
     include
 )
 
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
-
 from .views import *
 
 urlpatterns = [
@@ -17,12 +12,14 @@ urlpatterns = [
     path('joboffers/favourites/list/', FavouriteJobOffersView.as_view(), name='favourites-offers'),
     path('joboffers/favourites/', joboffer_to_favourites),
     # AUTHENTICATION
-    path('auth/token/', TokenObtainPairView.as_view(), name='token-obtain-pair'),
-    path('auth/token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('auth/token/', VersionedTokenObtainPairView.as_view(), name='token-obtain-pair'),
+    path('auth/token/refresh/', VersionedTokenRefreshView.as_view(), name='token-refresh'),
     # CHAT
     path('chat/', ChatListView.as_view()),
     path('chat/create/', ChatCreateView.as_view()),
+    path('chat/inbox/', ChatInboxView.as_view()),
     path('chat/<pk>', ChatDetailView.as_view()),
+    path('chat/<pk>/messages/', ChatMessagesView.as_view()),
     path('chat/<pk>/update/', ChatUpdateView.as_view()),
     path('chat/<pk>/delete/', ChatDeleteView.as_view()),
     # USERS
@@ -38,10 +35,13 @@ urlpatterns = [
     path('citites/<pk>/', CitiesList.as_view(), name='cities-list'),
     # OFFERS
     path('offers/categories/', OffersCategoriesList.as_view(), name='offers-categories-list'),                  # list of offer categories
+    path('offers/export/', OfferExport.as_view(), name='offers-export'),
+    path('offers/facets/', OfferFacets.as_view(), name='offers-facets'),
     path('offers/', OfferList.as_view(), name='offers-list'),                                                   
     path('offers/<pk>/', OfferDetail.as_view(), name='offer-detail'),                                           
     # JOB OFFERS
     path('joboffers/categories/', JobOffersCategoriesList.as_view(), name='job-offers-categories-list'),                  # list of offer categories
+    path('joboffers/facets/', JobOfferFacets.as_view(), name='job-offers-facets'),
     path('joboffers/', JobOfferList.as_view(), name='job-offers-list'),                                                   
     path('joboffers/<pk>/', JobOfferDetail.as_view(), name='job-offer-detail'),  
 ]
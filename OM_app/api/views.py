@@ -3,26 +3,39 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status, generics
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework.exceptions import ValidationError
+from django.http import FileResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils import timezone
+from datetime import datetime, timedelta
 
 from ..models import *
 from .serializers import *
-from ..chat_utils import get_user_contact
+from . import refdata
+from .authentication import bump_token_version, token_version_changed
+from .filters import IndexedSearchFilter, OfferFilter, JobOfferFilter
+from .mixins import InstrumentedViewMixin, LeanListMixin, NativeRetrieveMixin, ResponseCacheMixin
+from .pagination import KeysetPagination
+from ..chat_utils import (
+    get_user_contact, get_chat_contact_id, get_messages_page, get_inbox, mark_chat_read, notify_chat_changed, MESSAGES_PAGE_SIZE
+)
 
 # emails
-from django.core.mail import EmailMultiAlternatives
 from django.dispatch import receiver
-from django.template.loader import render_to_string
-from django.urls import reverse
 
 from django_rest_passwordreset.signals import reset_password_token_created
 
-from django.core.mail import EmailMultiAlternatives
-from django.dispatch import receiver
-from django.template.loader import render_to_string
-from django.urls import reverse
-
-from django_rest_passwordreset.signals import reset_password_token_created
+from .. import mail_queue
+from .. import bulk
+from .. import favourites
+from .. import facets
+from .. import search
+from .. import repository
+from django_filters.utils import translate_validation
+from django.core.exceptions import ObjectDoesNotExist
 
 
 @receiver(reset_password_token_created)
@@ -38,30 +51,24 @@ def password_reset_token_created(sender, reset_password_token, *args, **kwargs):
     :return:
     """
 
-    # send an e-mail to the user
+    # queue an e-mail to the user, the send_queued_mail worker renders and sends it
     context = {
-        'current_user': reset_password_token.user,
         'username': reset_password_token.user.username,
         'email': reset_password_token.user.email,
         'reset_password_url': "/{}".format(reset_password_token.key)
     }
 
-    # render email text
-    email_html_message = render_to_string('email/user_reset_password.html', context)
-    email_plaintext_message = render_to_string('email/user_reset_password.txt', context)
-
-    msg = EmailMultiAlternatives(
+    mail_queue.enqueue(
         # title:
         "Resetowanie hasła dla {title}".format(title="OnlineMarketplace"),
-        # message:
-        email_plaintext_message,
+        # templates:
+        'email/user_reset_password',
+        context,
         # from:
         "noreply@somehost.local",
         # to:
         [reset_password_token.user.email]
     )
-    msg.attach_alternative(email_html_message, "text/html")
-    msg.send()
 
 # USERS
 
@@ -82,11 +89,18 @@ def delete_user(request):
     if user:
         user_obj = User.objects.get(id=user.id)
         user_obj.delete()
+        token_version_changed(user.id)
 
         return Response(status.HTTP_204_NO_CONTENT)
     else:
         return Response(status.HTTP_400_BAD_REQUEST)
 
+class VersionedTokenObtainPairView(TokenObtainPairView):
+    serializer_class = VersionedTokenObtainPairSerializer
+
+class VersionedTokenRefreshView(TokenRefreshView):
+    serializer_class = VersionedTokenRefreshSerializer
+
 class CurrentUser(generics.GenericAPIView):
 
     def get(self, request, *args, **kwargs):
@@ -121,20 +135,39 @@ class ChangePasswordView(generics.UpdateAPIView):
                 return Response({"old_password": ["Wrong password."]}, status=status.HTTP_400_BAD_REQUEST)
             # set_password hashes the password
             self.object.set_password(serializer.data.get("new_password"))
+            # tokens issued before the change stop working, the client gets a new pair
+            bump_token_version(self.object)
             self.object.save()
-            return Response(status=status.HTTP_200_OK)
+            token_version_changed(self.object.id, self.object.token_version)
+            refresh = VersionedTokenObtainPairSerializer.get_token(self.object)
+            return Response({'refresh': str(refresh), 'access': str(refresh.access_token)}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # VOIVODESHIPS AND CITIES
 
-class VoivodeshipCitiesList(generics.GenericAPIView):
+class ReferenceDataView(generics.GenericAPIView):
     """
-    Get list of voivodeships and cities.
+    Serves a prebuilt payload from `refdata` with a strong ETag, answers 304 when the client has it.
     """
+    reference_data = None
+    max_age = 300
+
     def get(self, request, *args, **kwargs):
-        voivodeships = Voivodeship.objects.all().order_by('name')
-        serializer = VoivodeshipCitiesSerializer(voivodeships, many=True)
-        return Response(serializer.data)
+        payload, etag = refdata.get(self.reference_data)
+        client_etags = [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+        if etag in client_etags or '*' in client_etags:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(payload)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age={}'.format(self.max_age)
+        return response
+
+class VoivodeshipCitiesList(ReferenceDataView):
+    """
+    Get list of voivodeships and cities.
+    """
+    reference_data = 'voivodeships-cities'
 
 class CitiesList(generics.RetrieveAPIView):
     queryset = City.objects.all()
@@ -145,66 +178,150 @@ class CitiesList(generics.RetrieveAPIView):
 
 # OFFERS
 
-class OfferList(generics.ListCreateAPIView):
+class OfferList(ResponseCacheMixin, LeanListMixin, generics.ListCreateAPIView):
     queryset = Offer.objects.all()
     serializer_class = OfferSerializer
+    list_serializer_class = OfferListSerializer
+    pagination_class = KeysetPagination
     
     # filters
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
-    filter_fields = ('city_id', 'user_id', 'category_id')
-    search_fields = ('name',)
+    filter_backends = (DjangoFilterBackend, OrderingFilter, IndexedSearchFilter)
+    filterset_class = OfferFilter   # city, user, category, price range, creation date window
+    search_index = 'offer'  # name, description
+    response_cache_kind = 'offer'
     ordering_fields = ('price', 'creation_date')
 
-class OfferDetail(generics.RetrieveUpdateDestroyAPIView):
+class OfferDetail(NativeRetrieveMixin, InstrumentedViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Offer.objects.all()
     serializer_class = OfferSerializer
 
-class OffersCategoriesList(generics.GenericAPIView):
+class OfferExport(generics.GenericAPIView):
     """
-    Get list of categories of offers.
+    Streams every offer matching OfferList's filters as NDJSON, or CSV with
+    `?output=csv`, oldest modification first. `?since=<ISO datetime>` or an
+    If-Modified-Since header limits it to offers changed after then, the
+    response's Last-Modified is the value to send next time. The header has
+    whole seconds and stands for the end of its second, so an unchanged
+    export answers 304; `since=` compares exactly and sends the offers of
+    that second again. An export stops before the current second, which may
+    still get changes, so every second it names in Last-Modified is over.
+    Deleted offers are not in a delta. The output is spooled before it is
+    sent, see bulk.spool().
     """
+    permission_classes = (IsAuthenticated,)
+    queryset = Offer.objects.all()
+    filter_backends = OfferList.filter_backends
+    filterset_class = OfferList.filterset_class
+    search_index = OfferList.search_index
+    ordering_fields = ('modification_date',)
+    ordering = ('modification_date', 'id')
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv; charset=utf-8',
+    }
+    chunk_size = 2000
+
+    def get_since(self, request):
+        if 'since' in request.query_params:
+            since = parse_datetime(request.query_params['since'])
+            if since is None:
+                raise ValidationError({'since': ['Expected an ISO 8601 date and time.']})
+            return since if timezone.is_aware(since) else timezone.make_aware(since, timezone.utc)
+        timestamp = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if timestamp is not None:
+            # Last-Modified truncated the modification date to this second
+            return datetime.fromtimestamp(timestamp, timezone.utc) + timedelta(microseconds=999999)
+        return None
+
+    def get_until(self):
+        # start of the current second, offers modified from then on go in the next export
+        return timezone.now().replace(microsecond=0)
+
     def get(self, request, *args, **kwargs):
-        categories = OfferCategory.objects.all().order_by('name')
-        serializer = OffersCategoriesSerializer(categories, many=True)
-        return Response(serializer.data)
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.content_types:
+            raise ValidationError({'output': ['Expected one of: {}.'.format(', '.join(self.content_types))]})
+
+        since = self.get_since(request)
+        queryset = self.filter_queryset(self.get_queryset()).filter(modification_date__lt=self.get_until())
+        if since is not None:
+            queryset = queryset.filter(modification_date__gt=since)
+
+        latest = queryset.order_by('-modification_date').values_list('modification_date', flat=True).first()
+        if latest is None and since is not None and 'since' not in request.query_params:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+
+        fields, rows = bulk.export_values('offer', queryset, self.chunk_size)
+        response = FileResponse(
+            bulk.spool(bulk.encode_rows(fields, rows, output)),
+            content_type=self.content_types[output]
+        )
+        response['Content-Disposition'] = 'attachment; filename="offers.{}"'.format(output)
+        if latest is not None:
+            response['Last-Modified'] = http_date(latest.timestamp())
+        return response
+
+class FacetsView(generics.GenericAPIView):
+    """
+    Facet counts of the list view `list_view` for the current filter state,
+    with the same filter parameters (and `search`), see OM_app/facets.py.
+    """
+    list_view = None
+
+    def get_queryset(self):
+        return self.list_view.queryset
+
+    def get(self, request, *args, **kwargs):
+        filterset_class = self.list_view.filterset_class
+        filterset = filterset_class(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+
+        object_ids = None
+        terms = request.query_params.get('search', '').strip()
+        if terms:
+            object_ids = search.search(self.list_view.search_index, terms, limit=None)
+        return Response(facets.count(filterset_class._meta.model, filterset, object_ids))
+
+class OfferFacets(FacetsView):
+    list_view = OfferList
+
+class OffersCategoriesList(ReferenceDataView):
+    """
+    Get list of categories of offers.
+    """
+    reference_data = 'offers-categories'
 
 # JOB OFFERS
-class JobOfferList(generics.ListCreateAPIView):
-    # queryset = JobOffer.objects.all()
+class JobOfferList(ResponseCacheMixin, LeanListMixin, generics.ListCreateAPIView):
+    queryset = JobOffer.objects.all()
     serializer_class = JobOfferSerializer
+    list_serializer_class = JobOfferListSerializer
+    pagination_class = KeysetPagination
     
     # filters
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
-    filter_fields = ('city_id', 'user_id', 'category_id', 'remote')
-    search_fields = ('name', 'company')
+    filter_backends = (DjangoFilterBackend, OrderingFilter, IndexedSearchFilter)
+    filterset_class = JobOfferFilter    # city, user, category, remote, salary range, creation date window
+    search_index = 'joboffer'   # name, company, description
+    response_cache_kind = 'joboffer'
     ordering_fields = ('max_salary', 'creation_date',)
 
-    def get_queryset(self):
-        min_salary_f = self.request.query_params.get('min_salary_f', None)
-        if min_salary_f:
-            try:
-                return JobOffer.objects.filter(min_salary__gte=min_salary_f)
-            except:
-                return JobOffer.objects.all()
-        
-        return JobOffer.objects.all()
+class JobOfferFacets(FacetsView):
+    list_view = JobOfferList
 
-class JobOfferDetail(generics.RetrieveUpdateDestroyAPIView):
+class JobOfferDetail(NativeRetrieveMixin, InstrumentedViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = JobOffer.objects.all()
     serializer_class = JobOfferSerializer
 
-class JobOffersCategoriesList(generics.GenericAPIView):
+class JobOffersCategoriesList(ReferenceDataView):
     """
     Get list of categories of job offers.
     """
-    def get(self, request, *args, **kwargs):
-        categories = JobOfferCategory.objects.all().order_by('name')
-        serializer = JobOffersCategoriesSerializer(categories, many=True)
-        return Response(serializer.data)
+    reference_data = 'job-offers-categories'
 
 # CHAT
 
-class ChatListView(generics.ListAPIView):
+class ChatListView(InstrumentedViewMixin, generics.ListAPIView):
     serializer_class = ChatSerializer
     permission_classes = (IsAuthenticated, )
 
@@ -218,10 +335,41 @@ class ChatListView(generics.ListAPIView):
         return queryset
 
 
-class ChatDetailView(generics.RetrieveAPIView):
+class ChatInboxView(generics.GenericAPIView):
+    """
+    Chats of the current user with participants, last message preview and unread count.
+    """
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_inbox(request.user.id))
+
+class ChatDetailView(InstrumentedViewMixin, generics.RetrieveAPIView):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
 
+class ChatMessagesView(generics.GenericAPIView):
+    """
+    Chat history, newest first. `?before=<message id>&limit=` reads older pages.
+    """
+    serializer_class = MessageSerializer
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request, pk, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('limit', MESSAGES_PAGE_SIZE))
+        except ValueError:
+            return Response({'limit': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        contact_id = get_chat_contact_id(request.user.id, pk)
+        if contact_id is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        before = request.query_params.get('before')
+        if not before:
+            mark_chat_read(pk, contact_id)
+        messages, before = get_messages_page(pk, before, limit)
+        serializer = self.get_serializer(messages, many=True)
+        return Response({'messages': serializer.data, 'before': before})
+
 class ChatCreateView(generics.CreateAPIView):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
@@ -232,91 +380,79 @@ class ChatUpdateView(generics.UpdateAPIView):
     serializer_class = ChatSerializer
     permission_classes = (IsAuthenticated, )
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        notify_chat_changed(serializer.instance.pk)
+
 class ChatDeleteView(generics.DestroyAPIView):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
     permission_classes = (IsAuthenticated, )
 
+    def perform_destroy(self, instance):
+        chat_id = instance.pk
+        super().perform_destroy(instance)
+        notify_chat_changed(chat_id)
+
 # favourites
 
-class FavouriteOffersView(generics.ListAPIView):
+class FavouriteOffersView(InstrumentedViewMixin, generics.ListAPIView):
     serializer_class = OfferSerializer
     permission_classes = (IsAuthenticated, )
+    pagination_class = KeysetPagination
 
-    def get_queryset(self):
-        user_id = self.request.user.id
-        favourites = FavouriteOffer.objects.filter(user_id=user_id)
-
-        queryset = []
-        for obj in favourites:
-            queryset.append(obj.offer_id)
+    filter_backends = (OrderingFilter,)
+    ordering_fields = ('price', 'creation_date')
 
-        return queryset
+    def get_queryset(self):
+        # the cached id set, then one query for the offers, whatever the number of favourites
+        ids = favourites.favourite_ids('offer', self.request.user.id)
+        if repository.enabled():
+            return repository.favourites(Offer, ids)
+        return Offer.objects.filter(id__in=list(ids))
 
-class FavouriteJobOffersView(generics.ListAPIView):
+class FavouriteJobOffersView(InstrumentedViewMixin, generics.ListAPIView):
     serializer_class = JobOfferSerializer
     permission_classes = (IsAuthenticated, )
+    pagination_class = KeysetPagination
 
-    def get_queryset(self):
-        user_id = self.request.user.id
-        favourites = FavouriteJobOffer.objects.filter(user_id=user_id)
-
-        queryset = []
-        for obj in favourites:
-            queryset.append(obj.job_offer_id)
+    filter_backends = (OrderingFilter,)
+    ordering_fields = ('max_salary', 'creation_date')
 
-        return queryset
+    def get_queryset(self):
+        ids = favourites.favourite_ids('joboffer', self.request.user.id)
+        if repository.enabled():
+            return repository.favourites(JobOffer, ids)
+        return JobOffer.objects.filter(id__in=list(ids))
 
 @api_view(['POST','DELETE'])
 def offer_to_favourites(request):
-
-    if request.method == 'POST':
-        serializer = FavouriteOfferSerialzier(data=request.data)
-
-        # check if the offer is already in favourites
-        favourites_offers = FavouriteOffer.objects.filter(user_id=request.data["user_id"], offer_id=request.data["offer_id"])
-
-
-        if serializer.is_valid() and not favourites_offers:
-            serializer.save()
-            return Response(status.HTTP_200_OK)
-        return Response(status.HTTP_400_BAD_REQUEST)
-
-    elif request.method == 'DELETE':
-
-        obj_id = request.query_params.get('offer_id', None)
-
-        try:
-            obj = FavouriteOffer.objects.get(offer_id=obj_id, user_id=request.user.id)
-        except FavouriteOffer.DoesNotExist:
-            return Response(status.HTTP_404_NOT_FOUND)
-        
-        obj.delete()
-        return Response(status.HTTP_204_NO_CONTENT)
+    return toggle_favourite(request, 'offer', 'offer_id')
 
 @api_view(['POST','DELETE'])
 def joboffer_to_favourites(request):
+    return toggle_favourite(request, 'joboffer', 'job_offer_id')
 
+def toggle_favourite(request, kind, id_param):
+    """
+    POST adds the favourite of the authenticated user (idempotent), DELETE removes it.
+    """
     if request.method == 'POST':
-        serializer = FavouriteJobOfferSerialzier(data=request.data)
-
-        # check if the job offer is already in favourites
-        favourites_joboffers = FavouriteJobOffer.objects.filter(user_id=request.data["user_id"], job_offer_id=request.data["job_offer_id"])
-
-        if serializer.is_valid() and not favourites_joboffers:
-            serializer.save()
-            return Response(status.HTTP_200_OK)
+        object_id = request.data.get(id_param)
+    else:
+        object_id = request.query_params.get(id_param, None)
+    try:
+        object_id = int(object_id)
+    except (TypeError, ValueError):
         return Response(status.HTTP_400_BAD_REQUEST)
 
-    elif request.method == 'DELETE':
-
-        obj_id = request.query_params.get('job_offer_id', None)
-        user_id = request.user.id
-
+    if request.method == 'POST':
         try:
-            obj = FavouriteJobOffer.objects.get(job_offer_id = obj_id, user_id=request.user.id)
-        except FavouriteOffer.DoesNotExist:
-            return Response(status.HTTP_404_NOT_FOUND)
-        
-        obj.delete()
-        return Response(status.HTTP_204_NO_CONTENT)
+            favourites.add(kind, request.user.id, object_id)
+        except ObjectDoesNotExist:
+            return Response(status.HTTP_400_BAD_REQUEST)
+        return Response(status.HTTP_200_OK)
+
+    if not favourites.remove(kind, request.user.id, object_id):
+        return Response(status.HTTP_404_NOT_FOUND)
+    return Response(status.HTTP_204_NO_CONTENT)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class OmAppConfig(AppConfig):
     name = 'OM_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import mongo_pool
+        mongo_pool.install()
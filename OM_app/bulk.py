@@ -0,0 +1,220 @@
+"""
+Streaming bulk import and export of offers and job offers (CSV or NDJSON).
+
+Imports are read row by row and validated in chunks with the API serializers;
+the users a chunk refers to are loaded with one query instead of one per row.
+Valid rows of a chunk go to the database with a single bulk_create, with ids
+reserved up front so the chunk can be added to the search index, invalid
+ones are reported with their line number and do not stop the import.
+Exports iterate a database cursor in chunks. Neither direction keeps more
+than one chunk in memory; the HTTP export spools its output to a temporary
+file first, see spool().
+"""
+import csv
+import json
+import tempfile
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import serializers
+
+from . import response_cache, search
+from .api.serializers import OfferSerializer, JobOfferSerializer
+from .models import Offer, JobOffer, User
+from .mongo import reserve_ids
+
+FORMATS = ('csv', 'ndjson')
+
+
+class ChunkUserField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves the user from the chunk's prefetched users instead of a query per row.
+    """
+    def to_internal_value(self, data):
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        user = self.context['users'].get(pk)
+        if user is None:
+            self.fail('does_not_exist', pk_value=data)
+        return user
+
+
+class OfferImportSerializer(OfferSerializer):
+    user_id = ChunkUserField(queryset=User.objects.all())
+    image_variants = None
+
+    class Meta(OfferSerializer.Meta):
+        fields = ('user_id', 'city_id', 'category_id', 'name', 'price', 'description')
+
+
+class JobOfferImportSerializer(JobOfferSerializer):
+    user_id = ChunkUserField(queryset=User.objects.all())
+
+    class Meta(JobOfferSerializer.Meta):
+        fields = ('user_id', 'city_id', 'category_id', 'name', 'min_salary', 'max_salary', 'description', 'company', 'remote')
+
+
+# kind: (model, import serializer, exported fields)
+KINDS = {
+    'offer': (Offer, OfferImportSerializer, ('id', 'creation_date', 'modification_date') + OfferImportSerializer.Meta.fields),
+    'joboffer': (JobOffer, JobOfferImportSerializer, ('id', 'creation_date') + JobOfferImportSerializer.Meta.fields),
+}
+
+
+def read_rows(stream, format):
+    """
+    (line number, row dict) pairs; empty CSV cells are left out so model defaults apply.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key and value != ''}
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = e
+        yield line_number, row
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_chunk(serializer_class, rows):
+    """
+    Returns ([model kwargs], [(line number, errors)]) for a chunk of (line number, row).
+    """
+    user_ids = set()
+    for _, row in rows:
+        try:
+            user_ids.add(int(row['user_id']))
+        except (TypeError, ValueError, KeyError):
+            pass    # reported by the serializer
+    context = {'users': User.objects.in_bulk(list(user_ids))}
+
+    # one serializer per chunk, building its fields costs more than validating a row
+    serializer = serializer_class(context=context)
+    valid, errors = [], []
+    for line_number, row in rows:
+        if not isinstance(row, dict):
+            errors.append((line_number, {'non_field_errors': ['Invalid JSON object: {}'.format(row)]}))
+            continue
+        try:
+            valid.append(serializer.run_validation(row))
+        except serializers.ValidationError as e:
+            errors.append((line_number, e.detail))
+    return valid, errors
+
+
+def import_rows(kind, stream, format, batch_size=1000, on_error=None, index=True):
+    """
+    Import a stream, calling `on_error(line number, errors)` for rejected rows.
+    Returns {'created', 'rejected', 'seconds', 'rows_per_sec'}.
+    """
+    model, serializer_class, _ = KINDS[kind]
+    created = rejected = 0
+    start = time.perf_counter()
+    for chunk in chunks(read_rows(stream, format), batch_size):
+        valid, errors = validate_chunk(serializer_class, chunk)
+        if valid:
+            # djongo's bulk_create does not return the ids, the search index needs them
+            first = reserve_ids(model, len(valid))
+            objects = [model(id=first + i, **data) for i, data in enumerate(valid)]
+            model.objects.bulk_create(objects, batch_size=batch_size)
+            if index:
+                search.index_new_objects(kind, objects, batch_size)
+        created += len(valid)
+        rejected += len(errors)
+        if on_error is not None:
+            for line_number, row_errors in errors:
+                on_error(line_number, row_errors)
+
+    if created:
+        response_cache.invalidate(kind)     # bulk_create skips the model signals
+    return stats(created, start, rejected=rejected)
+
+
+def export_values(kind, queryset=None, batch_size=2000):
+    """
+    (field names, iterator of value tuples) of `queryset`, all rows of `kind` by default.
+    """
+    model, _, fields = KINDS[kind]
+    if queryset is None:
+        queryset = model.objects.order_by('id')
+    columns = [field + '_id' if field == 'user_id' else field for field in fields]
+    return fields, queryset.values_list(*columns).iterator(chunk_size=batch_size)
+
+
+SPOOL_MEMORY = 8 * 1024 * 1024     # bytes kept in memory before spooling to disk
+
+
+def spool(lines):
+    """
+    Binary file, rewound, holding the encoded `lines`. The ASGI handler
+    iterates streaming responses in the event loop: the cursor is read here,
+    in the view's thread, and the loop only reads the file.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+    for line in lines:
+        output.write(line.encode('utf-8'))
+    output.seek(0)
+    return output
+
+
+class Echo:
+    """
+    File-like object for csv.writer that hands the written line back.
+    """
+    def write(self, value):
+        return value
+
+
+def encode_rows(fields, rows, format):
+    """
+    Lines of CSV, header first, or NDJSON objects for value tuples in `fields` order.
+    """
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for values in rows:
+            yield writer.writerow(values)
+        return
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for values in rows:
+        yield encoder.encode(dict(zip(fields, values))) + '\n'
+
+
+def export_rows(kind, stream, format, queryset=None, batch_size=2000):
+    """
+    Write every row of `queryset` (all of `kind` by default) to the stream.
+    Returns {'exported', 'seconds', 'rows_per_sec'}.
+    """
+    fields, rows = export_values(kind, queryset, batch_size)
+    exported = -1 if format == 'csv' else 0     # not counting the header
+    start = time.perf_counter()
+    for line in encode_rows(fields, rows, format):
+        stream.write(line)
+        exported += 1
+    return stats(exported, start, key='exported')
+
+
+def stats(count, start, key='created', **extra):
+    seconds = time.perf_counter() - start
+    return dict({
+        key: count,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(count / seconds, 1) if seconds else None,
+    }, **extra)
@@ -1,9 +1,50 @@
+from datetime import datetime
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import DatabaseError
+from django.db.models import Q
+from django.http import Http404
 from django.shortcuts import render, get_object_or_404
-from .models import Chat, Contact, User
+from django.utils import timezone
+from .models import Chat, ChatReadMarker, Contact, Message, User
+from .mongo import get_collection
+from . import repository
+
+INBOX_PREVIEW_LENGTH = 100
 
-def get_last_10_messages(chatId):
-    chat = get_object_or_404(Chat, id=chatId)
-    return chat.messages.order_by('-timestamp').all()[:10]
+MESSAGES_PAGE_SIZE = 10
+MESSAGES_MAX_PAGE_SIZE = 100
+
+def get_messages_page(chatId, before=None, limit=MESSAGES_PAGE_SIZE):
+    """
+    Newest `limit` messages of the chat older than the message with id `before`,
+    and the `before` cursor of the next page (None on the last one).
+    Reads a (chat, timestamp) index range, so the cost does not grow with the history.
+    """
+    limit = max(1, min(int(limit), MESSAGES_MAX_PAGE_SIZE))
+    if repository.enabled():
+        try:
+            chatId = int(chatId)
+            before = int(before) if before else None
+        except (TypeError, ValueError):
+            raise Http404
+        messages = repository.messages_page(chatId, before, limit)
+        if messages is None:
+            raise Http404
+        return messages, messages[-1]['id'] if len(messages) == limit else None
+    messages = Message.objects.filter(chat_id=chatId).select_related('contact')
+    if before:
+        try:
+            before = int(before)
+        except (TypeError, ValueError):
+            raise Http404
+        timestamp = Message.objects.filter(id=before, chat_id=chatId).values_list('timestamp', flat=True).first()
+        if timestamp is None:
+            raise Http404
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=before))
+    messages = list(messages.order_by('-timestamp', '-id')[:limit])
+    return messages, messages[-1].id if len(messages) == limit else None
 
 
 def get_user_contact(user_id):  # if contact does not exists create
@@ -27,3 +68,104 @@ def create_chat_contact(user_id_username): # if contact does not exists create
 
 def get_current_chat(chatId):
     return get_object_or_404(Chat, id=chatId)
+
+
+def get_chat_contact_id(user_id, chatId):
+    """
+    Id of the user's contact if they take part in the chat, else None.
+    """
+    contact_id = Contact.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+    if contact_id is None:
+        return None
+    membership = Chat.participants.through.objects.filter(chat_id=chatId, contact_id=contact_id)
+    return contact_id if membership.exists() else None
+
+
+def notify_chat_changed(chatId):
+    """
+    Tell the consumers connected to the chat to resolve their membership again.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)('chat_%s' % chatId, {'type': 'chat_membership'})
+
+
+def mark_chat_read(chatId, contact_id):
+    now = timezone.now()
+    try:
+        ChatReadMarker.objects.update_or_create(chat_id=chatId, contact_id=contact_id, defaults={'last_read': now})
+    except DatabaseError:
+        # another connection created the marker after our lookup; djongo reports
+        # the duplicate key as a DatabaseError, not only as an IntegrityError
+        if not ChatReadMarker.objects.filter(chat_id=chatId, contact_id=contact_id).update(last_read=now):
+            raise
+
+
+def get_inbox(user_id):
+    """
+    Chats of the user with their participants, last message and unread count,
+    newest activity first. Runs the same number of queries for any number of
+    chats and participants: five ORM queries and two aggregations.
+    """
+    contact_id = Contact.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+    if contact_id is None:
+        return []
+    through = Chat.participants.through
+    chat_ids = list(through.objects.filter(contact_id=contact_id).values_list('chat_id', flat=True))
+    if not chat_ids:
+        return []
+
+    participants = {}
+    for chat_id, participant_id in through.objects.filter(chat_id__in=chat_ids).values_list('chat_id', 'contact_id'):
+        participants.setdefault(chat_id, []).append(participant_id)
+    contact_users = dict(Contact.objects.filter(
+        id__in={participant_id for ids in participants.values() for participant_id in ids}
+    ).values_list('id', 'user_id'))
+    usernames = dict(User.objects.filter(id__in=set(contact_users.values())).values_list('id', 'username'))
+    last_read = dict(ChatReadMarker.objects.filter(contact_id=contact_id, chat_id__in=chat_ids).values_list('chat_id', 'last_read'))
+
+    messages = get_collection(Message)
+    last_messages = {
+        row['_id']: row for row in messages.aggregate([
+            {'$match': {'chat_id': {'$in': chat_ids}}},
+            {'$sort': {'chat_id': 1, 'timestamp': -1, 'id': -1}},
+            {'$group': {
+                '_id': '$chat_id',
+                'id': {'$first': '$id'},
+                'contact_id': {'$first': '$contact_id'},
+                'content': {'$first': '$content'},
+                'timestamp': {'$first': '$timestamp'},
+            }},
+        ])
+    }
+    unread_filter = [{'chat_id': chat_id, 'timestamp': {'$gt': read}} for chat_id, read in last_read.items()]
+    never_read = [chat_id for chat_id in chat_ids if chat_id not in last_read]
+    if never_read:
+        unread_filter.append({'chat_id': {'$in': never_read}})
+    unread = {
+        row['_id']: row['count'] for row in messages.aggregate([
+            {'$match': {'$or': unread_filter, 'contact_id': {'$ne': contact_id}}},
+            {'$group': {'_id': '$chat_id', 'count': {'$sum': 1}}},
+        ])
+    }
+
+    inbox = []
+    for chat_id in chat_ids:
+        last = last_messages.get(chat_id)
+        inbox.append({
+            'id': chat_id,
+            'participants': [
+                {'id': contact_users.get(participant_id), 'username': usernames.get(contact_users.get(participant_id))}
+                for participant_id in participants.get(chat_id, [])
+            ],
+            'last_message': last and {
+                'id': last['id'],
+                'author': contact_users.get(last['contact_id']),
+                'content': last['content'][:INBOX_PREVIEW_LENGTH],
+                'timestamp': timezone.make_aware(last['timestamp'], timezone.utc),   # pymongo returns naive UTC
+            },
+            'unread': unread.get(chat_id, 0),
+        })
+    oldest = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    inbox.sort(key=lambda chat: chat['last_message']['timestamp'] if chat['last_message'] else oldest, reverse=True)
+    return inbox
@@ -0,0 +1,319 @@
+"""
+Write-behind persistence of chat messages.
+
+Consumers broadcast a new message right away and hand it to MessageWriter,
+which queues it and appends it to a journal file. A background thread
+stores queued messages with one bulk_create as soon as BATCH_SIZE of them
+are waiting or FLUSH_INTERVAL seconds have passed. A failed flush is retried
+MAX_ATTEMPTS times with backoff, then its messages are stored one by one and
+the ones that still fail go to a dead-letter file, so one bad message cannot
+hold back the others nor close(). Until stored the messages stay in the
+journal, which `recover` replays after a crash; `recover_chat_journal
+--dead-letters` replays the dead letters. `client_id` makes replays idempotent.
+
+Message ids are reserved from djongo's auto increment counter in blocks of
+ID_BLOCK, so a message is broadcast with the id it is stored and paged under.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .models import Message
+from .mongo import reserve_ids
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 0.2,    # seconds
+    'MAX_QUEUE': 10000,
+    'MAX_ATTEMPTS': 8,        # of a failed flush before its messages are stored one by one
+    'MAX_BACKOFF': 5.0,       # seconds between retries of a failed flush
+    'JOURNAL_DIR': None,      # no journal, queued messages die with the process
+    'DEAD_LETTER_DIR': None,  # JOURNAL_DIR when None; without either dead letters are only logged
+    'FSYNC': False,
+    'ID_BLOCK': 100,          # message ids reserved at once
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CHAT_WRITE_BEHIND', {}))
+    return config
+
+
+def store(records):
+    """
+    Insert the records that are not stored yet, returns how many were inserted.
+    """
+    client_ids = [record['client_id'] for record in records]
+    existing = set(Message.objects.filter(client_id__in=client_ids).values_list('client_id', flat=True))
+
+    messages = []
+    for record in records:
+        if record['client_id'] in existing:
+            continue
+        existing.add(record['client_id'])
+        messages.append(Message(
+            id=record.get('id'),    # None in journals written before ids were reserved
+            client_id=record['client_id'],
+            contact_id=record['contact_id'],
+            chat_id=record['chat_id'],
+            content=record['content'],
+            timestamp=parse_datetime(record['timestamp']),
+        ))
+    Message.objects.bulk_create(messages)
+    return len(messages)
+
+
+def recover(journal_dir, batch_size=DEFAULTS['BATCH_SIZE'], pattern='messages-*.ndjson'):
+    """
+    Store the messages left in journals of dead writers, returns how many were stored.
+    Journals still locked by a running writer are skipped.
+    """
+    stored = 0
+    for path in sorted(glob.glob(os.path.join(journal_dir, pattern))):
+        with open(path, 'r+') as journal:
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            records = []
+            for line in journal:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning('Skipping damaged line in %s', path)   # torn last write
+            for start in range(0, len(records), batch_size):
+                stored += store(records[start:start + batch_size])
+            os.unlink(path)
+    return stored
+
+
+class MessageWriter:
+
+    def __init__(self, batch_size, flush_interval, max_queue, max_backoff, journal_dir=None, fsync=False,
+                 max_attempts=DEFAULTS['MAX_ATTEMPTS'], dead_letter_dir=None, id_block=DEFAULTS['ID_BLOCK']):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.fsync = fsync
+        self.queue = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.id_lock = threading.Lock()
+        self.ids = iter(())
+        self.id_block = id_block
+        self.dead_letter_dir = dead_letter_dir or journal_dir
+        self.dead_letters = None
+        self.thread = None
+        self.closed = False
+        self.journal = None
+        self.journaled = False
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+            path = os.path.join(journal_dir, 'messages-{}.ndjson'.format(os.getpid()))
+            self.journal = open(path, 'a')
+            fcntl.flock(self.journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.stats = {
+            'flushes': 0,
+            'flushed_messages': 0,
+            'flush_failures': 0,
+            'dead_lettered': 0,
+            'last_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0,
+        }
+
+    def next_id(self, block=True):
+        """
+        Id to store the next message under. Taking a new block of ids is a
+        database round trip: None then when `block` is False.
+        """
+        if not self.id_lock.acquire(blocking=block):
+            return None
+        try:
+            message_id = next(self.ids, None)
+            if message_id is None and block:
+                first = reserve_ids(Message, self.id_block)
+                self.ids = iter(range(first, first + self.id_block))
+                message_id = next(self.ids)
+            return message_id
+        finally:
+            self.id_lock.release()
+
+    def put(self, record, block=True):
+        """
+        Queue a record: dict with id (of next_id()), client_id, contact_id, chat_id, content and an ISO timestamp.
+        Raises queue.Full when `block` is False and the queue is full.
+        """
+        self.start()
+        while True:
+            # never wait for room while holding the lock, checkpoint() needs it
+            with self.lock:
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    if not block:
+                        raise
+                else:
+                    self.write_journal(record)
+                    return
+            time.sleep(self.flush_interval / 10)
+
+    def write_journal(self, record):
+        if self.journal is None:
+            return
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+        self.journaled = True
+
+    def start(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name='chat-writer', daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while not self.closed:
+            batch = self.collect()
+            if batch:
+                self.flush(batch)
+            self.checkpoint()
+
+    def collect(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch):
+        start = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            try:
+                stored = store(batch)
+                break
+            except Exception:
+                logger.exception('Storing %d chat messages failed', len(batch))
+                self.stats['flush_failures'] += 1
+                close_old_connections()
+                if attempt + 1 < self.max_attempts:
+                    time.sleep(min(self.max_backoff, 0.05 * 2 ** attempt))
+        else:
+            stored = self.store_each(batch)
+        elapsed = time.perf_counter() - start
+        self.stats['flushes'] += 1
+        self.stats['flushed_messages'] += stored
+        self.stats['last_flush_seconds'] = elapsed
+        self.stats['total_flush_seconds'] += elapsed
+
+    def store_each(self, batch):
+        """
+        Store the records of a batch that keeps failing one by one, dead-letter the ones that fail.
+        """
+        stored = 0
+        for record in batch:
+            try:
+                stored += store([record])
+            except Exception as e:
+                close_old_connections()
+                self.dead_letter(record, e)
+        return stored
+
+    def dead_letter(self, record, error):
+        logger.error('Dead-lettering chat message %s: %r', record['client_id'], error)
+        self.stats['dead_lettered'] += 1
+        if self.dead_letter_dir is None:
+            logger.error('Dead chat message: %s', json.dumps(record))
+            return
+        if self.dead_letters is None:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            path = os.path.join(self.dead_letter_dir, 'dead-letters-{}.ndjson'.format(os.getpid()))
+            self.dead_letters = open(path, 'a')
+            fcntl.flock(self.dead_letters, fcntl.LOCK_EX | fcntl.LOCK_NB)   # recover() skips it meanwhile
+        self.dead_letters.write(json.dumps(record) + '\n')
+        self.dead_letters.flush()
+        os.fsync(self.dead_letters.fileno())
+
+    def checkpoint(self):
+        """
+        Everything journaled is stored once the queue drained, start the journal over.
+        """
+        if self.journal is None or not self.journaled:
+            return
+        with self.lock:
+            if self.queue.empty():
+                self.journal.seek(0)
+                self.journal.truncate()
+                self.journaled = False
+
+    def close(self):
+        self.closed = True
+        if self.thread is not None:
+            self.thread.join()
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get())
+        if batch:
+            self.flush(batch)
+        self.checkpoint()
+
+    def metrics(self):
+        return dict(self.stats, queue_depth=self.queue.qsize())
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """
+    Process wide writer. Creating it replays journals left behind by crashed
+    processes, so call it outside of the event loop.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = get_config()
+                if config['JOURNAL_DIR']:
+                    recovered = recover(config['JOURNAL_DIR'], config['BATCH_SIZE'])
+                    if recovered:
+                        logger.info('Recovered %d chat messages from journals', recovered)
+                _writer = MessageWriter(
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    max_queue=config['MAX_QUEUE'],
+                    max_backoff=config['MAX_BACKOFF'],
+                    journal_dir=config['JOURNAL_DIR'],
+                    fsync=config['FSYNC'],
+                    max_attempts=config['MAX_ATTEMPTS'],
+                    dead_letter_dir=config['DEAD_LETTER_DIR'],
+                    id_block=config['ID_BLOCK'],
+                )
+                atexit.register(_writer.close)
+                metrics.register_gauges('om_chat_writer', _writer.metrics)
+    return _writer
@@ -1,33 +1,45 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+from django.http import Http404
+from django.utils import timezone
 import json
+import queue
+import uuid
 
 from .models import Message, Chat, Contact, User
-from .chat_utils import get_last_10_messages, get_user_contact, get_current_chat
+from .chat_utils import (
+    get_messages_page, get_user_contact, get_current_chat, get_chat_contact_id, mark_chat_read, MESSAGES_PAGE_SIZE
+)
+from .chat_writer import get_writer
 
-class ChatConsumer(WebsocketConsumer):
+class MessageJsonMixin:
 
-    def fetch_messages(self, data):
-        messages = get_last_10_messages(data['chatId'])
-        content = {
+    def history_to_json(self, chat_id, data):
+        """
+        `messages` content for a fetch_messages command, `before` is the cursor of the next (older) page.
+        An invalid `limit` or unknown `before` gets an `error` content instead, the connection stays open.
+        """
+        try:
+            limit = int(data.get('limit', MESSAGES_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return self.error_to_json('fetch_messages', {'limit': ['A valid integer is required.']})
+        try:
+            messages, before = get_messages_page(chat_id, data.get('before'), limit)
+        except Http404:
+            return self.error_to_json('fetch_messages', {'before': ['Not found.']})
+        return {
             'command': 'messages',
-            'messages': self.messages_to_json(messages)
+            'messages': self.messages_to_json(messages),
+            'before': before
         }
-        self.send_message(content)
 
-    def new_message(self, data):
-        user_contact = get_user_contact(data['from']) # from is user id
-        message = Message.objects.create(
-            contact=user_contact,
-            content=data['message'])
-        current_chat = get_current_chat(data['chatId'])
-        current_chat.messages.add(message)
-        current_chat.save()
-        content = {
-            'command': 'new_message',
-            'message': self.message_to_json(message)
+    def error_to_json(self, command, errors):
+        return {
+            'command': 'error',
+            'request': command,
+            'errors': errors
         }
-        return self.send_chat_message(content)
 
     def messages_to_json(self, messages):
         result = []
@@ -38,11 +50,32 @@ class ChatConsumer(WebsocketConsumer):
     def message_to_json(self, message):
         return {
             'id': message.id,
+            'clientId': message.client_id,
             'author': message.contact.user_id,
             'content': message.content,
             'timestamp': str(message.timestamp)
         }
 
+class ChatConsumer(MessageJsonMixin, WebsocketConsumer):
+
+    def fetch_messages(self, data):
+        content = self.history_to_json(data['chatId'], data)
+        self.send_message(content)
+
+    def new_message(self, data):
+        user_contact = get_user_contact(data['from']) # from is user id
+        current_chat = get_current_chat(data['chatId'])
+        message = Message.objects.create(
+            contact=user_contact,
+            chat=current_chat,
+            client_id=data.get('clientId') or uuid.uuid4().hex,
+            content=data['message'])
+        content = {
+            'command': 'new_message',
+            'message': self.message_to_json(message)
+        }
+        return self.send_chat_message(content)
+
     commands = {
     'fetch_messages': fetch_messages,
     'new_message': new_message
@@ -82,3 +115,115 @@ class ChatConsumer(WebsocketConsumer):
     def chat_message(self, event):
         message = event['message']
         self.send(text_data=json.dumps(message))
+
+class AsyncChatConsumer(MessageJsonMixin, AsyncWebsocketConsumer):
+    """
+    ChatConsumer protocol on the event loop. fetch_messages does its ORM work
+    in a single database_sync_to_async call; new_message is broadcast at once
+    and stored by the write-behind writer (OM_app/chat_writer.py), with the
+    id the writer reserved for it: the id history pages return and `before`
+    takes.
+
+    The sender and the chat come from the connection: scope['user'] and the
+    room, checked once on connect and again when the participants change.
+    The `from` and `chatId` fields of the commands are ignored.
+    """
+
+    async def fetch_messages(self, data):
+        content = await database_sync_to_async(self.load_history)(data)
+        await self.send_message(content)
+
+    def load_history(self, data):
+        if not data.get('before'):
+            mark_chat_read(self.chat_id, self.contact_id)
+        return self.history_to_json(self.chat_id, data)
+
+    async def new_message(self, data):
+        # broadcast first, the write-behind queue stores the message later
+        timestamp = timezone.now()
+        message_id = self.writer.next_id(block=False)
+        if message_id is None:
+            message_id = await database_sync_to_async(self.writer.next_id)()
+        record = {
+            'id': message_id,
+            'client_id': str(data.get('clientId') or uuid.uuid4().hex)[:64],
+            'user_id': self.user_id,
+            'contact_id': self.contact_id,
+            'chat_id': self.chat_id,
+            'content': data['message'],
+            'timestamp': timestamp.isoformat(),
+        }
+        try:
+            self.writer.put(record, block=False)
+        except queue.Full:
+            await sync_to_async(self.writer.put)(record)
+        content = {
+            'command': 'new_message',
+            'message': {
+                'id': record['id'],
+                'clientId': record['client_id'],
+                'author': record['user_id'],
+                'content': record['content'],
+                'timestamp': str(timestamp)
+            }
+        }
+        await self.send_chat_message(content)
+
+    commands = {
+    'fetch_messages': fetch_messages,
+    'new_message': new_message
+    }
+
+    async def connect(self):
+        self.writer = await database_sync_to_async(get_writer)()
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        self.room_group_name = 'chat_%s' % self.room_name
+
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated or not self.room_name.isdigit():
+            await self.close()
+            return
+        self.user_id = user.id
+        self.chat_id = int(self.room_name)
+        self.contact_id = await database_sync_to_async(get_chat_contact_id)(self.user_id, self.chat_id)
+        if self.contact_id is None:
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
+        )
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            self.room_group_name,
+            self.channel_name
+        )
+
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        await self.commands[data['command']](self, data)
+
+    async def send_chat_message(self, message):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_message',
+                'message': message
+            }
+        )
+
+    async def send_message(self, message):
+        await self.send(text_data=json.dumps(message))
+
+    async def chat_message(self, event):
+        message = event['message']
+        await self.send(text_data=json.dumps(message))
+
+    async def chat_membership(self, event):
+        # participants changed (ChatUpdateView/ChatDeleteView)
+        self.contact_id = await database_sync_to_async(get_chat_contact_id)(self.user_id, self.chat_id)
+        if self.contact_id is None:
+            await self.close()
@@ -0,0 +1,80 @@
+"""
+Facet counts for the offer and job offer filter sidebars.
+
+All counts of a filter state come from one MongoDB aggregation: a $match of
+the filters that do not restrict a facet, then one $facet branch per facet
+field. A branch also matches the other facets' filters but not its own, so
+selecting a category still shows the counts of the other categories.
+Voivodeship counts are summed from the city counts. Results are cached for
+CACHE_TTL seconds per filter state, so they are counted on the primary.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from . import geo
+from .mongo import get_collection, column
+
+CACHE_TTL = 30      # seconds
+NOT_FACETS = ('user_id',)
+
+
+def facet_fields(filterset):
+    """
+    The view's filter fields that make sense as facets.
+    """
+    return [name for name in filterset._meta.fields if name not in NOT_FACETS]
+
+
+def cache_key(model, data):
+    raw = json.dumps(sorted(data.items()), default=str, separators=(',', ':'))
+    return 'facets:{}:{}'.format(model._meta.model_name, hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def build_pipeline(model, fields, conditions):
+    common = [condition for field, condition in conditions if field not in fields]
+    pipeline = [{'$match': {'$and': common}}] if common else []
+
+    def branch(excluded, *stages):
+        matches = [condition for field, condition in conditions if field in fields and field != excluded]
+        return ([{'$match': {'$and': matches}}] if matches else []) + list(stages)
+
+    facets = {'total': branch(None, {'$count': 'count'})}
+    for field in fields:
+        facets[field] = branch(field, {'$group': {'_id': '$' + column(model, field), 'count': {'$sum': 1}}})
+    pipeline.append({'$facet': facets})
+    return pipeline
+
+
+def count(model, filterset, object_ids=None):
+    """
+    {'total': n, <facet field>: {value: count}, 'voivodeship_id': {id: count}} for a
+    validated filterset, `object_ids` narrows it further (search results).
+    """
+    data = dict(filterset.form.cleaned_data, _ids=sorted(object_ids) if object_ids is not None else None)
+    key = cache_key(model, data)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    fields = facet_fields(filterset)
+    conditions = filterset.mongo_conditions()
+    if object_ids is not None:
+        conditions.append((None, {'id': {'$in': sorted(object_ids)}}))
+    row = next(get_collection(model).aggregate(build_pipeline(model, fields, conditions)))
+
+    total = row['total'][0]['count'] if row['total'] else 0
+    result = {'total': total}
+    for field in fields:
+        result[field] = {group['_id']: group['count'] for group in row[field] if group['_id'] is not None}
+    if 'city_id' in fields:
+        voivodeships = {}
+        for city_id, city_count in result['city_id'].items():
+            voivodeship_id = geo.voivodeship_of(city_id)
+            if voivodeship_id is not None:
+                voivodeships[voivodeship_id] = voivodeships.get(voivodeship_id, 0) + city_count
+        result['voivodeship_id'] = voivodeships
+
+    cache.set(key, result, CACHE_TTL)
+    return result
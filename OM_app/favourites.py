@@ -0,0 +1,94 @@
+"""
+Favourite offers and job offers.
+
+Every offer/job offer keeps a `favourite_count`, changed with an atomic
+$inc by the FavouriteOffer/FavouriteJobOffer signals (see OM_app/signals.py),
+so cascading deletes are counted as well. The ids a user has favourited are
+cached as one set per user and kind, a list page needs at most one lookup to
+flag its rows. A unique index on (user, offer) makes adding idempotent.
+"""
+from django.core.cache import cache
+from django.db import DatabaseError
+from pymongo import UpdateOne
+
+from .models import Offer, JobOffer, FavouriteOffer, FavouriteJobOffer
+from .mongo import get_collection, column
+
+FAVOURITE_IDS_TTL = 300     # seconds
+
+# kind: (favourite model, field pointing at the favourited object, favourited model)
+KINDS = {
+    'offer': (FavouriteOffer, 'offer_id', Offer),
+    'joboffer': (FavouriteJobOffer, 'job_offer_id', JobOffer),
+}
+
+
+def favourite_ids_key(kind, user_id):
+    return 'favourite-ids:{}:{}'.format(kind, user_id)
+
+
+def favourite_ids(kind, user_id):
+    """
+    Set of the ids `user_id` has favourited.
+    """
+    key = favourite_ids_key(kind, user_id)
+    ids = cache.get(key)
+    if ids is None:
+        model, field, _ = KINDS[kind]
+        ids = frozenset(model.objects.filter(user_id=user_id).values_list(field, flat=True))
+        cache.set(key, ids, FAVOURITE_IDS_TTL)
+    return ids
+
+
+def add(kind, user_id, object_id):
+    """
+    Favourite an object, returns False when it already was one.
+    Raises DoesNotExist for an unknown object.
+    """
+    model, field, target = KINDS[kind]
+    if not target.objects.filter(id=object_id).exists():
+        raise target.DoesNotExist
+    lookup = {'user_id_id': user_id, field + '_id': object_id}
+    try:
+        model.objects.create(**lookup)
+    except DatabaseError:
+        # the unique index rejected a concurrent duplicate
+        if not model.objects.filter(**lookup).exists():
+            raise
+        return False
+    return True
+
+
+def remove(kind, user_id, object_id):
+    """
+    Returns False when the object was not a favourite.
+    """
+    model, field, _ = KINDS[kind]
+    deleted, _ = model.objects.filter(user_id=user_id, **{field: object_id}).delete()
+    return bool(deleted)
+
+
+def changed(kind, user_id, object_id, delta):
+    """
+    Called by the signals after a favourite was created (+1) or deleted (-1).
+    """
+    _, _, target = KINDS[kind]
+    get_collection(target, operation='counters').update_one({'id': object_id}, {'$inc': {column(target, 'favourite_count'): delta}})
+    cache.delete(favourite_ids_key(kind, user_id))
+
+
+def recount(kind):
+    """
+    Recompute every favourite_count (after bulk inserts, which skip the signals), returns the number of objects.
+    """
+    model, field, target = KINDS[kind]
+    counts = get_collection(model).aggregate([
+        {'$group': {'_id': '$' + column(model, field), 'count': {'$sum': 1}}},
+    ])
+    count_column = column(target, 'favourite_count')
+    collection = get_collection(target, operation='counters')
+    collection.update_many({}, {'$set': {count_column: 0}})
+    updates = [UpdateOne({'id': row['_id']}, {'$set': {count_column: row['count']}}) for row in counts]
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return len(updates)
@@ -0,0 +1,51 @@
+"""
+Generation counters shared by every process, stored in MongoDB.
+
+Processes keep nearly static data in memory (the city index of OM_app/geo.py,
+the reference data payloads of OM_app/api/refdata.py) and rebuild it when the
+generation of its name changes. The counters live in the database rather
+than in the Django cache, which is per process unless a shared backend is
+configured, so a bump from any process, management commands included,
+reaches all of them. A process reads the counters at most every
+CHECK_INTERVAL seconds.
+"""
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+from .mongo import get_database
+
+COLLECTION = 'om_generations'
+CHECK_INTERVAL = 5      # seconds
+
+_lock = threading.Lock()
+_values = {}
+_checked = None
+
+
+def get_collection():
+    return get_database()[COLLECTION]
+
+
+def current(name):
+    global _values, _checked
+    now = time.monotonic()
+    if _checked is None or now - _checked >= CHECK_INTERVAL:
+        with _lock:
+            if _checked is None or now - _checked >= CHECK_INTERVAL:
+                _values = {row['_id']: row['value'] for row in get_collection().find()}
+                _checked = now
+    return _values.get(name, 0)
+
+
+def bump(name):
+    """
+    Start a new generation of `name`, this process sees it at once.
+    """
+    global _values
+    row = get_collection().find_one_and_update(
+        {'_id': name}, {'$inc': {'value': 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    with _lock:
+        _values = dict(_values, **{name: row['value']})
@@ -0,0 +1,119 @@
+"""
+City lookups for the `near=lat,lng&radius_km=` and `voivodeship_id=` list filters.
+
+The City table is small and nearly static, so every process keeps a grid of
+the cities with coordinates (cells of CELL_DEGREES) and the city ids of every
+voivodeship. A radius query only measures the cities of the cells its
+bounding box touches and returns a set of city ids, which the list views turn
+into a `city_id IN (...)` condition. The City/Voivodeship signals bump a
+shared generation number (OM_app/generations.py) and every process rebuilds
+its grid when it sees a new one.
+"""
+import math
+import threading
+from collections import defaultdict
+
+from . import generations
+from .models import City
+
+CELL_DEGREES = 0.5
+EARTH_RADIUS_KM = 6371.0
+MAX_RADIUS_KM = 2000
+GENERATION = 'geo-cities'
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """
+    Haversine distance.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell(lat, lng):
+    return int(math.floor(lat / CELL_DEGREES)), int(math.floor(lng / CELL_DEGREES))
+
+
+class CityIndex:
+    def __init__(self, cities):
+        """
+        `cities` are (id, voivodeship id, latitude, longitude) tuples.
+        """
+        self.cells = defaultdict(list)
+        self.voivodeships = defaultdict(set)
+        self.city_voivodeship = {}
+        self.located = set()
+        for pk, voivodeship_id, latitude, longitude in cities:
+            self.voivodeships[voivodeship_id].add(pk)
+            self.city_voivodeship[pk] = voivodeship_id
+            if latitude is not None and longitude is not None:
+                self.cells[cell(latitude, longitude)].append((pk, latitude, longitude))
+                self.located.add(pk)
+        self.all = frozenset(pk for ids in self.voivodeships.values() for pk in ids)
+
+    def near(self, lat, lng, radius_km):
+        radius_km = min(radius_km, MAX_RADIUS_KM)
+        lat_delta = radius_km / 111.0
+        # longitude degrees shrink with the latitude, use the widest row of the box
+        widest = max(abs(lat) + lat_delta, 0)
+        lng_delta = 360.0 if widest >= 89.9 else radius_km / (111.0 * math.cos(math.radians(widest)))
+
+        (min_row, min_col), (max_row, max_col) = cell(lat - lat_delta, lng - lng_delta), cell(lat + lat_delta, lng + lng_delta)
+        ids = set()
+        # iterate whichever is smaller: the touched cells or the occupied ones
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells):
+            candidates = (
+                cities for (row, col), cities in self.cells.items()
+                if min_row <= row <= max_row and min_col <= col <= max_col
+            )
+        else:
+            candidates = (
+                self.cells.get((row, col), ())
+                for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)
+            )
+        for cities in candidates:
+            for pk, latitude, longitude in cities:
+                if distance_km(lat, lng, latitude, longitude) <= radius_km:
+                    ids.add(pk)
+        return ids
+
+    def in_voivodeship(self, voivodeship_id):
+        return self.voivodeships.get(voivodeship_id, set())
+
+
+_lock = threading.Lock()
+_index = None
+_generation = None
+
+
+def get_index():
+    global _index, _generation
+    generation = generations.current(GENERATION)
+    if _index is None or generation != _generation:
+        with _lock:
+            if _index is None or generation != _generation:
+                _index = CityIndex(City.objects.values_list('id', 'voivodeship_id', 'latitude', 'longitude'))
+                _generation = generation
+    return _index
+
+
+def invalidate():
+    generations.bump(GENERATION)
+
+
+def cities_near(lat, lng, radius_km):
+    """
+    Ids of the cities within `radius_km`, None when that is every city, so no filter is needed.
+    """
+    index = get_index()
+    ids = index.near(lat, lng, radius_km)
+    return None if ids == index.all else ids
+
+
+def cities_in_voivodeship(voivodeship_id):
+    return get_index().in_voivodeship(voivodeship_id)
+
+
+def voivodeship_of(city_id):
+    return get_index().city_voivodeship.get(city_id)
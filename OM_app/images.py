@@ -0,0 +1,208 @@
+"""
+Offer image pipeline.
+
+An uploaded image is only written to a local staging directory while the
+request runs. A worker pool then strips EXIF data, generates the size
+variants (JPEG and WebP) and stores them on the image storage:
+OFFER_IMAGES['STORAGE'], or the default file storage (Cloudinary) when it is
+not set. The cleaned original goes to the storage of Offer.image, which
+serves its URL. Variant names are derived from the offer id and
+`image_version`, so URLs can be built without a lookup. Uploads still staged
+when a process stopped are queued again at startup, see requeue_pending().
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage, get_storage_class
+from django.utils import timezone
+from django.utils.functional import LazyObject
+from PIL import Image, ImageOps
+from pymongo import ReturnDocument
+
+from .models import Offer
+from .mongo import column, get_collection
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'STORAGE': None,            # dotted path of a storage class, None is DEFAULT_FILE_STORAGE
+    'STAGING_DIR': os.path.join(settings.BASE_DIR, 'media_staging'),
+    'WORKERS': 2,               # 0 processes uploads inside the request
+    'VARIANTS': {
+        'thumbnail': (320, 320),
+        'detail': (1280, 1280),
+    },
+    'QUALITY': 85,
+    'REQUEUE_AFTER': 300,       # seconds after which a staged upload counts as abandoned
+}
+
+FORMATS = (
+    ('jpg', 'JPEG'),
+    ('webp', 'WEBP'),
+)
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'OFFER_IMAGES', {}))
+    return config
+
+
+class ImageStorage(LazyObject):
+    def _setup(self):
+        storage_class = get_config()['STORAGE']
+        self._wrapped = get_storage_class(storage_class)() if storage_class else default_storage
+
+class StagingStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = FileSystemStorage(location=get_config()['STAGING_DIR'])
+
+image_storage = ImageStorage()
+staging_storage = StagingStorage()
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=get_config()['WORKERS'], thread_name_prefix='offer-images')
+    return _executor
+
+
+def variant_name(offer_id, version, variant, extension):
+    return 'offers_images/{}/{}/{}.{}'.format(offer_id, version, variant, extension)
+
+
+def variant_urls(offer):
+    if offer.image_status != Offer.IMAGE_READY:
+        return None
+    return {
+        '{}_{}'.format(variant, extension): image_storage.url(variant_name(offer.pk, offer.image_version, variant, extension))
+        for variant in get_config()['VARIANTS']
+        for extension, image_format in FORMATS
+    }
+
+
+def staging_name(offer_id, version):
+    return 'offer_{}_{}'.format(offer_id, version)
+
+
+def queue_upload(offer_id, version, staged_name):
+    if get_config()['WORKERS']:
+        get_executor().submit(process_upload, offer_id, version, staged_name)
+    else:
+        process_upload(offer_id, version, staged_name)
+
+
+def reserve_version(offer_id):
+    """
+    Mark the offer pending under a new image_version, unique among concurrent uploads.
+    """
+    row = get_collection(Offer).find_one_and_update(
+        {'id': offer_id},
+        {
+            '$inc': {column(Offer, 'image_version'): 1},
+            '$set': {column(Offer, 'image_status'): Offer.IMAGE_PENDING, column(Offer, 'modification_date'): timezone.now()},
+        },
+        projection={column(Offer, 'image_version'): True, '_id': False},
+        return_document=ReturnDocument.AFTER,
+    )
+    return row[column(Offer, 'image_version')]
+
+
+def accept_upload(offer, upload):
+    """
+    Stage the uploaded file and queue its processing, the offer is updated in place.
+    """
+    version = reserve_version(offer.pk)
+    offer.image_status, offer.image_version = Offer.IMAGE_PENDING, version
+    try:
+        staged_name = staging_storage.save(staging_name(offer.pk, version), upload)
+    except Exception:
+        Offer.objects.filter(pk=offer.pk, image_version=version).update(image_status=Offer.IMAGE_FAILED)
+        raise
+
+    queue_upload(offer.pk, version, staged_name)
+    if not get_config()['WORKERS']:
+        offer.refresh_from_db(fields=['image', 'image_status'])
+
+
+def requeue_pending():
+    """
+    Queue the uploads of pending offers staged on this host more than
+    REQUEUE_AFTER seconds ago, left behind by a process that stopped before
+    processing them. Renaming the staged file claims it, so processes
+    starting together queue it once. Returns how many were queued.
+    """
+    config = get_config()
+    queued = 0
+    pending = Offer.objects.filter(image_status=Offer.IMAGE_PENDING).values_list('id', 'image_version')
+    for offer_id, version in pending.iterator():
+        staged_name = staging_name(offer_id, version)
+        claimed_name = '{}.requeued'.format(staged_name)
+        try:
+            if time.time() - os.path.getmtime(staging_storage.path(staged_name)) < config['REQUEUE_AFTER']:
+                continue
+            os.rename(staging_storage.path(staged_name), staging_storage.path(claimed_name))
+        except OSError:
+            continue    # staged on another host, or claimed by another process
+        queue_upload(offer_id, version, claimed_name)
+        queued += 1
+    return queued
+
+
+def requeue_on_startup():
+    """
+    requeue_pending() at ASGI/WSGI startup; failures are logged, the process still starts.
+    """
+    try:
+        queued = requeue_pending()
+    except Exception:
+        logger.warning('Requeueing pending offer images failed', exc_info=True)
+    else:
+        if queued:
+            logger.info('Requeued %d pending offer images', queued)
+
+
+def encode(image, image_format, quality):
+    buffer = BytesIO()
+    # no exif argument, so none of the original metadata is written back
+    image.save(buffer, image_format, quality=quality)
+    return ContentFile(buffer.getvalue())
+
+
+def process_upload(offer_id, version, staged_name):
+    config = get_config()
+    try:
+        with staging_storage.open(staged_name) as staged:
+            image = ImageOps.exif_transpose(Image.open(staged))
+            image = image.convert('RGB')
+
+        for variant, size in config['VARIANTS'].items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            for extension, image_format in FORMATS:
+                image_storage.save(variant_name(offer_id, version, variant, extension), encode(resized, image_format, config['QUALITY']))
+
+        # Offer.image reads it back through the storage of its field
+        original = Offer.image.field.storage.save(
+            variant_name(offer_id, version, 'original', 'jpg'), encode(image, 'JPEG', config['QUALITY'])
+        )
+        # a newer upload wins, update() also keeps the search index signals quiet
+        Offer.objects.filter(pk=offer_id, image_version=version).update(
+            image=original, image_status=Offer.IMAGE_READY, modification_date=timezone.now()
+        )
+    except Exception:
+        logger.exception('Processing image of offer %s failed', offer_id)
+        # a requeued copy of the same upload may have succeeded meanwhile
+        Offer.objects.filter(pk=offer_id, image_version=version, image_status=Offer.IMAGE_PENDING).update(
+            image_status=Offer.IMAGE_FAILED, modification_date=timezone.now()
+        )
+    finally:
+        staging_storage.delete(staged_name)
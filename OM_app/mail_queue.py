@@ -0,0 +1,142 @@
+"""
+Outbound e-mail queue.
+
+Request code only stores an OutgoingEmail record with `enqueue`. The
+send_queued_mail worker claims due records in batches, renders them with
+templates compiled once per process and sends the whole batch over a single
+SMTP connection. Claiming a record counts an attempt, so one whose sender
+crashed counts too. A failed send is retried with exponential backoff and the
+record goes to the dead state after MAX_ATTEMPTS.
+"""
+import json
+import logging
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 60,      # seconds before the first retry, doubled on every attempt
+    'LEASE': 300,       # seconds a claimed batch stays with a worker
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'MAIL_QUEUE', {}))
+    return config
+
+
+def enqueue(subject, template, context, from_email, to):
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        template=template,
+        context=json.dumps(context),
+        from_email=from_email,
+        to=','.join(to),
+    )
+
+
+@lru_cache(maxsize=None)
+def compiled_template(name):
+    try:
+        return get_template(name)
+    except TemplateDoesNotExist:
+        return None
+
+
+def build_message(email, connection):
+    context = json.loads(email.context)
+    message = EmailMultiAlternatives(
+        email.subject,
+        compiled_template(email.template + '.txt').render(context),
+        email.from_email,
+        email.to.split(','),
+        connection=connection,
+    )
+    html = compiled_template(email.template + '.html')
+    if html is not None:
+        message.attach_alternative(html.render(context), 'text/html')
+    return message
+
+
+def claim_batch(batch_size, lease, max_attempts=DEFAULTS['MAX_ATTEMPTS']):
+    """
+    Due queued e-mails, marked as sending so other workers skip them, with
+    the attempt counted. Leases of crashed workers run out and their e-mails
+    are claimed again, or go to the dead state when out of attempts.
+    """
+    now = timezone.now()
+    due = OutgoingEmail.objects.filter(
+        status__in=(OutgoingEmail.QUEUED, OutgoingEmail.SENDING), next_attempt__lte=now
+    ).order_by('next_attempt')[:batch_size]
+
+    claimed = []
+    for email in due:
+        unchanged = OutgoingEmail.objects.filter(
+            pk=email.pk, status=email.status, next_attempt=email.next_attempt, attempts=email.attempts
+        )
+        if email.attempts >= max_attempts:
+            logger.error('Giving up on e-mail %s, its sender did not finish', email.pk)
+            unchanged.update(status=OutgoingEmail.DEAD, next_attempt=now)
+            continue
+        taken = unchanged.update(
+            status=OutgoingEmail.SENDING, next_attempt=now + timedelta(seconds=lease), attempts=email.attempts + 1
+        )
+        if taken:
+            email.attempts += 1
+            claimed.append(email)
+    return claimed
+
+
+def send_batch():
+    """
+    Send one batch of due e-mails, returns (sent, failed).
+    """
+    config = get_config()
+    batch = claim_batch(config['BATCH_SIZE'], config['LEASE'], config['MAX_ATTEMPTS'])
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        for email in batch:
+            try:
+                connection.open()   # no-op while the connection is up
+                build_message(email, connection).send()
+            except Exception as e:
+                logger.warning('Sending e-mail %s failed: %s', email.pk, e)
+                failed += 1
+                retry_later(email, e, config)
+                connection.close()  # reconnect for the next one
+            else:
+                sent += 1
+                OutgoingEmail.objects.filter(pk=email.pk).update(
+                    status=OutgoingEmail.SENT, sent=timezone.now(), last_error=''
+                )
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def retry_later(email, error, config):
+    # the attempt was counted when the e-mail was claimed
+    if email.attempts >= config['MAX_ATTEMPTS']:
+        status, next_attempt = OutgoingEmail.DEAD, timezone.now()
+    else:
+        status = OutgoingEmail.QUEUED
+        next_attempt = timezone.now() + timedelta(seconds=config['BACKOFF'] * 2 ** (email.attempts - 1))
+    OutgoingEmail.objects.filter(pk=email.pk).update(
+        status=status, next_attempt=next_attempt, last_error=str(error)
+    )
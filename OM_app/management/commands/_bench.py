@@ -0,0 +1,299 @@
+"""
+Shared helpers for the bench_* management commands.
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.test.utils import override_settings
+from django.urls import re_path
+
+from ... import geo
+from ...models import (
+    Offer, OfferCategory, JobOffer, JobOfferCategory, User, Chat, Contact, Message,
+    FavouriteOffer, FavouriteJobOffer, Voivodeship, City
+)
+
+# used when the database has no reference data yet
+VOIVODESHIP_CITIES = (
+    ('dolnośląskie', (('Wrocław', 51.11, 17.03), ('Wałbrzych', 50.77, 16.28), ('Legnica', 51.21, 16.16))),
+    ('kujawsko-pomorskie', (('Bydgoszcz', 53.12, 18.01), ('Toruń', 53.01, 18.60), ('Włocławek', 52.65, 19.07))),
+    ('lubelskie', (('Lublin', 51.25, 22.57), ('Zamość', 50.72, 23.25), ('Chełm', 51.14, 23.47))),
+    ('lubuskie', (('Gorzów Wielkopolski', 52.73, 15.24), ('Zielona Góra', 51.94, 15.51))),
+    ('łódzkie', (('Łódź', 51.76, 19.46), ('Piotrków Trybunalski', 51.41, 19.70))),
+    ('małopolskie', (('Kraków', 50.06, 19.94), ('Tarnów', 50.01, 20.99), ('Nowy Sącz', 49.62, 20.69))),
+    ('mazowieckie', (('Warszawa', 52.23, 21.01), ('Radom', 51.40, 21.15), ('Płock', 52.55, 19.71))),
+    ('opolskie', (('Opole', 50.67, 17.93),)),
+    ('podkarpackie', (('Rzeszów', 50.04, 22.00), ('Przemyśl', 49.78, 22.77))),
+    ('podlaskie', (('Białystok', 53.13, 23.16), ('Suwałki', 54.10, 22.93))),
+    ('pomorskie', (('Gdańsk', 54.35, 18.65), ('Gdynia', 54.52, 18.53), ('Sopot', 54.44, 18.56))),
+    ('śląskie', (('Katowice', 50.26, 19.02), ('Gliwice', 50.29, 18.67), ('Częstochowa', 50.81, 19.12))),
+    ('świętokrzyskie', (('Kielce', 50.87, 20.63),)),
+    ('warmińsko-mazurskie', (('Olsztyn', 53.78, 20.48), ('Elbląg', 54.16, 19.40))),
+    ('wielkopolskie', (('Poznań', 52.41, 16.93), ('Kalisz', 51.76, 18.09), ('Konin', 52.22, 18.25))),
+    ('zachodniopomorskie', (('Szczecin', 53.43, 14.55), ('Koszalin', 54.19, 16.17))),
+)
+
+WORDS = (
+    'rower', 'łóżko', 'sofa', 'żyrandol', 'krzesło', 'stół', 'telefon', 'laptop', 'książka', 'szafa',
+    'biurko', 'lampa', 'pralka', 'lodówka', 'kurtka', 'buty', 'zegarek', 'gitara', 'samochód', 'opony',
+    'programista', 'kierowca', 'księgowa', 'sprzedawca', 'magazynier', 'kucharz', 'elektryk', 'spawacz',
+)
+
+
+def random_name(rng, number):
+    return '{} {} {}'.format(rng.choice(WORDS), rng.choice(WORDS), number)
+
+
+@contextmanager
+def benchmark_database(keep=False, response_cache=False):
+    """
+    Run the block against a throwaway test database so seeding never touches real data.
+    The anonymous response cache is off unless asked for, repeated requests would only time cache hits.
+    """
+    with override_settings(RESPONSE_CACHE=dict(getattr(settings, 'RESPONSE_CACHE', {}), ENABLED=response_cache)):
+        if keep:
+            yield connection.settings_dict['NAME']
+            return
+        old_name = connection.settings_dict['NAME']
+        test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # the read alias follows the test database, as under the test runner
+        mirrors = {}
+        for alias in connections:
+            if connections[alias].settings_dict.get('TEST', {}).get('MIRROR') == DEFAULT_DB_ALIAS:
+                mirrors[alias] = connections[alias].settings_dict
+                connections[alias].close()
+                connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            yield test_name
+        finally:
+            for alias, settings_dict in mirrors.items():
+                connections[alias].close()
+                connections[alias].settings_dict = settings_dict
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(func, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+def bench_user(username='bench'):
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        user = User.objects.create_user(username, '{}@bench.local'.format(username), 'bench-password')
+    return user
+
+
+def seed_offers(count, user, batch_size=1000, city_ids=range(1, 51), category_ids=range(1, 11)):
+    """
+    `user` owns the offers, a list spreads them over several users.
+    """
+    rng = random.Random(count)
+    users = list(user) if isinstance(user, (list, tuple)) else [user]
+    for start in range(0, count, batch_size):
+        Offer.objects.bulk_create([
+            Offer(
+                user_id=rng.choice(users),
+                city_id=rng.choice(city_ids),
+                category_id=rng.choice(category_ids),
+                name=random_name(rng, start + i),
+                price=rng.randint(0, 100000) / 100,
+                description='',
+            )
+            for i in range(min(batch_size, count - start))
+        ])
+
+
+def seed_job_offers(count, user, batch_size=1000, city_ids=range(1, 51), category_ids=range(1, 11)):
+    rng = random.Random(count)
+    users = list(user) if isinstance(user, (list, tuple)) else [user]
+    for start in range(0, count, batch_size):
+        offers = []
+        for i in range(min(batch_size, count - start)):
+            min_salary = rng.randint(2000, 20000)
+            offers.append(JobOffer(
+                user_id=rng.choice(users),
+                city_id=rng.choice(city_ids),
+                category_id=rng.choice(category_ids),
+                name=random_name(rng, start + i),
+                min_salary=min_salary,
+                max_salary=min_salary + rng.randint(0, 10000),
+                company='Company {}'.format(i % 100),
+                remote=rng.random() < 0.3,
+            ))
+        JobOffer.objects.bulk_create(offers)
+
+
+def seed_chat(participants):
+    """
+    Chat between `participants` new users, returns (chat, [user, ...]).
+    """
+    chat = Chat.objects.create()
+    users = []
+    for i in range(participants):
+        user = bench_user('chat{}_{}'.format(chat.pk, i))
+        chat.participants.add(Contact.objects.create(user_id=user.id))
+        users.append(user)
+    return chat, users
+
+
+def seed_reference_data():
+    """
+    City and category ids to seed with, voivodeships and cities are created only if there are none.
+    """
+    if not City.objects.exists():
+        for voivodeship_name, cities in VOIVODESHIP_CITIES:
+            voivodeship = Voivodeship.objects.create(name=voivodeship_name)
+            City.objects.bulk_create([
+                City(voivodeship_id=voivodeship, name=name, latitude=latitude, longitude=longitude)
+                for name, latitude, longitude in cities
+            ])
+        geo.invalidate()    # bulk_create skips the signals
+    if not OfferCategory.objects.exists():
+        OfferCategory.objects.bulk_create([OfferCategory(name='Kategoria {}'.format(i), icon='icon') for i in range(10)])
+    if not JobOfferCategory.objects.exists():
+        JobOfferCategory.objects.bulk_create([JobOfferCategory(name='Branża {}'.format(i)) for i in range(10)])
+    return {
+        'city_ids': list(City.objects.values_list('id', flat=True)),
+        'offer_category_ids': list(OfferCategory.objects.values_list('id', flat=True)),
+        'job_offer_category_ids': list(JobOfferCategory.objects.values_list('id', flat=True)),
+    }
+
+
+def seed_dataset(users, offers, job_offers, favourites, chats, chat_messages=20, seed=0):
+    """
+    Marketplace of `users` users over the reference data: offers, job offers,
+    `favourites` favourites of each kind per user and two-person chats.
+    Returns the seeded users.
+    """
+    from ... import favourites, search
+
+    rng = random.Random(seed)
+    reference = seed_reference_data()
+    owners = [bench_user('seed{}'.format(i)) for i in range(users)]
+    seed_offers(offers, owners, city_ids=reference['city_ids'], category_ids=reference['offer_category_ids'])
+    seed_job_offers(job_offers, owners, city_ids=reference['city_ids'], category_ids=reference['job_offer_category_ids'])
+    search.rebuild('offer')     # bulk_create skips the indexing signals
+    search.rebuild('joboffer')
+
+    offer_ids = list(Offer.objects.values_list('id', flat=True))
+    job_offer_ids = list(JobOffer.objects.values_list('id', flat=True))
+    for user in owners:
+        FavouriteOffer.objects.bulk_create([
+            FavouriteOffer(user_id=user, offer_id_id=pk) for pk in rng.sample(offer_ids, min(favourites, len(offer_ids)))
+        ])
+        FavouriteJobOffer.objects.bulk_create([
+            FavouriteJobOffer(user_id=user, job_offer_id_id=pk) for pk in rng.sample(job_offer_ids, min(favourites, len(job_offer_ids)))
+        ])
+
+    favourites.recount('offer')     # bulk_create skips the counting signals
+    favourites.recount('joboffer')
+
+    contacts = {
+        user.id: Contact.objects.filter(user_id=user.id).first() or Contact.objects.create(user_id=user.id)
+        for user in owners
+    }
+    for _ in range(chats if len(owners) > 1 else 0):
+        first, second = rng.sample(owners, 2)
+        chat = Chat.objects.create()
+        chat.participants.add(contacts[first.id], contacts[second.id])
+        Message.objects.bulk_create([
+            Message(contact=contacts[(first, second)[i % 2].id], chat=chat, content='message {}'.format(i))
+            for i in range(chat_messages)
+        ])
+    return owners
+
+
+async def chat_fanout(consumer, chat_id, user, clients, messages):
+    """
+    Connect `clients` sockets of `user` to the chat, send `messages` round robin
+    and time the delivery of every message to every socket.
+    """
+    application = URLRouter([
+        re_path(r'^ws/chat/(?P<room_name>[^/]+)/$', consumer.as_asgi()),
+    ])
+    path = '/ws/chat/{}/'.format(chat_id)
+    communicators = [WebsocketCommunicator(application, path) for _ in range(clients)]
+    for communicator in communicators:
+        communicator.scope['user'] = user
+        await communicator.connect()
+
+    latencies = []
+
+    async def receive_all(communicator):
+        for _ in range(messages):
+            data = json.loads(await communicator.receive_from(timeout=60))
+            latencies.append(time.perf_counter() - float(data['message']['content']))
+
+    start = time.perf_counter()
+    receivers = [asyncio.ensure_future(receive_all(communicator)) for communicator in communicators]
+    for i in range(messages):
+        await communicators[i % clients].send_to(text_data=json.dumps({
+            'command': 'new_message',
+            'from': user.id,
+            'chatId': chat_id,
+            'message': repr(time.perf_counter()),   # send time, read back by the receivers
+        }))
+    await asyncio.gather(*receivers)
+    elapsed = time.perf_counter() - start
+
+    for communicator in communicators:
+        await communicator.disconnect()
+
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'messages_per_sec': round(messages / elapsed, 1),
+        'deliveries_per_sec': round(len(latencies) / elapsed, 1),
+        'fanout_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'fanout_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def latencies(func, iterations):
+    """
+    Run `func(i)` `iterations` times, percentiles of the single calls and throughput.
+    """
+    samples = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - call_start) * 1000)
+    elapsed = time.perf_counter() - start
+    return {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / elapsed, 1),
+        'p50_ms': round(percentile(samples, 0.50), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+    }
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else None
+
+
+def write_results(command, results, path=None):
+    if path is None:
+        command.stdout.write(json.dumps(results, indent=2))
+        return
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from ...chat_utils import get_messages_page
+from ...models import Contact, Message
+from ._bench import benchmark_database, measure, seed_chat, write_results
+
+
+class Command(BaseCommand):
+    help = 'Latency of the newest and of a deep chat history page while one chat grows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,100000', help='Comma separated chat lengths.')
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        results = {'limit': options['limit'], 'sizes': {}}
+        with benchmark_database(options['keep_db']):
+            chat, users = seed_chat(2)
+            contacts = list(Contact.objects.filter(user_id__in=[user.id for user in users]))
+            seeded = 0
+            for size in sorted(int(size) for size in options['sizes'].split(',')):
+                for start in range(seeded, size, 1000):
+                    Message.objects.bulk_create([
+                        Message(contact=contacts[i % 2], chat=chat, content='message {}'.format(i))
+                        for i in range(start, min(start + 1000, size))
+                    ])
+                seeded = size
+
+                # cursor in the middle of the history
+                middle = Message.objects.filter(chat=chat).order_by('-timestamp', '-id')[size // 2]
+                results['sizes'][size] = {
+                    'newest': measure(lambda: get_messages_page(chat.pk, None, options['limit']), options['repeat']),
+                    'before_middle': measure(lambda: get_messages_page(chat.pk, middle.pk, options['limit']), options['repeat']),
+                }
+        write_results(self, results)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ...chat_utils import get_inbox
+from ...models import Chat, Contact, Message
+from ._bench import benchmark_database, bench_user, measure, write_results
+
+
+class Command(BaseCommand):
+    help = 'Query count and latency of the chat inbox for a growing number of chats and participants.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', default='1,10,100', help='Comma separated numbers of chats.')
+        parser.add_argument('--participants', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        results = {'participants': options['participants'], 'chats': {}}
+        with benchmark_database(options['keep_db']):
+            user = bench_user()
+            contact = Contact.objects.create(user_id=user.id)
+            others = []
+            for i in range(options['participants'] - 1):
+                other = bench_user('inbox{}'.format(i))
+                others.append(Contact.objects.create(user_id=other.id))
+
+            seeded = 0
+            for count in sorted(int(count) for count in options['chats'].split(',')):
+                for _ in range(count - seeded):
+                    chat = Chat.objects.create()
+                    chat.participants.add(contact, *others)
+                    Message.objects.bulk_create([
+                        Message(contact=others[i % len(others)] if others else contact, chat=chat, content='message {}'.format(i))
+                        for i in range(10)
+                    ])
+                seeded = count
+
+                # ORM queries only, the two aggregations go straight to pymongo
+                with CaptureQueriesContext(connection) as queries:
+                    get_inbox(user.id)
+                results['chats'][count] = dict(measure(lambda: get_inbox(user.id), options['repeat']), queries=len(queries))
+
+        write_results(self, results)
+        if len({result['queries'] for result in results['chats'].values()}) > 1:
+            raise CommandError('inbox query count grows with the number of chats')
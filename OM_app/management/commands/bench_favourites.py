@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ...api.views import FavouriteOffersView
+from ...models import FavouriteOffer, Offer
+from ._bench import benchmark_database, bench_user, measure, seed_offers, write_results
+
+
+class Command(BaseCommand):
+    help = 'Query count and latency of the favourite offers list for a growing number of favourites.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', default='1,100,1000', help='Comma separated favourite counts.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        counts = sorted(int(count) for count in options['counts'].split(','))
+        results = {'counts': {}}
+        with benchmark_database(options['keep_db']):
+            user = bench_user()
+            seed_offers(counts[-1], user)
+            offers = list(Offer.objects.order_by('id')[:counts[-1]])
+
+            for count in counts:
+                FavouriteOffer.objects.filter(user_id=user.id).delete()
+                FavouriteOffer.objects.bulk_create([FavouriteOffer(user_id=user, offer_id=offer) for offer in offers[:count]])
+
+                with CaptureQueriesContext(connection) as queries:
+                    self.get(user)
+                results['counts'][count] = dict(measure(lambda: self.get(user), options['repeat']), queries=len(queries))
+
+        write_results(self, results)
+        if len({result['queries'] for result in results['counts'].values()}) > 1:
+            raise CommandError('query count grows with the number of favourites')
+
+    def get(self, user):
+        request = APIRequestFactory().get('/api/offers/favourites/list/', {'limit': 20})
+        force_authenticate(request, user=user)
+        response = FavouriteOffersView.as_view()(request)
+        response.render()
+        return response
@@ -0,0 +1,67 @@
+import random
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from ... import geo
+from ...api.views import OfferList
+from ...models import City, Voivodeship
+from ._bench import benchmark_database, bench_user, measure, seed_offers, write_results
+
+# bounding box of Poland
+LATITUDES = (49.0, 54.8)
+LONGITUDES = (14.1, 24.2)
+CENTER = (52.23, 21.01)
+
+
+class Command(BaseCommand):
+    help = 'Latency of the near= city lookup (grid vs scanning every city) and of the filtered offer list for growing radii.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=2500)
+        parser.add_argument('--offers', type=int, default=100000)
+        parser.add_argument('--radii', default='5,25,100,300,1000', help='Comma separated radii in km.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        results = {'cities': options['cities'], 'offers': options['offers'], 'radii': {}}
+        with benchmark_database(options['keep_db']):
+            city_ids = self.seed_cities(options['cities'])
+            seed_offers(options['offers'], bench_user(), city_ids=city_ids)
+            geo.invalidate()
+
+            cities = list(City.objects.values_list('id', 'latitude', 'longitude'))
+            index = geo.get_index()
+            view = OfferList.as_view()
+            factory = APIRequestFactory()
+            lat, lng = CENTER
+
+            for radius in (float(radius) for radius in options['radii'].split(',')):
+                matched = index.near(lat, lng, radius)
+                results['radii'][radius] = {
+                    'matched_cities': len(matched),
+                    'grid': measure(lambda: index.near(lat, lng, radius), options['repeat']),
+                    'scan': measure(lambda: {
+                        pk for pk, latitude, longitude in cities
+                        if geo.distance_km(lat, lng, latitude, longitude) <= radius
+                    }, options['repeat']),
+                    'offer_list': measure(lambda: view(factory.get('/api/offers/', {
+                        'near': '{},{}'.format(lat, lng), 'radius_km': radius, 'limit': 20,
+                    })).render(), options['repeat']),
+                }
+        write_results(self, results)
+
+    def seed_cities(self, count):
+        rng = random.Random(count)
+        voivodeship = Voivodeship.objects.create(name='bench')
+        City.objects.bulk_create([
+            City(
+                voivodeship_id=voivodeship,
+                name='Miasto {}'.format(i),
+                latitude=rng.uniform(*LATITUDES),
+                longitude=rng.uniform(*LONGITUDES),
+            )
+            for i in range(count)
+        ])
+        return list(City.objects.filter(voivodeship_id=voivodeship).values_list('id', flat=True))
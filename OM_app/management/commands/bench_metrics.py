@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from ...middleware import PerformanceMetricsMiddleware
+from ._bench import measure, write_results
+
+
+def view(request):
+    return HttpResponse(b'x' * 1000)
+
+
+class Command(BaseCommand):
+    help = 'Per request overhead of PerformanceMetricsMiddleware on a trivial view (no database needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/api/offers/')
+        requests = options['requests']
+        instrumented = PerformanceMetricsMiddleware(view)
+        with override_settings(PERFORMANCE_METRICS={'ENABLED': True, 'SERVER_TIMING': True}):
+            with_server_timing = PerformanceMetricsMiddleware(view)
+
+        def run(handler):
+            return lambda: [handler(request) for _ in range(requests)]
+
+        results = {'requests': requests, 'paths': {
+            'bare': measure(run(view), options['repeat']),
+            'metrics': measure(run(instrumented), options['repeat']),
+            'metrics_server_timing': measure(run(with_server_timing), options['repeat']),
+        }}
+        bare = results['paths']['bare']['median_ms']
+        for name in ('metrics', 'metrics_server_timing'):
+            results['paths'][name]['overhead_us_per_request'] = round(
+                (results['paths'][name]['median_ms'] - bare) * 1000 / requests, 3
+            )
+        write_results(self, results)
@@ -0,0 +1,111 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from ...api.serializers import OfferListSerializer
+from ...models import City, Contact, Chat, Offer
+from ...repository import DocumentQuery
+from ._bench import benchmark_database, bench_user, latencies, seed_dataset, write_results
+
+PATHS = ('offer_query', 'offer_list', 'job_offer_list', 'offer_detail', 'favourites_list', 'chat_history')
+
+
+class Command(BaseCommand):
+    help = (
+        'Latency of the hot read paths through the ORM and through the native pymongo reads '
+        '(OM_app/repository.py), the same requests in the same order on both.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, default=20000)
+        parser.add_argument('--job-offers', type=int, default=10000)
+        parser.add_argument('--iterations', type=int, default=300)
+        parser.add_argument('--paths', default=','.join(PATHS))
+        parser.add_argument('--output', help='Also write the results to this file.')
+        parser.add_argument('--keep-db', action='store_true', help='Use the already seeded configured database.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'].split(',')
+        unknown = set(paths) - set(PATHS)
+        if unknown:
+            raise CommandError('Unknown paths: {}'.format(', '.join(sorted(unknown))))
+
+        results = {'options': {name: options[name] for name in ('offers', 'job_offers', 'iterations')}, 'paths': {}}
+        with benchmark_database(options['keep_db']):
+            if not options['keep_db']:
+                seed_dataset(10, options['offers'], options['job_offers'], favourites=50, chats=10, chat_messages=500)
+            self.city_ids = list(City.objects.values_list('id', flat=True))
+            self.offer_ids = list(Offer.objects.values_list('id', flat=True)[:1000])
+            self.user = bench_user('seed0')
+            self.client = APIClient()
+            self.client.force_authenticate(self.user)
+
+            for name in paths:
+                requests = getattr(self, name)(random.Random(0), options['iterations'])
+                timings = {}
+                for mode, native in (('orm', False), ('native', True)):
+                    with override_settings(NATIVE_READS={'ENABLED': native}):
+                        timings[mode] = latencies(lambda i: requests[i](native), options['iterations'])
+                timings['speedup_p50'] = round(timings['orm']['p50_ms'] / timings['native']['p50_ms'], 2)
+                results['paths'][name] = timings
+
+        write_results(self, results)
+        if options['output']:
+            write_results(self, results, options['output'])
+
+    def get(self, url, params=None):
+        def request(native):
+            response = self.client.get(url, params or {})
+            if response.status_code != 200:
+                raise CommandError('GET {} {} returned {}'.format(url, params, response.status_code))
+        return request
+
+    def offer_query(self, rng, iterations):
+        """
+        One page of a city's newest offers without the view: djongo's translation against a find().
+        """
+        columns = OfferListSerializer.columns(OfferListSerializer.default_fields) | {'id'}
+
+        def page(city_id):
+            def request(native):
+                if native:
+                    query = DocumentQuery(Offer, columns).filter({'city_id': city_id}, 'city_id')
+                    return query.order_by('-creation_date', '-id')[:20]
+                return list(Offer.objects.filter(city_id=city_id).only(*columns).order_by('-creation_date', '-id')[:20])
+            return request
+        return [page(rng.choice(self.city_ids)) for _ in range(iterations)]
+
+    def offer_list(self, rng, iterations):
+        return [
+            self.get('/api/offers/', {
+                'city_id': rng.choice(self.city_ids),
+                'ordering': rng.choice(('-creation_date', 'price', '-price')),
+                'cursor': '',
+            })
+            for _ in range(iterations)
+        ]
+
+    def job_offer_list(self, rng, iterations):
+        return [
+            self.get('/api/joboffers/', {
+                'city_id': rng.choice(self.city_ids),
+                'ordering': rng.choice(('-creation_date', 'max_salary', '-max_salary')),
+                'limit': 20,
+            })
+            for _ in range(iterations)
+        ]
+
+    def offer_detail(self, rng, iterations):
+        return [self.get('/api/offers/{}/'.format(rng.choice(self.offer_ids))) for _ in range(iterations)]
+
+    def favourites_list(self, rng, iterations):
+        return [self.get('/api/offers/favourites/list/', {'limit': 20, 'ordering': 'price'}) for _ in range(iterations)]
+
+    def chat_history(self, rng, iterations):
+        contact_id = Contact.objects.filter(user_id=self.user.id).values_list('id', flat=True).first()
+        chat_ids = list(Chat.participants.through.objects.filter(contact_id=contact_id).values_list('chat_id', flat=True))
+        if not chat_ids:
+            raise CommandError('seed0 takes part in no chat, seed more chats')
+        return [self.get('/api/chat/{}/messages/'.format(rng.choice(chat_ids)), {'limit': 20}) for _ in range(iterations)]
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from ...api.pagination import KeysetPagination
+from ...api.views import OfferList
+from ...models import Offer
+from ._bench import benchmark_database, bench_user, measure, seed_offers, write_results
+
+
+class Command(BaseCommand):
+    help = 'Compare limit/offset and keyset pagination of /offers/ at offset 0 and at a deep offset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Depth of the deep page.')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        rows, limit = options['rows'], options['limit']
+        with benchmark_database(options['keep_db']):
+            seed_offers(rows + limit, bench_user())
+
+            # cursor pointing right before the row at offset `rows`
+            last = Offer.objects.order_by('-creation_date', '-id')[rows - 1]
+            deep_cursor = KeysetPagination().encode_cursor(str(last.creation_date), last.pk)
+
+            scenarios = {
+                'offset_0': {'limit': limit, 'offset': 0},
+                'offset_deep': {'limit': limit, 'offset': rows},
+                'keyset_first': {'limit': limit, 'cursor': ''},
+                'keyset_deep': {'limit': limit, 'cursor': deep_cursor},
+            }
+            results = {'rows': rows, 'limit': limit, 'scenarios': {}}
+            for name, params in scenarios.items():
+                results['scenarios'][name] = measure(lambda: self.get(params), options['repeat'])
+
+        write_results(self, results)
+
+    def get(self, params):
+        request = APIRequestFactory().get('/api/offers/', dict(params, ordering='-creation_date'))
+        response = OfferList.as_view()(request)
+        response.render()
+        return response
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from ...api.views import JobOfferList
+from ...models import JobOffer
+from ._bench import benchmark_database, bench_user, measure, seed_job_offers, write_results
+
+# indexes added for the range filters, dropped for the baseline run
+RANGE_INDEXES = ('joboffer_cat_minsal_idx', 'joboffer_city_minsal_idx', 'joboffer_city_cat_minsal_idx')
+
+QUERIES = {
+    'salary_overlap': {'salary_min': 8000, 'salary_max': 9000},
+    'salary_overlap_category': {'salary_min': 8000, 'salary_max': 9000, 'category_id': 3},
+    'salary_overlap_city_category': {'salary_min': 8000, 'salary_max': 9000, 'city_id': 7, 'category_id': 3},
+    'min_salary_city': {'min_salary_f': 15000, 'city_id': 7},
+    'created_window_category': {'created_after': '2020-01-01', 'created_before': '2030-01-01', 'category_id': 3},
+}
+
+
+class Command(BaseCommand):
+    help = 'Latency of the job offer range filters with and without their indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000000, help='Job offers seeded.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        results = {'count': options['count'], 'queries': {}}
+        indexes = [index for index in JobOffer._meta.indexes if index.name in RANGE_INDEXES]
+        with benchmark_database(options['keep_db']):
+            seed_job_offers(options['count'], bench_user())
+
+            indexed = self.run(options['repeat'])
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.remove_index(JobOffer, index)
+            try:
+                without = self.run(options['repeat'])
+            finally:
+                with connection.schema_editor() as editor:
+                    for index in indexes:
+                        editor.add_index(JobOffer, index)
+
+            for name in QUERIES:
+                results['queries'][name] = {'indexed': indexed[name], 'without_range_indexes': without[name]}
+        write_results(self, results)
+
+    def run(self, repeat):
+        view = JobOfferList.as_view()
+        factory = APIRequestFactory()
+        return {
+            name: measure(lambda params=params: view(factory.get('/api/joboffers/', dict(params, limit=20))).render(), repeat)
+            for name, params in QUERIES.items()
+        }
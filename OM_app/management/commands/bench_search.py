@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.test import APIRequestFactory
+
+from ... import search
+from ...api.views import OfferList
+from ._bench import benchmark_database, bench_user, measure, seed_offers, write_results
+
+
+class SearchFilterOfferList(OfferList):
+    # the icontains path OfferList used before the search index
+    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
+    search_fields = ('name',)
+
+
+class Command(BaseCommand):
+    help = 'Compare indexed search with the SearchFilter icontains scan on growing catalogs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated catalog sizes.')
+        parser.add_argument('--queries', default='rower,łozko sof,krzeslo,gitara 12')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        queries = options['queries'].split(',')
+        results = {'queries': queries, 'sizes': {}}
+        with benchmark_database(options['keep_db']):
+            user, seeded = bench_user(), 0
+            for size in sorted(int(size) for size in options['sizes'].split(',')):
+                seed_offers(size - seeded, user)
+                seeded = size
+                search.rebuild('offer')
+
+                results['sizes'][size] = {
+                    'index': self.run(OfferList, queries, options['repeat']),
+                    'search_filter': self.run(SearchFilterOfferList, queries, options['repeat']),
+                }
+        write_results(self, results)
+
+    def run(self, view_class, queries, repeat):
+        view = view_class.as_view()
+        factory = APIRequestFactory()
+
+        def run_queries():
+            for query in queries:
+                view(factory.get('/api/offers/', {'search': query, 'limit': 20})).render()
+
+        return measure(run_queries, repeat)
@@ -0,0 +1,67 @@
+import cProfile
+import datetime
+import pstats
+import random
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management.base import BaseCommand
+
+from ...api.serializers import OfferSerializer, OfferListSerializer, JobOfferSerializer, JobOfferListSerializer
+from ...models import Offer, JobOffer
+from ._bench import measure, write_results
+
+
+def make_offers(count):
+    rng = random.Random(count)
+    return [
+        Offer(
+            id=i, user_id_id=1, city_id=rng.randint(1, 50), category_id=rng.randint(1, 10),
+            name='Offer {}'.format(i), price=Decimal(rng.randint(0, 100000)) / 100,
+            description='x' * 1500, creation_date=datetime.date(2020, 12, 1),
+        )
+        for i in range(count)
+    ]
+
+def make_job_offers(count):
+    rng = random.Random(count)
+    return [
+        JobOffer(
+            id=i, user_id_id=1, city_id=rng.randint(1, 50), category_id=rng.randint(1, 10),
+            name='Job offer {}'.format(i), min_salary=3000, max_salary=rng.randint(3000, 20000),
+            description='x' * 1500, creation_date=datetime.date(2020, 12, 1), company='Company', remote=False,
+        )
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Serializer time per page of rows, ModelSerializer against the lean list serializers (no database needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--profile', action='store_true', help='Print the top functions of each path.')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        offers, job_offers = make_offers(rows), make_job_offers(rows)
+        paths = {
+            'offer_model_serializer': lambda: OfferSerializer(offers, many=True).data,
+            'offer_lean': lambda: OfferListSerializer(offers, OfferListSerializer.default_fields).data,
+            'job_offer_model_serializer': lambda: JobOfferSerializer(job_offers, many=True).data,
+            'job_offer_lean': lambda: JobOfferListSerializer(job_offers, JobOfferListSerializer.default_fields).data,
+        }
+        results = {'rows': rows, 'paths': {}}
+        for name, path in paths.items():
+            results['paths'][name] = measure(path, repeat)
+            if options['profile']:
+                self.profile(name, path)
+        write_results(self, results)
+
+    def profile(self, name, path):
+        profiler = cProfile.Profile()
+        profiler.runcall(path)
+        output = StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(15)
+        self.stderr.write('--- {}\n{}'.format(name, output.getvalue()))
@@ -0,0 +1,70 @@
+import pymongo
+from django.core.management.base import BaseCommand, CommandError
+
+from ...api.views import OfferList, JobOfferList
+from ...models import Offer, JobOffer
+from ...mongo import get_collection, column, plan_stages
+
+LIST_VIEWS = (
+    (OfferList, Offer),
+    (JobOfferList, JobOffer),
+)
+
+# range filter field of each model, explained together with the equality filters
+RANGES = {
+    Offer: 'price',
+    JobOffer: 'min_salary',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Run explain() on the MongoDB queries behind every filter/ordering combination '
+        'of the offer and job offer list views and report collection scans.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any query scans a collection.')
+
+    def handle(self, *args, **options):
+        scans = 0
+        for view, model in LIST_VIEWS:
+            collection = get_collection(model)
+            sample = collection.find_one() or {}
+            range_column = column(model, RANGES[model])
+            for filters in self.filter_combinations(view):
+                query = {column(model, name): sample.get(column(model, name), 1) for name in filters}
+                ranged = dict(query, **{range_column: {'$gte': 0, '$lte': sample.get(range_column) or 1}})
+                for ordering in self.orderings(view):
+                    for label, mongo_query in ((filters, query), (filters + (RANGES[model] + ' range',), ranged)):
+                        stages = self.explain(collection, mongo_query, model, ordering)
+                        scans += 'COLLSCAN' in stages
+                        self.stdout.write('{:<10} {:<45} {:<16} {}'.format(
+                            model._meta.model_name,
+                            ','.join(label) or '-',
+                            ordering,
+                            ' > '.join(stages),
+                        ))
+
+        if scans and options['fail']:
+            raise CommandError('{} list queries scan a whole collection'.format(scans))
+        self.stdout.write('collection scans: {}'.format(scans))
+
+    def filter_combinations(self, view):
+        fields = tuple(view.filterset_class.Meta.fields)
+        yield ()
+        for name in fields:
+            yield (name,)
+        if 'city_id' in fields and 'category_id' in fields:
+            yield ('city_id', 'category_id')
+
+    def orderings(self, view):
+        for name in view.ordering_fields:
+            yield name
+            yield '-' + name
+
+    def explain(self, collection, query, model, ordering):
+        direction = pymongo.DESCENDING if ordering.startswith('-') else pymongo.ASCENDING
+        sort = [(column(model, ordering.lstrip('-')), direction), ('id', direction)]
+        plan = collection.find(query).sort(sort).limit(20).explain()
+        return plan_stages(plan['queryPlanner']['winningPlan'])
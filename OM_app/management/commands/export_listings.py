@@ -0,0 +1,32 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import bulk
+
+
+class Command(BaseCommand):
+    help = 'Stream every offer or job offer to a CSV/NDJSON file (- for stdout).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(bulk.KINDS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=bulk.FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if format not in bulk.FORMATS:
+            raise CommandError('Unknown format, pass --format {}'.format('|'.join(bulk.FORMATS)))
+
+        to_stdout = options['path'] == '-'
+        stream = sys.stdout if to_stdout else open(options['path'], 'w', newline='', encoding='utf-8')
+        try:
+            result = bulk.export_rows(options['kind'], stream, format, batch_size=options['batch_size'])
+        finally:
+            if not to_stdout:
+                stream.close()
+        # the rows own stdout when exporting to it
+        (self.stderr if to_stdout else self.stdout).write(json.dumps(result))
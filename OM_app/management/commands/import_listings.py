@@ -0,0 +1,37 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream offers or job offers from a CSV/NDJSON file (- for stdin) into the database. '
+        'Rejected rows are reported as JSON lines on stderr, the import goes on.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(bulk.KINDS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=bulk.FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-index', action='store_true', help='Leave the imported rows out of the search index (rebuild_search_index adds them).')
+
+    def handle(self, *args, **options):
+        format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if format not in bulk.FORMATS:
+            raise CommandError('Unknown format, pass --format {}'.format('|'.join(bulk.FORMATS)))
+
+        def report(line_number, errors):
+            self.stderr.write(json.dumps({'line': line_number, 'errors': errors}, ensure_ascii=False))
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        with stream:
+            result = bulk.import_rows(
+                options['kind'], stream, format,
+                batch_size=options['batch_size'], on_error=report, index=not options['no_index']
+            )
+        self.stdout.write(json.dumps(result))
@@ -0,0 +1,41 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from ... import geo
+from ...api import refdata
+from ...models import City, Voivodeship
+from ...search import normalize
+
+
+class Command(BaseCommand):
+    help = (
+        'Set City.latitude/longitude from a CSV file with the columns '
+        'voivodeship,city,latitude,longitude, matched by name ignoring case and diacritics.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        voivodeships = dict(Voivodeship.objects.values_list('id', 'name'))
+        cities = {
+            (normalize(voivodeships.get(voivodeship_id)), normalize(name)): pk
+            for pk, voivodeship_id, name in City.objects.values_list('id', 'voivodeship_id', 'name')
+        }
+        updated, unknown = 0, []
+        with open(options['path'], newline='', encoding='utf-8') as stream:
+            for row in csv.DictReader(stream):
+                pk = cities.get((normalize(row['voivodeship']), normalize(row['city'])))
+                if pk is None:
+                    unknown.append('{}/{}'.format(row['voivodeship'], row['city']))
+                    continue
+                # update() skips the signals, the caches are dropped below
+                City.objects.filter(id=pk).update(latitude=float(row['latitude']), longitude=float(row['longitude']))
+                updated += 1
+
+        geo.invalidate()
+        refdata.invalidate('voivodeships-cities')
+        self.stdout.write('Updated {} cities'.format(updated))
+        if unknown:
+            self.stderr.write('Unknown cities: {}'.format(', '.join(unknown)))
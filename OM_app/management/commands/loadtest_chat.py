@@ -0,0 +1,33 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ...consumers import ChatConsumer, AsyncChatConsumer
+from ._bench import benchmark_database, chat_fanout, seed_chat, write_results
+
+CONSUMERS = {
+    'sync': ChatConsumer,
+    'async': AsyncChatConsumer,
+}
+
+
+class Command(BaseCommand):
+    help = 'Chat fan-out load test of the sync and async consumers on the in-memory channel layer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='Sockets connected to the chat room.')
+        parser.add_argument('--messages', type=int, default=100, help='Messages sent, round robin over the clients.')
+        parser.add_argument('--consumers', default='sync,async')
+        parser.add_argument('--keep-db', action='store_true', help='Use the configured database instead of a test one.')
+
+    def handle(self, *args, **options):
+        results = {'clients': options['clients'], 'messages': options['messages'], 'consumers': {}}
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        with benchmark_database(options['keep_db']), override_settings(CHANNEL_LAYERS=layers):
+            chat, users = seed_chat(2)
+            for name in options['consumers'].split(','):
+                results['consumers'][name] = asyncio.run(chat_fanout(
+                    CONSUMERS[name], chat.pk, users[0], options['clients'], options['messages']
+                ))
+        write_results(self, results)
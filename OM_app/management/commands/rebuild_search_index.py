@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the offers/job offers search index (needed after bulk inserts, which skip signals).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help='Any of {}, defaults to all.'.format(', '.join(sorted(search.INDEXES))))
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or sorted(search.INDEXES)
+        unknown = set(kinds) - set(search.INDEXES)
+        if unknown:
+            raise CommandError('Unknown index: {}'.format(', '.join(sorted(unknown))))
+        for kind in kinds:
+            count = search.rebuild(kind)
+            self.stdout.write('{}: indexed {} objects'.format(kind, count))
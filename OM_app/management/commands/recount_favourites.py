@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import favourites
+
+
+class Command(BaseCommand):
+    help = 'Recompute favourite_count of offers/job offers (needed after bulk inserts, which skip signals).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help='Any of {}, defaults to all.'.format(', '.join(sorted(favourites.KINDS))))
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or sorted(favourites.KINDS)
+        unknown = set(kinds) - set(favourites.KINDS)
+        if unknown:
+            raise CommandError('Unknown kind: {}'.format(', '.join(sorted(unknown))))
+        for kind in kinds:
+            count = favourites.recount(kind)
+            self.stdout.write('{}: counted favourites of {} objects'.format(kind, count))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...chat_writer import get_config, recover
+
+
+class Command(BaseCommand):
+    help = 'Store chat messages left in the write-behind journals by crashed processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dead-letters', action='store_true',
+            help='Also retry the messages the writers gave up on, once the cause is fixed.',
+        )
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if not config['JOURNAL_DIR']:
+            raise CommandError('CHAT_WRITE_BEHIND has no JOURNAL_DIR')
+        stored = recover(config['JOURNAL_DIR'], config['BATCH_SIZE'])
+        self.stdout.write('recovered {} messages'.format(stored))
+        if options['dead_letters']:
+            directory = config['DEAD_LETTER_DIR'] or config['JOURNAL_DIR']
+            stored = recover(directory, config['BATCH_SIZE'], pattern='dead-letters-*.ndjson')
+            self.stdout.write('stored {} dead-lettered messages'.format(stored))
@@ -0,0 +1,137 @@
+import asyncio
+import random
+import subprocess
+import sys
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from ...consumers import AsyncChatConsumer
+from ...models import City, Offer, OfferCategory
+from ._bench import WORDS, benchmark_database, bench_user, chat_fanout, latencies, seed_chat, seed_dataset, write_results
+
+SCENARIOS = (
+    'offer_browsing', 'job_offer_browsing', 'search', 'favourites_toggle',
+    'favourites_list', 'chat_inbox', 'chat_fanout',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Scripted REST and WebSocket scenarios over a seeded marketplace. '
+        'Prints JSON (or writes it to --output) so runs can be diffed between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--offers', type=int, default=5000)
+        parser.add_argument('--job-offers', type=int, default=2000)
+        parser.add_argument('--favourites', type=int, default=20)
+        parser.add_argument('--chats', type=int, default=50)
+        parser.add_argument('--iterations', type=int, default=200, help='Requests per REST scenario.')
+        parser.add_argument('--clients', type=int, default=50, help='Sockets of the chat fan-out scenario.')
+        parser.add_argument('--messages', type=int, default=100, help='Messages of the chat fan-out scenario.')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--output', help='Also write the results to this file.')
+        parser.add_argument('--keep-db', action='store_true', help='Use the already seeded configured database.')
+        parser.add_argument('--response-cache', action='store_true', help='Keep the anonymous response cache on.')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+
+        results = {
+            'commit': self.git_commit(),
+            'started': datetime.utcnow().isoformat(),
+            'python': sys.version.split()[0],
+            'options': {name: options[name] for name in ('users', 'offers', 'job_offers', 'favourites', 'chats', 'iterations')},
+            'scenarios': {},
+        }
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        with benchmark_database(options['keep_db'], options['response_cache']), override_settings(CHANNEL_LAYERS=layers):
+            if not options['keep_db']:
+                seed_dataset(options['users'], options['offers'], options['job_offers'], options['favourites'], options['chats'])
+            self.rng = random.Random(0)
+            self.city_ids = list(City.objects.values_list('id', flat=True))
+            self.category_ids = list(OfferCategory.objects.values_list('id', flat=True))
+            self.offer_ids = list(Offer.objects.values_list('id', flat=True)[:1000])
+            self.client = APIClient()
+            self.user = bench_user('seed0')    # owns offers, favourites and chats of the seeded data
+            self.client.force_authenticate(self.user)
+
+            for name in scenarios:
+                results['scenarios'][name] = getattr(self, name)(options)
+
+        write_results(self, results)
+        if options['output']:
+            write_results(self, results, options['output'])
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params or {})
+        if response.status_code != 200:
+            raise CommandError('GET {} {} returned {}'.format(url, params, response.status_code))
+        return response
+
+    def offer_browsing(self, options):
+        """
+        Filter by city and category, a random ordering, then follow the keyset cursor two pages deep.
+        """
+        def browse(i):
+            params = {
+                'city_id': self.rng.choice(self.city_ids),
+                'ordering': self.rng.choice(('-creation_date', 'price', '-price')),
+                'cursor': '',
+            }
+            if i % 2:
+                params['category_id'] = self.rng.choice(self.category_ids)
+            for _ in range(2):
+                next_url = self.get('/api/offers/', params).data['next']
+                if not next_url:
+                    break
+                params['cursor'] = parse_qs(urlparse(next_url).query)['cursor'][0]
+        return latencies(browse, options['iterations'])
+
+    def job_offer_browsing(self, options):
+        def browse(i):
+            self.get('/api/joboffers/', {
+                'city_id': self.rng.choice(self.city_ids),
+                'ordering': self.rng.choice(('-creation_date', 'max_salary', '-max_salary')),
+                'limit': 20,
+            })
+        return latencies(browse, options['iterations'])
+
+    def search(self, options):
+        def query(i):
+            word = self.rng.choice(WORDS)
+            self.get('/api/offers/', {'search': word if i % 2 else word[:3], 'limit': 20})
+        return latencies(query, options['iterations'])
+
+    def favourites_toggle(self, options):
+        def toggle(i):
+            offer_id = self.rng.choice(self.offer_ids)
+            self.client.post('/api/offers/favourites/', {'user_id': self.user.id, 'offer_id': offer_id}, format='json')
+            self.client.delete('/api/offers/favourites/?offer_id={}'.format(offer_id))
+        return latencies(toggle, options['iterations'])
+
+    def favourites_list(self, options):
+        for offer_id in self.offer_ids[:options['favourites']]:
+            self.client.post('/api/offers/favourites/', {'user_id': self.user.id, 'offer_id': offer_id}, format='json')
+        return latencies(lambda i: self.get('/api/offers/favourites/list/', {'limit': 20}), options['iterations'])
+
+    def chat_inbox(self, options):
+        return latencies(lambda i: self.get('/api/chat/inbox/'), options['iterations'])
+
+    def chat_fanout(self, options):
+        chat, users = seed_chat(2)
+        return asyncio.run(chat_fanout(AsyncChatConsumer, chat.pk, users[0], options['clients'], options['messages']))
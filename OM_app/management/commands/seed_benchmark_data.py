@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ._bench import seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Seed the configured database with users, offers, job offers, favourites and chats for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--offers', type=int, default=10000)
+        parser.add_argument('--job-offers', type=int, default=5000)
+        parser.add_argument('--favourites', type=int, default=20, help='Favourites of each kind per user.')
+        parser.add_argument('--chats', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = seed_dataset(
+            options['users'], options['offers'], options['job_offers'],
+            options['favourites'], options['chats'], seed=options['seed']
+        )
+        self.stdout.write('Seeded {} users, {} offers, {} job offers and {} chats'.format(
+            len(users), options['offers'], options['job_offers'], options['chats']
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...mail_queue import send_batch
+
+
+class Command(BaseCommand):
+    help = 'Send queued e-mails in batches over one SMTP connection, optionally forever.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls of an empty queue.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_batch()
+            if sent or failed:
+                self.stdout.write('sent {}, failed {}'.format(sent, failed))
+            elif not options['loop']:
+                return
+            else:
+                time.sleep(options['interval'])
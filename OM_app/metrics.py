@@ -0,0 +1,180 @@
+"""
+In-process request metrics rendered in the Prometheus text format.
+
+PerformanceMetricsMiddleware (OM_app/middleware.py) feeds the request
+histograms, `timing` lets views add named durations (the serializer time)
+and other subsystems publish gauges with `register_gauges`. The scrape
+endpoint only answers requests with SCRAPE_TOKEN as a bearer token or from
+one of SCRAPE_ADDRESSES, and nobody when neither is set.
+"""
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': False,     # add a Server-Timing header to every response
+    'SCRAPE_TOKEN': None,       # bearer token of the scraper
+    'SCRAPE_ADDRESSES': (),     # client addresses allowed without a token
+}
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PERFORMANCE_METRICS', {}))
+    return config
+
+
+def scrape_allowed(request):
+    config = get_config()
+    if request.META.get('REMOTE_ADDR') in config['SCRAPE_ADDRESSES']:
+        return True
+    token = config['SCRAPE_TOKEN']
+    if not token:
+        return False
+    return hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), 'Bearer {}'.format(token).encode())
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labels=()):
+        self.name, self.documentation, self.labels = name, documentation, labels
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            for labels, value in sorted(self.series.items()):
+                lines.append('{}{} {}'.format(self.name, format_labels(self.labels, labels), value))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        self.name, self.documentation, self.labels, self.buckets = name, documentation, labels, buckets
+        self.lock = threading.Lock()
+        self.series = {}    # labels: [count per bucket..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            for labels, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name, format_labels(self.labels + ('le',), labels + (bound,)), count
+                    ))
+                lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, labels), series[-1]))
+                lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, labels), series[-2]))
+        return lines
+
+
+REQUESTS = Counter('om_requests_total', 'Requests by route, method and status.', ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('om_request_duration_seconds', 'Wall time of requests.', ('route', 'method'))
+DB_QUERIES = Histogram('om_request_db_queries', 'Database queries per request.', ('route', 'method'), COUNT_BUCKETS)
+DB_SECONDS = Histogram('om_request_db_duration_seconds', 'Database time per request.', ('route', 'method'))
+SERIALIZER_SECONDS = Histogram('om_request_serializer_duration_seconds', 'Serializer time per request.', ('route', 'method'))
+RESPONSE_BYTES = Histogram('om_response_size_bytes', 'Size of response bodies.', ('route', 'method'), BYTES_BUCKETS)
+
+METRICS = [REQUESTS, REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, SERIALIZER_SECONDS, RESPONSE_BYTES]
+
+_gauges = {}
+
+
+def register(metric):
+    """
+    Publish a Counter or Histogram of another subsystem, returns it.
+    """
+    METRICS.append(metric)
+    return metric
+
+
+def register_gauges(prefix, collect):
+    """
+    `collect()` returns {name: number}, published as `<prefix>_<name>` gauges.
+    """
+    _gauges[prefix] = collect
+
+
+def observe_request(route, method, status, seconds, queries, db_seconds, size, timings):
+    labels = (route, method)
+    REQUESTS.inc((route, method, str(status)))
+    REQUEST_SECONDS.observe(labels, seconds)
+    DB_QUERIES.observe(labels, queries)
+    DB_SECONDS.observe(labels, db_seconds)
+    if size is not None:
+        RESPONSE_BYTES.observe(labels, size)
+    if 'serializer' in timings:
+        SERIALIZER_SECONDS.observe(labels, timings['serializer'])
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for prefix, collect in sorted(_gauges.items()):
+        for name, value in sorted(collect().items()):
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('{}_{} {}'.format(prefix, name, value))
+    return '\n'.join(lines) + '\n'
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting queries and their time.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+@contextmanager
+def timing(request, name):
+    """
+    Add the time spent in the block to the `name` timing of the request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = getattr(request, '_timings', None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
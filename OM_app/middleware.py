@@ -0,0 +1,70 @@
+import time
+from contextlib import ExitStack
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+
+
+@database_sync_to_async
+def get_token_user(raw_token):
+    from .api.authentication import user_for_token
+
+    return user_for_token(raw_token)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates websockets with `?token=<access token>`, browsers cannot set headers on them.
+    """
+    async def __call__(self, scope, receive, send):
+        raw_token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if raw_token:
+            user = await get_token_user(raw_token[0])
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
+
+
+class PerformanceMetricsMiddleware:
+    """
+    Records wall time, database queries and time, serializer time and response
+    size of every request per URL route, see OM_app/metrics.py. Goes first in
+    MIDDLEWARE so the whole stack is measured.
+    """
+    def __init__(self, get_response):
+        config = metrics.get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+
+    def __call__(self, request):
+        request._timings = {}
+        queries = metrics.QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.route if match is not None else 'unresolved'
+        size = None if response.streaming else len(response.content)
+        metrics.observe_request(route, request.method, response.status_code, seconds, queries.count, queries.seconds, size, request._timings)
+
+        if self.server_timing:
+            timings = ['total;dur={:.2f}'.format(seconds * 1000), 'db;dur={:.2f};desc="{} queries"'.format(queries.seconds * 1000, queries.count)]
+            timings.extend('{};dur={:.2f}'.format(name, value * 1000) for name, value in request._timings.items())
+            response['Server-Timing'] = ', '.join(timings)
+        return response
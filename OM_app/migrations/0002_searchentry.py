@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('token', models.CharField(max_length=40)),
+                ('object_id', models.PositiveIntegerField()),
+                ('weight', models.PositiveSmallIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchentry',
+            index=models.Index(fields=['kind', 'token'], name='search_kind_token_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchentry',
+            index=models.Index(fields=['kind', 'object_id'], name='search_kind_object_idx'),
+        ),
+    ]
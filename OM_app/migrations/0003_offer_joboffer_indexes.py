@@ -0,0 +1,83 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0002_searchentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['-creation_date', '-id'], name='offer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['price', 'id'], name='offer_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['category_id', '-creation_date', '-id'], name='offer_cat_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['category_id', 'price', 'id'], name='offer_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['city_id', '-creation_date', '-id'], name='offer_city_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['city_id', 'price', 'id'], name='offer_city_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['city_id', 'category_id', '-creation_date'], name='offer_city_cat_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['user_id', '-creation_date'], name='offer_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['-creation_date', '-id'], name='joboffer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['max_salary', 'id'], name='joboffer_salary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['category_id', '-creation_date', '-id'], name='joboffer_cat_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['category_id', 'max_salary', 'id'], name='joboffer_cat_salary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['city_id', '-creation_date', '-id'], name='joboffer_city_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['city_id', 'max_salary', 'id'], name='joboffer_city_salary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['city_id', 'category_id', '-creation_date'], name='joboffer_city_cat_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['user_id', '-creation_date'], name='joboffer_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['remote', '-creation_date'], name='joboffer_remote_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['min_salary', 'id'], name='joboffer_min_salary_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def messages_m2m_to_fk(apps, schema_editor):
+    Chat = apps.get_model('OM_app', 'Chat')
+    Message = apps.get_model('OM_app', 'Message')
+    through = Chat._meta.get_field('messages').remote_field.through
+
+    chat_messages = {}
+    for chat_id, message_id in through.objects.values_list('chat_id', 'message_id'):
+        chat_messages.setdefault(chat_id, []).append(message_id)
+    for chat_id, message_ids in chat_messages.items():
+        Message.objects.filter(id__in=message_ids).update(chat_id=chat_id)
+
+
+def messages_fk_to_m2m(apps, schema_editor):
+    Chat = apps.get_model('OM_app', 'Chat')
+    Message = apps.get_model('OM_app', 'Message')
+    through = Chat._meta.get_field('messages').remote_field.through
+
+    through.objects.bulk_create([
+        through(chat_id=chat_id, message_id=message_id)
+        for message_id, chat_id in Message.objects.filter(chat__isnull=False).values_list('id', 'chat_id')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0003_offer_joboffer_indexes'),
+    ]
+
+    operations = [
+        # hidden reverse accessor until the many-to-many `Chat.messages` is gone
+        migrations.AddField(
+            model_name='message',
+            name='chat',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='OM_app.Chat'),
+        ),
+        migrations.RunPython(messages_m2m_to_fk, messages_fk_to_m2m),
+        migrations.RemoveField(
+            model_name='chat',
+            name='messages',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='chat',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='OM_app.Chat'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', '-timestamp', '-id'], name='message_chat_time_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0005_message_client_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadMarker',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='OM_app.Chat')),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='OM_app.Contact')),
+            ],
+            options={
+                'unique_together': {('chat', 'contact')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0006_chatreadmarker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='image_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
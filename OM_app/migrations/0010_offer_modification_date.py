@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0009_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='modification_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['modification_date', 'id'], name='offer_modified_idx'),
+        ),
+    ]
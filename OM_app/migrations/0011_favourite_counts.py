@@ -0,0 +1,64 @@
+from django.db import migrations, models
+from pymongo import UpdateOne
+
+
+# (favourite model, field pointing at the favourited object, favourited model)
+FAVOURITES = (
+    ('FavouriteOffer', 'offer_id', 'Offer'),
+    ('FavouriteJobOffer', 'job_offer_id', 'JobOffer'),
+)
+
+
+def deduplicate_and_count(apps, schema_editor):
+    """
+    Keep the oldest of duplicated favourites, so the unique index can be built, then count them.
+    """
+    database = schema_editor.connection.connection
+    for favourite_name, field, target_name in FAVOURITES:
+        favourite = apps.get_model('OM_app', favourite_name)
+        target = apps.get_model('OM_app', target_name)
+
+        seen, duplicates = set(), []
+        for pk, user_id, object_id in favourite.objects.order_by('id').values_list('id', 'user_id', field):
+            if (user_id, object_id) in seen:
+                duplicates.append(pk)
+            seen.add((user_id, object_id))
+        if duplicates:
+            favourite.objects.filter(id__in=duplicates).delete()
+
+        object_column = favourite._meta.get_field(field).column
+        counts = database[favourite._meta.db_table].aggregate([
+            {'$group': {'_id': '$' + object_column, 'count': {'$sum': 1}}},
+        ])
+        updates = [UpdateOne({'id': row['_id']}, {'$set': {'favourite_count': row['count']}}) for row in counts]
+        if updates:
+            database[target._meta.db_table].bulk_write(updates, ordered=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0010_offer_modification_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='favourite_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='joboffer',
+            name='favourite_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(deduplicate_and_count, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='favouriteoffer',
+            unique_together={('user_id', 'offer_id')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='favouritejoboffer',
+            unique_together={('user_id', 'job_offer_id')},
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OM_app', '0011_favourite_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['city_id', 'category_id', 'price', 'id'], name='offer_city_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['category_id', 'min_salary', 'id'], name='joboffer_cat_minsal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['city_id', 'min_salary', 'id'], name='joboffer_city_minsal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['city_id', 'category_id', 'min_salary'], name='joboffer_city_cat_minsal_idx'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from django.utils import timezone
 import json
 from django.forms.models import model_to_dict
 
@@ -39,6 +40,7 @@ class User(AbstractBaseUser):
     date_joined = models.DateTimeField(auto_now_add=True, null=True)  # date of creation account, automatic
 
     password = models.CharField(max_length=128) # NOTE max 128 characters for password
+    token_version = models.PositiveIntegerField(default=0)  # bumped to invalidate all issued tokens
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username',]  # ex ['first_name'] #py manage.py createsuperuser
@@ -77,9 +79,39 @@ class City(models.Model):
         max_length=30,
     )
 
+    # WGS84 degrees, for the `near=` list filter (see OM_app/geo.py)
+    latitude = models.FloatField(
+        null=True,
+        blank=True
+    )
+
+    longitude = models.FloatField(
+        null=True,
+        blank=True
+    )
+
     def __str__(self):
         return self.name
 
+class CounterFieldsMixin:
+    """
+    `counter_fields` only change through atomic $inc updates (OM_app/favourites.py)
+    and `worker_fields` through the conditional updates of a background worker
+    (OM_app/images.py), so save() of a loaded object leaves them out instead of
+    writing back the values it was loaded with.
+    """
+    counter_fields = ()
+    worker_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+                and field.name not in self.worker_fields
+            ]
+        super().save(*args, **kwargs)
+
 class OfferCategory(models.Model):
     """
     Category for an offer with an "icon" property for an icon name.
@@ -95,7 +127,7 @@ class OfferCategory(models.Model):
     def __str__(self):
         return self.name
 
-class Offer(models.Model):
+class Offer(CounterFieldsMixin, models.Model):
     """
     Model of offer published by user (not job offer).
     """
@@ -132,11 +164,58 @@ class Offer(models.Model):
         auto_now_add=True
     )
 
+    # incremental exports, update() calls set it explicitly
+    modification_date = models.DateTimeField(
+        auto_now=True
+    )
+
     image = models.ImageField(
         upload_to ='offers_images/',
         blank=True
     )
 
+    # uploads are processed in the background, see OM_app/images.py
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PENDING, 'Pending'),
+        (IMAGE_READY, 'Ready'),
+        (IMAGE_FAILED, 'Failed'),
+    )
+
+    image_status = models.CharField(
+        max_length=10,
+        choices=IMAGE_STATUSES,
+        blank=True
+    )
+
+    image_version = models.PositiveIntegerField(
+        default=0
+    )
+
+    # maintained by the favourite signals, see OM_app/favourites.py
+    favourite_count = models.PositiveIntegerField(
+        default=0
+    )
+    counter_fields = ('favourite_count',)
+    worker_fields = ('image', 'image_status', 'image_version')
+
+    class Meta:
+        # equality filters first, then the sort key and `id` for keyset pagination
+        indexes = [
+            models.Index(fields=['-creation_date', '-id'], name='offer_date_idx'),
+            models.Index(fields=['price', 'id'], name='offer_price_idx'),
+            models.Index(fields=['category_id', '-creation_date', '-id'], name='offer_cat_date_idx'),
+            models.Index(fields=['category_id', 'price', 'id'], name='offer_cat_price_idx'),
+            models.Index(fields=['city_id', '-creation_date', '-id'], name='offer_city_date_idx'),
+            models.Index(fields=['city_id', 'price', 'id'], name='offer_city_price_idx'),
+            models.Index(fields=['city_id', 'category_id', '-creation_date'], name='offer_city_cat_date_idx'),
+            models.Index(fields=['city_id', 'category_id', 'price', 'id'], name='offer_city_cat_price_idx'),
+            models.Index(fields=['user_id', '-creation_date'], name='offer_user_date_idx'),
+            models.Index(fields=['modification_date', 'id'], name='offer_modified_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -151,7 +230,7 @@ class JobOfferCategory(models.Model):
     def __str__(self):
         return self.name
 
-class JobOffer(models.Model):
+class JobOffer(CounterFieldsMixin, models.Model):
     """
     Job offer model.
     """
@@ -196,6 +275,31 @@ class JobOffer(models.Model):
         default=False
     )
 
+    # maintained by the favourite signals, see OM_app/favourites.py
+    favourite_count = models.PositiveIntegerField(
+        default=0
+    )
+    counter_fields = ('favourite_count',)
+
+    class Meta:
+        # equality filters first, then the sort key and `id` for keyset pagination
+        indexes = [
+            models.Index(fields=['-creation_date', '-id'], name='joboffer_date_idx'),
+            models.Index(fields=['max_salary', 'id'], name='joboffer_salary_idx'),
+            models.Index(fields=['category_id', '-creation_date', '-id'], name='joboffer_cat_date_idx'),
+            models.Index(fields=['category_id', 'max_salary', 'id'], name='joboffer_cat_salary_idx'),
+            models.Index(fields=['city_id', '-creation_date', '-id'], name='joboffer_city_date_idx'),
+            models.Index(fields=['city_id', 'max_salary', 'id'], name='joboffer_city_salary_idx'),
+            models.Index(fields=['city_id', 'category_id', '-creation_date'], name='joboffer_city_cat_date_idx'),
+            models.Index(fields=['user_id', '-creation_date'], name='joboffer_user_date_idx'),
+            models.Index(fields=['remote', '-creation_date'], name='joboffer_remote_date_idx'),
+            models.Index(fields=['min_salary', 'id'], name='joboffer_min_salary_idx'),
+            # salary range filters, see JobOfferFilter
+            models.Index(fields=['category_id', 'min_salary', 'id'], name='joboffer_cat_minsal_idx'),
+            models.Index(fields=['city_id', 'min_salary', 'id'], name='joboffer_city_minsal_idx'),
+            models.Index(fields=['city_id', 'category_id', 'min_salary'], name='joboffer_city_cat_minsal_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -220,8 +324,19 @@ class Contact(models.Model):
 class Message(models.Model):
     contact = models.ForeignKey(
         Contact, related_name='messages', on_delete=models.CASCADE)
+    # history of a chat is read through the (chat, timestamp) index
+    chat = models.ForeignKey(
+        'Chat', related_name='messages', on_delete=models.CASCADE, null=True, blank=True)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the message is received, it may be stored later by the write-behind queue
+    timestamp = models.DateTimeField(default=timezone.now)
+    # id generated by the client (or the consumer), makes write-behind retries idempotent
+    client_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', '-timestamp', '-id'], name='message_chat_time_idx'),
+        ]
 
     def __str__(self):
         return "{}".format(self.contact.user_id)
@@ -230,11 +345,26 @@ class Message(models.Model):
 class Chat(models.Model):
     participants = models.ManyToManyField(
         Contact, related_name='chats', blank=True)
-    messages = models.ManyToManyField(Message, blank=True)
 
     def __str__(self):
         return "{}".format(self.pk)
 
+class ChatReadMarker(models.Model):
+    """
+    When a participant last read a chat, for the unread counts of the inbox.
+    """
+    chat = models.ForeignKey(
+        Chat, related_name='read_markers', on_delete=models.CASCADE)
+    contact = models.ForeignKey(
+        Contact, related_name='read_markers', on_delete=models.CASCADE)
+    last_read = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('chat', 'contact')
+
+    def __str__(self):
+        return "{} {}".format(self.chat_id, self.contact_id)
+
 class FavouriteOffer(models.Model):
     user_id = models.ForeignKey(
         User,
@@ -246,6 +376,9 @@ class FavouriteOffer(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        unique_together = ('user_id', 'offer_id')
+
     def __str__(self):
         return self.offer_id.name
 
@@ -259,6 +392,106 @@ class FavouriteJobOffer(models.Model):
         JobOffer,
         on_delete=models.CASCADE,
     )
-    
+
+    class Meta:
+        unique_together = ('user_id', 'job_offer_id')
+
     def __str__(self):
         return self.offer_id.name
+
+# search
+
+class SearchEntry(models.Model):
+    """
+    Posting of the offers/job offers inverted index, see OM_app/search.py.
+    """
+    kind = models.CharField(
+        max_length=10
+    )
+
+    token = models.CharField(
+        max_length=40
+    )
+
+    object_id = models.PositiveIntegerField()
+
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'token'], name='search_kind_token_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_kind_object_idx'),
+        ]
+
+    def __str__(self):
+        return "{} {} {}".format(self.kind, self.token, self.object_id)
+
+# e-mails
+
+class OutgoingEmail(models.Model):
+    """
+    E-mail waiting in the outbound queue, sent by the send_queued_mail worker (OM_app/mail_queue.py).
+    """
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'   # gave up after MAIL_QUEUE['MAX_ATTEMPTS']
+    STATUSES = (
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    )
+
+    subject = models.CharField(
+        max_length=200
+    )
+
+    # rendered by the worker: `<template>.txt` and, if it exists, `<template>.html`
+    template = models.CharField(
+        max_length=100
+    )
+
+    context = models.TextField()    # JSON
+
+    from_email = models.CharField(
+        max_length=320
+    )
+
+    to = models.TextField()     # comma separated addresses
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED
+    )
+
+    attempts = models.PositiveSmallIntegerField(
+        default=0
+    )
+
+    # next try when queued, end of the worker's lease when sending
+    next_attempt = models.DateTimeField(
+        default=timezone.now
+    )
+
+    last_error = models.TextField(
+        blank=True
+    )
+
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    sent = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='email_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return "{} {}".format(self.to, self.subject)
@@ -0,0 +1,97 @@
+"""
+Access to the pymongo objects behind djongo, for the few places that need
+MongoDB features the SQL translation layer does not expose.
+
+Connections are configured by the MONGODB setting (OM_project/settings.py):
+the 'default' alias reads from the primary, the READS alias from the read
+preference of read-only list views, except while primary_reads() is on,
+and raw pymongo writes pick the write concern of their operation class. Pool metrics, the health check and the
+startup warm-up are in OM_app/mongo_pool.py.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from pymongo import ReturnDocument
+from pymongo.write_concern import WriteConcern
+
+READS = 'reads'
+
+_local = threading.local()
+
+
+def read_alias():
+    """
+    Alias for reads that may lag behind the primary, 'default' when READS is
+    not configured or inside primary_reads().
+    """
+    if getattr(_local, 'primary', False) or READS not in settings.DATABASES:
+        return DEFAULT_DB_ALIAS
+    return READS
+
+
+@contextmanager
+def primary_reads():
+    """
+    read_alias() is the primary in this thread meanwhile: results that get
+    cached must not come from a secondary still missing the write that
+    invalidated the cache.
+    """
+    previous = getattr(_local, 'primary', False)
+    _local.primary = True
+    try:
+        yield
+    finally:
+        _local.primary = previous
+
+
+def write_concern(operation):
+    concerns = getattr(settings, 'MONGODB', {}).get('WRITE_CONCERNS', {})
+    return WriteConcern(**concerns.get(operation, concerns.get('default', {})))
+
+
+def get_database(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    connection.ensure_connection()
+    return connection.connection   # djongo keeps the pymongo Database here
+
+
+def get_collection(model, using=DEFAULT_DB_ALIAS, operation=None):
+    """
+    `operation` names a class of MONGODB['WRITE_CONCERNS'] for the writes made through the collection.
+    """
+    collection = get_database(using)[model._meta.db_table]
+    if operation is not None:
+        collection = collection.with_options(write_concern=write_concern(operation))
+    return collection
+
+
+def reserve_ids(model, count):
+    """
+    First of `count` consecutive primary keys of `model`, taken from djongo's
+    auto increment counter, for rows bulk inserted with their ids set.
+    """
+    auto = get_database()['__schema__'].find_one_and_update(
+        {'name': model._meta.db_table, 'auto': {'$exists': True}},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return auto['auto']['seq'] - count + 1
+
+
+def column(model, field_name):
+    return model._meta.get_field(field_name).column
+
+
+def plan_stages(plan):
+    """
+    Names of every stage of an explain() plan, depth first.
+    """
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'outerStage', 'innerStage'):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get('inputStages', ()):
+        stages.extend(plan_stages(child))
+    return stages
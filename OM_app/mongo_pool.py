@@ -0,0 +1,146 @@
+"""
+Connection pool metrics, health check and warm-up of the MongoDB clients.
+
+djongo creates one MongoClient per database alias and thread; the pool
+options come from MONGODB in OM_project/settings.py. PoolListener is
+registered with pymongo before the first client exists (OmAppConfig.ready)
+and counts the connections of every pool, published as `om_mongo_pool_*`
+gauges. `warm_up()` runs at ASGI/WSGI startup: a WSGI worker serves requests
+from the thread it warms, so its first request does not pay for server
+selection, TLS and authentication; under ASGI the request threads open their
+own clients and the warm-up only checks every alias is reachable.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from pymongo import monitoring
+
+from . import metrics
+from .mongo import get_database
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_SECONDS = metrics.register(metrics.Histogram(
+    'om_mongo_checkout_seconds', 'Time waited for a pooled MongoDB connection.'
+))
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """
+    Counts pools and connections of every client of this process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pools = 0
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.cleared = 0
+
+    def add(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def pool_created(self, event):
+        self.add(pools=1)
+
+    def pool_cleared(self, event):
+        self.add(cleared=1)
+
+    def pool_closed(self, event):
+        self.add(pools=-1)
+
+    def connection_created(self, event):
+        self.add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.add(open=-1)
+
+    def connection_check_out_started(self, event):
+        # the checkout finishes in the thread that started it
+        self.local.started = time.perf_counter()
+        self.add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self.add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        started = getattr(self.local, 'started', None)
+        if started is not None:
+            CHECKOUT_SECONDS.observe((), time.perf_counter() - started)
+        self.add(waiting=-1, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self.add(in_use=-1)
+
+    def metrics(self):
+        with self.lock:
+            capacity = self.pools * settings.MONGODB['MAX_POOL_SIZE']
+            return {
+                'pools': self.pools,
+                'connections_open': self.open,
+                'connections_in_use': self.in_use,
+                'checkouts_waiting': self.waiting,
+                'checkouts_total': self.checkouts,
+                'checkout_failures_total': self.checkout_failures,
+                'cleared_total': self.cleared,
+                'utilization': round(self.in_use / capacity, 4) if capacity else 0,
+            }
+
+
+listener = PoolListener()
+
+
+def install():
+    """
+    Called once from OmAppConfig.ready(), before any client is created.
+    """
+    monitoring.register(listener)
+    metrics.register_gauges('om_mongo_pool', listener.metrics)
+
+
+def ping(using):
+    """
+    Round trip time of a `ping` command in seconds, raises on an unreachable server.
+    """
+    start = time.perf_counter()
+    get_database(using).command('ping')
+    return time.perf_counter() - start
+
+
+def health():
+    """
+    (healthy, {alias: {'ok', 'seconds' or 'error'}}) for every database alias.
+    """
+    result = {}
+    for alias in connections:
+        try:
+            result[alias] = {'ok': True, 'seconds': round(ping(alias), 4)}
+        except Exception as e:
+            result[alias] = {'ok': False, 'error': str(e)}
+    return all(item['ok'] for item in result.values()), result
+
+
+def warm_up():
+    """
+    Open the clients of this thread and select a server for every alias, the
+    pools fill up to MIN_POOL_SIZE in the background. Failures are logged, the
+    process still starts and connects on the first request.
+    """
+    for alias in connections:
+        try:
+            seconds = ping(alias)
+        except Exception:
+            logger.warning('MongoDB warm-up of %r failed', alias, exc_info=True)
+        else:
+            logger.info('MongoDB %r ready in %.3fs', alias, seconds)
@@ -0,0 +1,321 @@
+"""
+Native pymongo reads for the hot read paths: the offer and job offer lists,
+their detail GETs, the favourites lists and the chat history.
+
+Every ORM query goes through djongo's SQL to MongoDB translation, which costs
+CPU on each request and gives up the index choice for filter + sort
+combinations. These paths build the query themselves: the FilterSet's
+mongo_conditions() (the ones of the facet counts), a projection of the
+columns the serializer reads and a hint naming the model index that matches
+the equality filters and the sort key. Rows come back as Documents, dicts of
+the values the ORM would return whose keys also read as attributes, so the
+lean list serializers, images.variant_urls and KeysetPagination take them as
+they take model instances; serializers that need model instances get them
+built with Model.from_db(). Writes, searches and the admin stay on the ORM.
+
+NativeReadsParityTests (OM_app/tests.py) compares both paths on the same
+requests and `manage.py bench_native_reads` times them.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django_filters.utils import translate_validation
+from bson.decimal128 import Decimal128
+from rest_framework.filters import OrderingFilter
+
+from .api.filters import IndexedSearchFilter, to_mongo
+from .models import Contact, Message
+from .mongo import get_collection, column, read_alias
+
+DEFAULTS = {
+    'ENABLED': True,
+    'HINTS': True,      # pass the matching model index as hint()
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'NATIVE_READS', {}))
+    return config
+
+
+def enabled():
+    return get_config()['ENABLED']
+
+
+class Document(dict):
+    """
+    Row of a native read, keyed by attname; keys can be read as attributes too.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def pk(self):
+        return self['id']
+
+
+# conversions of djongo's DatabaseOperations, the values pymongo returns are otherwise what the ORM returns
+
+def convert_date(value):
+    return value.date() if hasattr(value, 'date') else value
+
+
+def convert_datetime(value):
+    if value is not None and settings.USE_TZ and timezone.is_naive(value):
+        return timezone.make_aware(value, timezone.utc)    # pymongo returns naive UTC
+    return value
+
+
+def convert_decimal(value):
+    return value.to_decimal() if isinstance(value, Decimal128) else value
+
+
+CONVERTERS = {
+    'DateField': convert_date,
+    'DateTimeField': convert_datetime,
+    'DecimalField': convert_decimal,
+}
+
+_columns = {}
+
+
+def model_columns(model):
+    """
+    [(field name, column, attname, converter or None)] of the concrete fields of `model`.
+    """
+    columns = _columns.get(model)
+    if columns is None:
+        columns = _columns[model] = [
+            (field.name, field.column, field.attname, CONVERTERS.get(field.get_internal_type()))
+            for field in model._meta.concrete_fields
+        ]
+    return columns
+
+
+def choose_index(model, equality, sort_field):
+    """
+    Name of the model index made of the `equality` fields, in any order,
+    followed by `sort_field`; the shortest one when several match.
+    """
+    if sort_field is None:
+        return None
+    best = None
+    for index in model._meta.indexes:
+        names = [name.lstrip('-') for name in index.fields]
+        if set(names[:len(equality)]) != equality or names[len(equality):len(equality) + 1] != [sort_field]:
+            continue
+        if best is None or len(names) < len(best.fields):
+            best = index
+    return best and best.name
+
+
+_index_names = {}
+
+
+def existing_indexes(collection):
+    """
+    Index names of a collection, read once per process; a hint naming a missing index is an error.
+    """
+    key = (collection.database.name, collection.name)
+    names = _index_names.get(key)
+    if names is None:
+        names = _index_names[key] = frozenset(collection.index_information())
+    return names
+
+
+class DocumentQuery:
+    """
+    A find() on the collection of `model`, chained, counted and sliced like the
+    QuerySet methods the views and paginations use. Rows are Documents, or
+    model instances after `as_instances()`.
+    """
+    def __init__(self, model, columns=None, using=DEFAULT_DB_ALIAS):
+        self.model = model
+        self.columns = columns      # field names to load, every field when None
+        self.using = using
+        self.conditions = []
+        self.equality = frozenset()     # fields restricted to one value or a list, for the hint
+        self.ordering = ()
+        self.instances = False
+
+    def clone(self):
+        query = DocumentQuery(self.model, self.columns, self.using)
+        query.conditions = list(self.conditions)
+        query.equality, query.ordering, query.instances = self.equality, self.ordering, self.instances
+        return query
+
+    def filter(self, condition, field=None):
+        """
+        Add a MongoDB condition; `field` names the field it restricts to one value or a list of them.
+        """
+        query = self.clone()
+        query.conditions.append(condition)
+        if field is not None:
+            query.equality = query.equality | {field}
+        return query
+
+    def order_by(self, *ordering):
+        query = self.clone()
+        query.ordering = ordering
+        return query
+
+    def as_instances(self):
+        query = self.clone()
+        query.instances = True
+        return query
+
+    def after(self, field, descending, value, pk):
+        """
+        Rows after (value of `field`, pk) in that order, KeysetPagination.filter_after for documents.
+        """
+        after_pk = {'id': {'$lt' if descending else '$gt': pk}}
+        if field == 'id':
+            return self.filter(after_pk)
+
+        name = column(self.model, field)
+        # MongoDB sorts nulls first in ascending and last in descending order
+        if value is None:
+            position = {'$and': [{name: None}, after_pk]}
+            if not descending:
+                position = {'$or': [position, {name: {'$ne': None}}]}
+            return self.filter(position)
+
+        value = to_mongo(value, self.model._meta.get_field(field))
+        positions = [{name: {'$lt' if descending else '$gt': value}}, {'$and': [{name: value}, after_pk]}]
+        if descending and self.model._meta.get_field(field).null:
+            positions.append({name: None})
+        return self.filter({'$or': positions})
+
+    @property
+    def query(self):
+        if not self.conditions:
+            return {}
+        return self.conditions[0] if len(self.conditions) == 1 else {'$and': self.conditions}
+
+    def get_collection(self):
+        return get_collection(self.model, self.using)
+
+    def get_hint(self, collection):
+        if not get_config()['HINTS']:
+            return None
+        sort_field = self.ordering[0].lstrip('-') if self.ordering else None
+        name = choose_index(self.model, self.equality, sort_field)
+        return name if name in existing_indexes(collection) else None
+
+    def count(self):
+        collection = self.get_collection()
+        hint = self.get_hint(collection)
+        return collection.count_documents(self.query, **({'hint': hint} if hint else {}))
+
+    def fetch(self, offset=0, limit=None):
+        collection = self.get_collection()
+        fields = [
+            (name, db_column, attname, convert) for name, db_column, attname, convert in model_columns(self.model)
+            if self.columns is None or name in self.columns or name == 'id'
+        ]
+        cursor = collection.find(self.query, dict({db_column: True for _, db_column, _, _ in fields}, _id=False))
+        if self.ordering:
+            cursor = cursor.sort([
+                (column(self.model, term.lstrip('-')), -1 if term.startswith('-') else 1) for term in self.ordering
+            ])
+        hint = self.get_hint(collection)
+        if hint:
+            cursor = cursor.hint(hint)
+        if offset:
+            cursor = cursor.skip(offset)
+        if limit is not None:
+            if limit <= 0:
+                return []
+            cursor = cursor.limit(limit)
+
+        rows = []
+        for raw in cursor:
+            values = [
+                convert(raw.get(db_column)) if convert else raw.get(db_column)
+                for _, db_column, _, convert in fields
+            ]
+            if self.instances:
+                rows.append(self.model.from_db(self.using, [attname for _, _, attname, _ in fields], values))
+            else:
+                rows.append(Document(zip((attname for _, _, attname, _ in fields), values)))
+        return rows
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('DocumentQuery only supports slices without a step')
+        start = item.start or 0
+        return self.fetch(start, None if item.stop is None else item.stop - start)
+
+    def __iter__(self):
+        return iter(self.fetch())
+
+    def __len__(self):
+        return len(self.fetch())
+
+
+def list_documents(view, request, columns):
+    """
+    The rows of a list view (filterset_class, ordering_fields) as a DocumentQuery
+    on the read alias, None when the request needs the ORM: a search.
+    """
+    if not enabled() or IndexedSearchFilter().get_search_terms(request):
+        return None
+    filterset = view.filterset_class(request.query_params, queryset=view.get_queryset(), request=request)
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+
+    query = DocumentQuery(view.filterset_class._meta.model, columns, read_alias())
+    for field, condition in filterset.mongo_conditions():
+        query = query.filter(condition, field)
+    ordering = OrderingFilter().get_ordering(request, query, view)
+    if ordering:
+        query = query.order_by(*ordering)
+    return query
+
+
+def favourites(model, object_ids):
+    """
+    The favourited objects as model instances for the favourites lists.
+    """
+    return DocumentQuery(model).filter({'id': {'$in': sorted(object_ids)}}).as_instances()
+
+
+def get_instance(model, pk):
+    """
+    Model instance with primary key `pk`, None when there is none.
+    """
+    rows = DocumentQuery(model).filter({'id': pk}).as_instances()[:1]
+    return rows[0] if rows else None
+
+
+def messages_page(chat_id, before, limit):
+    """
+    Newest `limit` messages of the chat older than the message `before`, None
+    when that message is not in the chat. `message.contact.user_id` is the
+    author, as on the ORM messages.
+    """
+    chat = column(Message, 'chat')
+    query = DocumentQuery(Message, ('id', 'contact', 'chat', 'content', 'timestamp', 'client_id'))
+    query = query.filter({chat: chat_id}, 'chat')
+    if before is not None:
+        anchor = get_collection(Message).find_one({'id': before, chat: chat_id}, {'timestamp': True, '_id': False})
+        if anchor is None:
+            return None
+        timestamp = anchor['timestamp']
+        query = query.filter({'$or': [{'timestamp': {'$lt': timestamp}}, {'timestamp': timestamp, 'id': {'$lt': before}}]})
+    messages = query.order_by('-timestamp', '-id')[:limit]
+
+    contact_ids = sorted({message['contact_id'] for message in messages})
+    users = {
+        row['id']: row.get('user_id') for row in
+        get_collection(Contact).find({'id': {'$in': contact_ids}}, {'id': True, 'user_id': True, '_id': False})
+    }
+    for message in messages:
+        message['contact'] = Document(id=message['contact_id'], user_id=users.get(message['contact_id']))
+    return messages
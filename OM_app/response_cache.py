@@ -0,0 +1,116 @@
+"""
+Shared cache of rendered anonymous list responses (offers and job offers).
+
+Responses are stored in the RESPONSE_CACHE['CACHE'] alias of CACHES under a
+key made of the kind, its generation counter and a hash of the normalized
+query string, host and Accept header. Offer/JobOffer signals bump the
+generation (see OM_app/signals.py), which makes every cached page of that kind
+unreachable at once; the old entries simply expire. The generations live in
+MongoDB (OM_app/generations.py), so a change made by any process reaches the
+others within CHECK_INTERVAL seconds even when each has its own cache.
+
+On a miss only one process recomputes a page: it takes a lock with
+cache.add(), the others wait for the page to appear for up to WAIT seconds
+before computing it themselves. Both the local memory cache and a Redis cache
+(django-redis) implement add() atomically; use a shared one when running
+several processes.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from . import generations, metrics
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',     # alias in CACHES
+    'TTL': 60,              # seconds a page is served from the cache
+    'LOCK_TIMEOUT': 10,     # seconds, longer than the slowest page
+    'WAIT': 2,              # seconds to wait for another process computing the page
+    'POLL': 0.02,           # seconds between checks while waiting
+}
+
+RESULTS = metrics.register(metrics.Counter(
+    'om_response_cache_total', 'Anonymous list responses by cache result.', ('kind', 'result')
+))
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'RESPONSE_CACHE', {}))
+    return config
+
+
+def get_cache():
+    return caches[get_config()['CACHE']]
+
+
+def generation_name(kind):
+    return 'response-cache:{}'.format(kind)
+
+
+def invalidate(kind):
+    generations.bump(generation_name(kind))
+
+
+def cacheable(request):
+    # the API authenticates with JWT headers only, no header means an anonymous request
+    return request.method == 'GET' and 'HTTP_AUTHORIZATION' not in request.META and get_config()['ENABLED']
+
+
+def page_key(kind, generation, request):
+    query = sorted(
+        (name, sorted(value for value in values if value != ''))
+        for name, values in request.GET.lists()
+    )
+    raw = repr((request.get_host(), request.path, request.META.get('HTTP_ACCEPT', ''), query))
+    return 'response-cache:{}:{}:{}'.format(kind, generation, hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def to_response(entry, result):
+    content, content_type = entry
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Cache'] = result
+    return response
+
+
+def fetch(kind, request, compute):
+    """
+    Cached response of `request`; `compute()` returns a rendered response and
+    is only cached when it is a 200.
+    """
+    config = get_config()
+    cache = get_cache()
+    generation = generations.current(generation_name(kind))
+    key = page_key(kind, generation, request)
+
+    entry = cache.get(key)
+    if entry is not None:
+        RESULTS.inc((kind, 'hit'))
+        return to_response(entry, 'HIT')
+
+    lock = key + ':lock'
+    if not cache.add(lock, 1, config['LOCK_TIMEOUT']):
+        # someone else is computing this page
+        deadline = time.monotonic() + config['WAIT']
+        while time.monotonic() < deadline:
+            time.sleep(config['POLL'])
+            entry = cache.get(key)
+            if entry is not None:
+                RESULTS.inc((kind, 'wait'))
+                return to_response(entry, 'HIT')
+        RESULTS.inc((kind, 'timeout'))
+        return compute()
+
+    try:
+        RESULTS.inc((kind, 'miss'))
+        response = compute()
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']), config['TTL'])
+        response['X-Cache'] = 'MISS'
+        return response
+    finally:
+        cache.delete(lock)
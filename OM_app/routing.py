@@ -1,8 +1,8 @@
 # chat/routing.py
 from django.urls import re_path
 
-from .consumers import ChatConsumer
+from .consumers import AsyncChatConsumer
 
 websocket_urlpatterns = [
-    re_path(r'^ws/chat/(?P<room_name>[^/]+)/$', ChatConsumer.as_asgi()),
+    re_path(r'^ws/chat/(?P<room_name>[^/]+)/$', AsyncChatConsumer.as_asgi()),
 ]
@@ -0,0 +1,113 @@
+"""
+Inverted index used by the offers/job offers search.
+
+Every indexed object is split into diacritic-free tokens stored as
+SearchEntry rows (kind, token, object_id, weight). A query looks the tokens
+up through the (kind, token) index, so the cost depends on the number of
+matching postings instead of the size of the catalog. Scoring and the
+intersection of the tokens run in one aggregation on the server, so every
+match is found however common its tokens are.
+"""
+import re
+import unicodedata
+
+from .models import SearchEntry, Offer, JobOffer
+from .mongo import get_collection
+
+MAX_TOKEN_LENGTH = 40
+MAX_RESULTS = 500       # ranked results of a search without an explicit ordering
+
+# kind: (model, ((field, weight), ...))
+INDEXES = {
+    'offer': (Offer, (('name', 3), ('description', 1))),
+    'joboffer': (JobOffer, (('name', 3), ('company', 2), ('description', 1))),
+}
+
+# letters that do not decompose under NFKD
+_TRANSLITERATION = str.maketrans({'ł': 'l', 'Ł': 'l'})
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    text = (text or '').translate(_TRANSLITERATION).lower()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [token[:MAX_TOKEN_LENGTH] for token in _TOKEN_RE.findall(normalize(text))]
+
+
+def build_entries(kind, obj):
+    weights = {}
+    for field, weight in INDEXES[kind][1]:
+        for token in tokenize(getattr(obj, field)):
+            weights[token] = max(weight, weights.get(token, 0))
+    return [
+        SearchEntry(kind=kind, token=token, object_id=obj.pk, weight=weight)
+        for token, weight in weights.items()
+    ]
+
+
+def index_object(kind, obj):
+    SearchEntry.objects.filter(kind=kind, object_id=obj.pk).delete()
+    SearchEntry.objects.bulk_create(build_entries(kind, obj))
+
+
+def index_new_objects(kind, objects, batch_size=1000):
+    """
+    Index objects that have no entries yet, e.g. the rows of a bulk import.
+    """
+    entries = [entry for obj in objects for entry in build_entries(kind, obj)]
+    SearchEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+
+def remove_object(kind, pk):
+    SearchEntry.objects.filter(kind=kind, object_id=pk).delete()
+
+
+def rebuild(kind, batch_size=1000):
+    """
+    Drop and rebuild the whole index for `kind`, returns number of indexed objects.
+    """
+    model = INDEXES[kind][0]
+    SearchEntry.objects.filter(kind=kind).delete()
+    count, entries = 0, []
+    for obj in model.objects.all().iterator(chunk_size=batch_size):
+        entries.extend(build_entries(kind, obj))
+        count += 1
+        if len(entries) >= batch_size:
+            SearchEntry.objects.bulk_create(entries)
+            entries = []
+    SearchEntry.objects.bulk_create(entries)
+    return count
+
+
+def search(kind, query, limit=MAX_RESULTS):
+    """
+    Ids of objects matching every token of `query`, best ranked first; all of
+    them when `limit` is None. The last token is matched as a prefix so
+    results follow the user typing.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    # a posting counts for every query token it matches, an object's score is
+    # the sum of its best weight per token and it needs all of them
+    conditions = [{'$eq': ['$token', token]} for token in tokens[:-1]]
+    conditions.append({'$eq': [{'$indexOfBytes': ['$token', tokens[-1]]}, 0]})
+    pipeline = [
+        {'$match': {'kind': kind, '$or': [{'token': {'$in': tokens[:-1]}}, {'token': {'$regex': '^' + re.escape(tokens[-1])}}]}},
+        {'$group': dict(
+            {'t{}'.format(i): {'$max': {'$cond': [condition, '$weight', 0]}} for i, condition in enumerate(conditions)},
+            _id='$object_id',
+        )},
+        {'$match': {'t{}'.format(i): {'$gt': 0} for i in range(len(conditions))}},
+        {'$project': {'score': {'$add': ['$t{}'.format(i) for i in range(len(conditions))]}}},
+        {'$sort': {'score': -1, '_id': -1}},
+    ]
+    if limit is not None:
+        pipeline.append({'$limit': limit})
+    cursor = get_collection(SearchEntry).aggregate(pipeline, allowDiskUse=True)
+    return [row['_id'] for row in cursor]
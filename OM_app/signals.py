@@ -0,0 +1,72 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import favourites, geo, response_cache, search
+from .api import refdata
+from .models import (
+    Offer, JobOffer, Voivodeship, City, OfferCategory, JobOfferCategory, FavouriteOffer, FavouriteJobOffer
+)
+
+# search index
+
+@receiver(post_save, sender=Offer)
+def index_offer(sender, instance, **kwargs):
+    search.index_object('offer', instance)
+
+@receiver(post_delete, sender=Offer)
+def unindex_offer(sender, instance, **kwargs):
+    search.remove_object('offer', instance.pk)
+
+@receiver(post_save, sender=JobOffer)
+def index_job_offer(sender, instance, **kwargs):
+    search.index_object('joboffer', instance)
+
+@receiver(post_delete, sender=JobOffer)
+def unindex_job_offer(sender, instance, **kwargs):
+    search.remove_object('joboffer', instance.pk)
+
+# anonymous list response cache
+
+@receiver([post_save, post_delete], sender=Offer)
+def invalidate_offer_pages(sender, **kwargs):
+    response_cache.invalidate('offer')
+
+@receiver([post_save, post_delete], sender=JobOffer)
+def invalidate_job_offer_pages(sender, **kwargs):
+    response_cache.invalidate('joboffer')
+
+# favourite counts
+
+@receiver(post_save, sender=FavouriteOffer)
+def count_favourite_offer(sender, instance, created, **kwargs):
+    if created:
+        favourites.changed('offer', instance.user_id_id, instance.offer_id_id, 1)
+
+@receiver(post_delete, sender=FavouriteOffer)
+def uncount_favourite_offer(sender, instance, **kwargs):
+    favourites.changed('offer', instance.user_id_id, instance.offer_id_id, -1)
+
+@receiver(post_save, sender=FavouriteJobOffer)
+def count_favourite_job_offer(sender, instance, created, **kwargs):
+    if created:
+        favourites.changed('joboffer', instance.user_id_id, instance.job_offer_id_id, 1)
+
+@receiver(post_delete, sender=FavouriteJobOffer)
+def uncount_favourite_job_offer(sender, instance, **kwargs):
+    favourites.changed('joboffer', instance.user_id_id, instance.job_offer_id_id, -1)
+
+# reference data cache
+
+@receiver([post_save, post_delete], sender=Voivodeship)
+@receiver([post_save, post_delete], sender=City)
+def invalidate_voivodeships_cities(sender, **kwargs):
+    refdata.invalidate('voivodeships-cities')
+    geo.invalidate()
+
+@receiver([post_save, post_delete], sender=OfferCategory)
+def invalidate_offers_categories(sender, **kwargs):
+    refdata.invalidate('offers-categories')
+
+@receiver([post_save, post_delete], sender=JobOfferCategory)
+def invalidate_job_offers_categories(sender, **kwargs):
+    refdata.invalidate('job-offers-categories')
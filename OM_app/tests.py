@@ -1,3 +1,937 @@
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import smtplib
+import tempfile
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, connection
+from rest_framework import serializers
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import bulk, chat_writer, generations, geo, images, mail_queue, response_cache, search
+from .api import authentication
+from .api.filters import OfferFilter, JobOfferFilter
+from .api.serializers import VersionedTokenRefreshSerializer
+from .chat_utils import get_inbox, mark_chat_read
+from .consumers import MessageJsonMixin
+from .mongo import primary_reads, read_alias
+from .models import (
+    Chat, ChatReadMarker, City, Contact, FavouriteJobOffer, FavouriteOffer, JobOffer, JobOfferCategory, Message, Offer,
+    OfferCategory, OutgoingEmail, SearchEntry, User, Voivodeship,
+)
+
+TODAY = date(2021, 3, 15)
+
+# every filter of OfferFilter/JobOfferFilter, sent with each ordering; {names} are ids of seed_marketplace()
+OFFER_FILTERS = (
+    {'city_id': '{city0}'},
+    {'user_id': '{user0}'},
+    {'category_id': '{category1}'},
+    {'min_price': '250'},
+    {'max_price': '499.99'},
+    {'min_price': '100.50', 'max_price': '700'},
+    {'created_after': (TODAY - timedelta(days=3)).isoformat()},
+    {'created_before': (TODAY - timedelta(days=2)).isoformat()},
+    {'created_after': (TODAY - timedelta(days=4)).isoformat(), 'created_before': (TODAY - timedelta(days=1)).isoformat()},
+    {'near': '52.23,21.01'},
+    {'near': '52.23,21.01', 'radius_km': '300'},
+    {'voivodeship_id': '{voivodeship1}'},
+    {'city_id': '{city1}', 'category_id': '{category0}', 'min_price': '100'},
+)
+JOB_OFFER_FILTERS = (
+    {'city_id': '{city0}'},
+    {'user_id': '{user1}'},
+    {'category_id': '{jobcategory2}'},
+    {'remote': 'true'},
+    {'remote': 'false'},
+    {'salary_min': '9000'},
+    {'salary_max': '6000'},
+    {'salary_min': '5000', 'salary_max': '12000'},
+    {'min_salary_f': '7000'},
+    {'created_after': (TODAY - timedelta(days=3)).isoformat()},
+    {'created_before': (TODAY - timedelta(days=2)).isoformat()},
+    {'near': '50.06,19.94', 'radius_km': '50'},
+    {'voivodeship_id': '{voivodeship0}'},
+    {'city_id': '{city2}', 'remote': 'true', 'salary_min': '4000'},
+)
+# filter parameters that only modify another one
+MODIFIERS = {'radius_km'}
+
+
+def seed_marketplace():
+    """
+    Two users, three cities in two voivodeships and offers/job offers spread
+    over prices, salaries (some without max_salary) and creation dates.
+    Returns the ids to fill the filter parameters with.
+    """
+    rng = random.Random(0)
+    users = [User.objects.create_user('user{}'.format(i), 'user{}@test.local'.format(i), 'test-password') for i in range(2)]
+    mazowieckie = Voivodeship.objects.create(name='mazowieckie')
+    malopolskie = Voivodeship.objects.create(name='małopolskie')
+    City.objects.create(voivodeship_id=malopolskie, name='Kraków', latitude=50.06, longitude=19.94)
+    City.objects.create(voivodeship_id=mazowieckie, name='Warszawa', latitude=52.23, longitude=21.01)
+    City.objects.create(voivodeship_id=mazowieckie, name='Radom', latitude=51.40, longitude=21.15)
+    for i in range(3):
+        OfferCategory.objects.create(name='Kategoria {}'.format(i), icon='icon')
+        JobOfferCategory.objects.create(name='Branża {}'.format(i))
+    city_ids = list(City.objects.order_by('id').values_list('id', flat=True))
+    category_ids = list(OfferCategory.objects.order_by('id').values_list('id', flat=True))
+    job_category_ids = list(JobOfferCategory.objects.order_by('id').values_list('id', flat=True))
+
+    for i in range(60):
+        offer = Offer.objects.create(
+            user_id=users[i % 2], city_id=rng.choice(city_ids), category_id=rng.choice(category_ids),
+            name='Oferta {}'.format(i), description='opis {}'.format(i),
+            price=None if i % 15 == 0 else Decimal(rng.randint(0, 100000)) / 100,
+        )
+        Offer.objects.filter(id=offer.id).update(creation_date=TODAY - timedelta(days=i % 6))
+    for i in range(60):
+        min_salary = rng.randint(3000, 12000)
+        job_offer = JobOffer.objects.create(
+            user_id=users[i % 2], city_id=rng.choice(city_ids), category_id=rng.choice(job_category_ids),
+            name='Praca {}'.format(i), company='Firma {}'.format(i % 4), remote=i % 3 == 0,
+            min_salary=min_salary, max_salary=None if i % 7 == 0 else min_salary + rng.randint(0, 6000),
+        )
+        JobOffer.objects.filter(id=job_offer.id).update(creation_date=TODAY - timedelta(days=i % 6))
+
+    ids = {'voivodeship0': malopolskie.id, 'voivodeship1': mazowieckie.id}
+    for name, values in (
+        ('user', [user.id for user in users]), ('city', city_ids),
+        ('category', category_ids), ('jobcategory', job_category_ids),
+    ):
+        ids.update(('{}{}'.format(name, i), pk) for i, pk in enumerate(values))
+    return users, ids
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class NativeReadsParityTests(TestCase):
+    """
+    The native pymongo reads (OM_app/repository.py) answer like the ORM.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.users, self.ids = seed_marketplace()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get(self, url, params, native):
+        params = {name: str(value).format(**self.ids) for name, value in params.items()}
+        with override_settings(NATIVE_READS={'ENABLED': native}):
+            response = self.client.get(url, params)
+        return response.status_code, response.json() if response.status_code == 200 else None
+
+    def assertSameResponse(self, url, params, unordered=False):
+        orm, native = self.get(url, params, False), self.get(url, params, True)
+        if unordered:
+            # rows with the same sort key come in either order
+            for status, data in (orm, native):
+                if data is not None:
+                    data['results'].sort(key=lambda row: row['id'])
+        self.assertEqual(orm, native, '{} {}'.format(url, params))
+        return native[1]
+
+    def assertSamePages(self, url, params):
+        """
+        Every keyset page, following the next links, and one limit/offset page holding every match.
+        """
+        self.assertSameResponse(url, dict(params, limit=1000), unordered=True)
+        params = dict(params, cursor='', limit=7, count='true')
+        for _ in range(20):
+            data = self.assertSameResponse(url, params)
+            if not data['next']:
+                return
+            params['cursor'] = parse_qs(urlparse(data['next']).query)['cursor'][0]
+        self.fail('more pages than expected: {} {}'.format(url, params))
+
+    def test_filters_are_all_covered(self):
+        for filterset, filters in ((OfferFilter, OFFER_FILTERS), (JobOfferFilter, JOB_OFFER_FILTERS)):
+            sent = {name for params in filters for name in params}
+            self.assertEqual(set(filterset.base_filters) - sent - MODIFIERS, set(), filterset.__name__)
+
+    def test_offer_list(self):
+        for params in ({},) + OFFER_FILTERS:
+            for ordering in (None, 'price', '-price', 'creation_date', '-creation_date'):
+                with self.subTest(params=params, ordering=ordering):
+                    self.assertSamePages('/api/offers/', dict(params, **({'ordering': ordering} if ordering else {})))
+
+    def test_job_offer_list(self):
+        for params in ({},) + JOB_OFFER_FILTERS:
+            for ordering in (None, 'max_salary', '-max_salary', 'creation_date', '-creation_date'):
+                with self.subTest(params=params, ordering=ordering):
+                    self.assertSamePages('/api/joboffers/', dict(params, **({'ordering': ordering} if ordering else {})))
+
+    def test_sparse_fields(self):
+        self.assertSamePages('/api/offers/', {'fields': 'id,name,price,image_variants,is_favourite'})
+        self.assertSamePages('/api/joboffers/', {'fields': 'id,company,max_salary', 'ordering': '-max_salary'})
+
+    def test_invalid_filters(self):
+        self.assertSameResponse('/api/offers/', {'min_price': 'abc'})
+        self.assertSameResponse('/api/joboffers/', {'near': 'north'})
+
+    def test_detail(self):
+        for model, url in ((Offer, '/api/offers/{}/'), (JobOffer, '/api/joboffers/{}/')):
+            for pk in list(model.objects.values_list('id', flat=True)[:10]) + [0, 'x']:
+                with self.subTest(url=url, pk=pk):
+                    self.assertSameResponse(url.format(pk), {})
+
+    def test_favourites(self):
+        for offer_id in Offer.objects.values_list('id', flat=True)[:12]:
+            FavouriteOffer.objects.create(user_id=self.users[0], offer_id_id=offer_id)
+        for job_offer_id in JobOffer.objects.values_list('id', flat=True)[:12]:
+            FavouriteJobOffer.objects.create(user_id=self.users[0], job_offer_id_id=job_offer_id)
+        for ordering in ('price', '-creation_date'):
+            self.assertSamePages('/api/offers/favourites/list/', {'ordering': ordering})
+        for ordering in ('max_salary', '-creation_date'):
+            self.assertSamePages('/api/joboffers/favourites/list/', {'ordering': ordering})
+
+    def test_chat_history(self):
+        contacts = [Contact.objects.create(user_id=user.id) for user in self.users]
+        chat = Chat.objects.create()
+        chat.participants.add(*contacts)
+        for i in range(25):
+            Message.objects.create(contact=contacts[i % 2], chat=chat, content='message {}'.format(i))
+        url = '/api/chat/{}/messages/'.format(chat.pk)
+        params = {'limit': 4}
+        for _ in range(10):
+            data = self.assertSameResponse(url, params)
+            if not data['before']:
+                break
+            params['before'] = data['before']
+        self.assertIsNone(data['before'])
+        self.assertSameResponse(url, {'before': 0})
+
+
+class ChatWriterTests(TestCase):
+    """
+    Write-behind chat messages survive a crashed writer and a message that cannot be stored.
+    """
+    def setUp(self):
+        users = [User.objects.create_user('user{}'.format(i), 'user{}@test.local'.format(i), 'test-password') for i in range(2)]
+        self.contacts = [Contact.objects.create(user_id=user.id) for user in users]
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(*self.contacts)
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: [os.unlink(path) for path in glob.glob(os.path.join(self.journal_dir, '*'))])
+        self.addCleanup(os.rmdir, self.journal_dir)
+
+    def make_writer(self, **options):
+        options = dict(dict(
+            batch_size=100, flush_interval=0.01, max_queue=100, max_backoff=0, journal_dir=self.journal_dir,
+        ), **options)
+        return chat_writer.MessageWriter(**options)
+
+    def record(self, writer, content):
+        return {
+            'id': writer.next_id(),
+            'client_id': uuid.uuid4().hex,
+            'contact_id': self.contacts[0].id,
+            'chat_id': self.chat.id,
+            'content': content,
+            'timestamp': timezone.now().isoformat(),
+        }
+
+    def test_recover_replays_the_journal_of_a_killed_writer(self):
+        writer = self.make_writer()
+        records = [self.record(writer, 'message {}'.format(i)) for i in range(5)]
+        # killed once the messages are journaled, before the thread stores them
+        with mock.patch.object(chat_writer.MessageWriter, 'start'):
+            for record in records:
+                writer.put(record)
+        writer.journal.close()      # the process exits, its lock goes with it
+        self.assertEqual(Message.objects.count(), 0)
+
+        self.assertEqual(chat_writer.recover(self.journal_dir), 5)
+        self.assertEqual(glob.glob(os.path.join(self.journal_dir, 'messages-*.ndjson')), [])
+        stored = Message.objects.order_by('id').values_list('id', 'client_id', 'content')
+        self.assertEqual(list(stored), [(r['id'], r['client_id'], r['content']) for r in records])
+
+        # a replay of messages already stored stores nothing
+        writer = self.make_writer()
+        with mock.patch.object(chat_writer.MessageWriter, 'start'):
+            writer.put(records[0])
+        writer.journal.close()
+        self.assertEqual(chat_writer.recover(self.journal_dir), 0)
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_recover_skips_the_journal_of_a_running_writer(self):
+        writer = self.make_writer()
+        with mock.patch.object(chat_writer.MessageWriter, 'start'):
+            writer.put(self.record(writer, 'message'))
+        self.assertEqual(chat_writer.recover(self.journal_dir), 0)
+        writer.close()
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_failing_message_is_dead_lettered(self):
+        store = chat_writer.store
+
+        def store_unless_poisoned(records):
+            if any(record['content'] == 'poison' for record in records):
+                raise ValueError('poison')
+            return store(records)
+
+        writer = self.make_writer(max_attempts=3)
+        records = [self.record(writer, content) for content in ('first', 'poison', 'last')]
+        with mock.patch.object(chat_writer, 'store', side_effect=store_unless_poisoned):
+            with mock.patch.object(chat_writer.MessageWriter, 'start'):
+                for record in records:
+                    writer.put(record)
+            writer.close()      # one batch, returns although one message can never be stored
+
+        self.assertEqual(sorted(Message.objects.values_list('content', flat=True)), ['first', 'last'])
+        self.assertEqual(writer.stats['flush_failures'], 3)
+        self.assertEqual(writer.stats['dead_lettered'], 1)
+        self.assertEqual(chat_writer.recover(self.journal_dir), 0)
+        writer.dead_letters.close()
+        self.assertEqual(chat_writer.recover(self.journal_dir, pattern='dead-letters-*.ndjson'), 1)
+        self.assertEqual(Message.objects.get(content='poison').id, records[1]['id'])
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class SearchTests(TestCase):
+    """
+    Every object matching all tokens is found, the last token as a prefix.
+    """
+    def setUp(self):
+        cache.clear()
+        self.users, self.ids = seed_marketplace()
+        offers = Offer.objects.order_by('id')
+        for i, offer in enumerate(offers):
+            offer.name = 'Rower {} górski'.format(i) if i % 3 else 'Rower miejski'
+            offer.save()
+        search.rebuild('offer')
+        self.client = APIClient()
+
+    def test_every_token_matches(self):
+        mountain = set(Offer.objects.filter(name__contains='górski').values_list('id', flat=True))
+        self.assertEqual(set(search.search('offer', 'rower gor', limit=None)), mountain)
+        self.assertEqual(set(search.search('offer', 'GÓRSKI rower', limit=None)), mountain)
+        self.assertEqual(search.search('offer', 'rower gorx'), [])
+        self.assertEqual(len(search.search('offer', 'rower', limit=7)), 7)
+
+    def test_best_ranked_first(self):
+        ranked = search.search('offer', 'rower', limit=None)
+        self.assertEqual(len(ranked), Offer.objects.count())
+        self.assertEqual(ranked, sorted(ranked, reverse=True))     # one weight, ties by id
+
+    def test_ordered_search_lists_every_match(self):
+        response = self.client.get('/api/offers/', {'search': 'rower gor', 'ordering': 'price', 'limit': 1000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(row['id'] for row in response.json()['results']),
+            sorted(Offer.objects.filter(name__contains='górski').values_list('id', flat=True)),
+        )
+
+
+class FavouriteCountTests(TestCase):
+    """
+    Saving an offer loaded before a favourite change keeps the count of the database.
+    """
+    def test_save_keeps_favourite_count(self):
+        users, ids = seed_marketplace()
+        for model, favourite, field in ((Offer, FavouriteOffer, 'offer_id'), (JobOffer, FavouriteJobOffer, 'job_offer_id')):
+            with self.subTest(model=model.__name__):
+                obj = model.objects.order_by('id').first()
+                favourite.objects.create(**{'user_id': users[0], field: obj})
+                obj.name = 'renamed'
+                obj.save()
+                obj = model.objects.get(id=obj.id)
+                self.assertEqual((obj.name, obj.favourite_count), ('renamed', 1))
+
+
+class ReadAliasTests(TestCase):
+    """
+    Pages of the response cache are computed from the primary.
+    """
+    def test_cached_pages_read_from_primary(self):
+        self.assertEqual(read_alias(), 'reads')
+        aliases = []
+        with mock.patch('OM_app.api.mixins.repository.list_documents', side_effect=lambda *args: aliases.append(read_alias())):
+            self.assertEqual(APIClient().get('/api/offers/').status_code, 200)
+        self.assertEqual(aliases, ['default'])
+        with primary_reads():
+            self.assertEqual(read_alias(), 'default')
+        self.assertEqual(read_alias(), 'reads')
+
+
+class GenerationTests(TestCase):
+    """
+    A generation bumped by another process reaches this one within CHECK_INTERVAL.
+    """
+    def test_bump_of_another_process_is_seen(self):
+        before = generations.current('test')
+        generations.get_collection().update_one({'_id': 'test'}, {'$inc': {'value': 1}}, upsert=True)
+        with mock.patch.object(generations, 'CHECK_INTERVAL', 0):
+            self.assertEqual(generations.current('test'), before + 1)
+        generations.bump('test')
+        self.assertEqual(generations.current('test'), before + 2)
+
+    def test_city_index_follows_updates_without_signals(self):
+        seed_marketplace()
+        krakow = City.objects.get(name='Kraków')
+        self.assertIn(krakow.id, geo.cities_near(50.06, 19.94, 10))
+        City.objects.filter(id=krakow.id).update(latitude=54.35, longitude=18.65)
+        generations.get_collection().update_one({'_id': geo.GENERATION}, {'$inc': {'value': 1}}, upsert=True)
+        with mock.patch.object(generations, 'CHECK_INTERVAL', 0):
+            self.assertNotIn(krakow.id, geo.cities_near(50.06, 19.94, 10) or ())
+
+
+class OfferExportTests(TestCase):
+    """
+    Deltas of the offer export answer 304 until an offer changes, and send
+    every change, also one made in the second the previous export ran.
+    """
+    def setUp(self):
+        users, ids = seed_marketplace()
+        self.client = APIClient()
+        self.client.force_authenticate(users[0])
+        self.second = timezone.now().replace(microsecond=0) - timedelta(minutes=1)
+        Offer.objects.update(modification_date=self.second - timedelta(seconds=5))
+
+    def export(self, now, **headers):
+        with mock.patch('OM_app.api.views.OfferExport.get_until', return_value=now.replace(microsecond=0)):
+            response = self.client.get('/api/offers/export/', **headers)
+        rows = b''.join(response.streaming_content).splitlines() if response.status_code == 200 else []
+        return response, [json.loads(row)['id'] for row in rows]
+
+    def test_if_modified_since(self):
+        response, exported = self.export(self.second)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(exported), Offer.objects.count())
+
+        last_modified = response['Last-Modified']
+        response, _ = self.export(self.second, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        changed = Offer.objects.order_by('id').first()
+        Offer.objects.filter(id=changed.id).update(modification_date=self.second + timedelta(seconds=2))
+        response, exported = self.export(self.second + timedelta(seconds=3), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(exported, [changed.id])
+
+    def test_change_in_the_second_of_the_export(self):
+        first, second = Offer.objects.order_by('id')[:2]
+        Offer.objects.filter(id=first.id).update(modification_date=self.second + timedelta(milliseconds=200))
+        # the export runs at .500 of that second, the second offer changes at .700
+        response, exported = self.export(self.second + timedelta(milliseconds=500))
+        self.assertNotIn(first.id, exported)
+        Offer.objects.filter(id=second.id).update(modification_date=self.second + timedelta(milliseconds=700))
+
+        last_modified = response['Last-Modified']
+        response, exported = self.export(self.second + timedelta(milliseconds=1500), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(exported), sorted([first.id, second.id]))
+
+        response, _ = self.export(self.second + timedelta(seconds=3), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class OfferListImageTests(TestCase):
+    """
+    List rows carry the `image` of the offer detail.
+    """
+    def test_image_matches_detail(self):
+        seed_marketplace()
+        offer = Offer.objects.order_by('-creation_date', '-id').first()
+        Offer.objects.filter(id=offer.id).update(image='offers_images/{}.jpg'.format(offer.id))
+        client = APIClient()
+        detail = client.get('/api/offers/{}/'.format(offer.id)).json()
+        self.assertTrue(detail['image'])
+        for native in (False, True):
+            with override_settings(NATIVE_READS={'ENABLED': native}):
+                rows = {row['id']: row for row in client.get('/api/offers/', {'limit': 1000}).json()['results']}
+            self.assertEqual(rows[offer.id]['image'], detail['image'])
+            self.assertEqual(sum(1 for row in rows.values() if row['image'] is not None), 1)
+
+
+def image_upload(color='red'):
+    from PIL import Image
+    upload = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(upload, 'PNG')
+    upload.seek(0)
+    return upload
+
+
+class OfferImageTests(TestCase):
+    """
+    Offer images: uploads a stopped process left pending are processed at the
+    next startup, concurrent uploads and ordinary saves keep the worker's result.
+    """
+    def setUp(self):
+        self.media_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_dir)
+        storage = FileSystemStorage(location=os.path.join(self.media_dir, 'media'))
+        for patcher in (
+            override_settings(OFFER_IMAGES={'STAGING_DIR': os.path.join(self.media_dir, 'staging'), 'WORKERS': 0}),
+            mock.patch.object(images, 'image_storage', storage),
+            mock.patch.object(images, 'staging_storage', FileSystemStorage(location=os.path.join(self.media_dir, 'staging'))),
+            mock.patch.object(Offer._meta.get_field('image'), 'storage', storage),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_requeue_pending(self):
+        users, ids = seed_marketplace()
+        offer = Offer.objects.order_by('id').first()
+        staged_name = images.staging_storage.save(images.staging_name(offer.id, 1), image_upload())
+        Offer.objects.filter(id=offer.id).update(image_status=Offer.IMAGE_PENDING, image_version=1)
+
+        self.assertEqual(images.requeue_pending(), 0)   # may still be processed by its own process
+        old = images.time.time() - images.DEFAULTS['REQUEUE_AFTER'] - 1
+        os.utime(images.staging_storage.path(staged_name), (old, old))
+        self.assertEqual(images.requeue_pending(), 1)
+        self.assertEqual(images.requeue_pending(), 0)
+
+        offer = Offer.objects.get(id=offer.id)
+        self.assertEqual(offer.image_status, Offer.IMAGE_READY)
+        self.assertTrue(offer.image.storage.exists(offer.image.name))
+        self.assertEqual(os.listdir(images.staging_storage.location), [])
+
+    def test_stale_save_keeps_processed_image(self):
+        seed_marketplace()
+        stale = Offer.objects.order_by('id').first()
+        images.accept_upload(Offer.objects.get(id=stale.id), image_upload())
+        stale.name = 'renamed'
+        stale.save()
+
+        offer = Offer.objects.get(id=stale.id)
+        self.assertEqual((offer.name, offer.image_status, offer.image_version), ('renamed', Offer.IMAGE_READY, 1))
+        self.assertTrue(offer.image.name)
+        self.assertIsNotNone(images.variant_urls(offer))
+
+    def test_concurrent_uploads_get_their_own_version(self):
+        seed_marketplace()
+        first, second = Offer.objects.order_by('id').first(), Offer.objects.order_by('id').first()
+        with mock.patch.object(images, 'queue_upload') as queue_upload:
+            images.accept_upload(first, image_upload('red'))
+            images.accept_upload(second, image_upload('blue'))
+        (_, first_version, first_staged), _ = queue_upload.call_args_list[0]
+        (_, second_version, second_staged), _ = queue_upload.call_args_list[1]
+        self.assertEqual((first_version, second_version), (1, 2))
+        self.assertNotEqual(first_staged, second_staged)
+        self.assertEqual(Offer.objects.get(id=first.id).image_version, 2)
+
+
+class ImportTests(TestCase):
+    """
+    A bulk import adds its rows to the search index and leaves the other entries alone.
+    """
+    def test_import_indexes_imported_rows(self):
+        users, ids = seed_marketplace()
+        search.rebuild('offer')
+        entries = SearchEntry.objects.filter(kind='offer').count()
+        lines = ''.join(
+            json.dumps({'user_id': users[0].id, 'city_id': ids['city0'], 'category_id': ids['category0'],
+                        'name': 'Hulajnoga {}'.format(i), 'price': '99.00'}) + '\n'
+            for i in range(5)
+        )
+        with mock.patch.object(search, 'rebuild') as rebuild:
+            result = bulk.import_rows('offer', io.StringIO(lines), 'ndjson', batch_size=2)
+        rebuild.assert_not_called()
+        self.assertEqual(result['created'], 5)
+
+        imported = set(Offer.objects.filter(name__startswith='Hulajnoga').values_list('id', flat=True))
+        self.assertEqual(len(imported), 5)
+        self.assertEqual(set(search.search('offer', 'hulaj', limit=None)), imported)
+        self.assertEqual(SearchEntry.objects.filter(kind='offer').count(), entries + 10)   # two tokens each
+
+
+class ChatInboxTests(TestCase):
+    """
+    The inbox costs the same queries for any number of chats, read markers are created once.
+    """
+    def setUp(self):
+        self.users = [User.objects.create_user('user{}'.format(i), 'user{}@test.local'.format(i), 'test-password') for i in range(6)]
+        self.contacts = [Contact.objects.create(user_id=user.id) for user in self.users]
+
+    def add_chat(self, *contacts, messages=3):
+        chat = Chat.objects.create()
+        chat.participants.add(*contacts)
+        for i in range(messages):
+            Message.objects.create(contact=contacts[i % len(contacts)], chat=chat, content='message {}'.format(i))
+        return chat
+
+    def test_constant_queries(self):
+        self.add_chat(self.contacts[0], self.contacts[1])
+        with self.assertNumQueries(5):
+            self.assertEqual(len(get_inbox(self.users[0].id)), 1)
+
+        for i in range(2, 6):
+            chat = self.add_chat(self.contacts[0], *self.contacts[1:i + 1])
+            mark_chat_read(chat.id, self.contacts[0].id)
+        with self.assertNumQueries(5):
+            inbox = get_inbox(self.users[0].id)
+        self.assertEqual(len(inbox), 5)
+        self.assertEqual(sorted(len(chat['participants']) for chat in inbox), [2, 3, 4, 5, 6])
+        self.assertEqual(sorted(chat['unread'] for chat in inbox), [0, 0, 0, 0, 1])
+
+    def test_mark_chat_read(self):
+        chat = self.add_chat(self.contacts[0], self.contacts[1])
+        mark_chat_read(chat.id, self.contacts[0].id)
+        first = ChatReadMarker.objects.get(chat=chat, contact=self.contacts[0]).last_read
+        mark_chat_read(chat.id, self.contacts[0].id)
+        self.assertEqual(ChatReadMarker.objects.filter(chat=chat, contact=self.contacts[0]).count(), 1)
+        self.assertGreaterEqual(ChatReadMarker.objects.get(chat=chat, contact=self.contacts[0]).last_read, first)
+
+    def test_mark_chat_read_race(self):
+        chat = self.add_chat(self.contacts[0], self.contacts[1])
+        old = timezone.now() - timedelta(days=1)
+        # the marker another request created between our lookup and our insert
+        ChatReadMarker.objects.create(chat=chat, contact=self.contacts[0], last_read=old)
+        with mock.patch.object(ChatReadMarker.objects, 'update_or_create', side_effect=IntegrityError):
+            mark_chat_read(chat.id, self.contacts[0].id)
+        self.assertGreater(ChatReadMarker.objects.get(chat=chat, contact=self.contacts[0]).last_read, old)
+
+
+@override_settings(NATIVE_READS={'ENABLED': False})
+class FavouritesQueryTests(TestCase):
+    """
+    The favourites lists cost the same ORM queries for 1, 100 and 1000 favourites.
+    """
+    def get(self, url, params):
+        cache.clear()   # the favourite id set is read again
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_constant_queries(self):
+        users, ids = seed_marketplace()
+        self.client = APIClient()
+        self.client.force_authenticate(users[0])
+        Offer.objects.bulk_create([
+            Offer(user_id=users[1], city_id=ids['city0'], category_id=ids['category0'], name='Ulubiona {}'.format(i), price=i)
+            for i in range(1000)
+        ])
+        JobOffer.objects.bulk_create([
+            JobOffer(user_id=users[1], city_id=ids['city0'], category_id=ids['jobcategory0'], name='Ulubiona {}'.format(i),
+                     min_salary=3000 + i, max_salary=None if i % 10 == 0 else 4000 + i)
+            for i in range(1000)
+        ])
+        offer_ids = list(Offer.objects.filter(name__startswith='Ulubiona').order_by('id').values_list('id', flat=True))
+        job_offer_ids = list(JobOffer.objects.filter(name__startswith='Ulubiona').order_by('id').values_list('id', flat=True))
+        requests = (
+            ('/api/offers/favourites/list/', {'ordering': 'price', 'limit': 20}),
+            ('/api/offers/favourites/list/', {'ordering': '-creation_date', 'cursor': '', 'limit': 20}),
+            ('/api/joboffers/favourites/list/', {'ordering': 'max_salary', 'limit': 20}),
+        )
+
+        expected = {}
+        for favourites in (1, 100, 1000):
+            FavouriteOffer.objects.all().delete()
+            FavouriteJobOffer.objects.all().delete()
+            FavouriteOffer.objects.bulk_create([
+                FavouriteOffer(user_id=users[0], offer_id_id=offer_id) for offer_id in offer_ids[:favourites]
+            ])
+            FavouriteJobOffer.objects.bulk_create([
+                FavouriteJobOffer(user_id=users[0], job_offer_id_id=job_offer_id) for job_offer_id in job_offer_ids[:favourites]
+            ])
+            self.assertEqual(FavouriteOffer.objects.filter(user_id=users[0]).count(), favourites)
+            self.assertEqual(FavouriteJobOffer.objects.filter(user_id=users[0]).count(), favourites)
+            for url, params in requests:
+                with self.subTest(favourites=favourites, url=url, params=params):
+                    key = (url, tuple(params))
+                    if key not in expected:
+                        with CaptureQueriesContext(connection) as context:
+                            self.get(url, params)
+                        expected[key] = len(context.captured_queries)
+                        self.assertLessEqual(expected[key], 3)
+                    with self.assertNumQueries(expected[key]):
+                        results = self.get(url, params)
+                    self.assertEqual(len(results), min(20, favourites))
+
+
+class MetricsEndpointTests(TestCase):
+    """
+    /metrics only answers the scraper.
+    """
+    def test_scrape_access(self):
+        client = APIClient(REMOTE_ADDR='203.0.113.7')
+        with override_settings(PERFORMANCE_METRICS={'SCRAPE_TOKEN': None, 'SCRAPE_ADDRESSES': ()}):
+            self.assertEqual(client.get('/metrics').status_code, 403)
+        with override_settings(PERFORMANCE_METRICS={'SCRAPE_TOKEN': 'secret', 'SCRAPE_ADDRESSES': ()}):
+            self.assertEqual(client.get('/metrics').status_code, 403)
+            self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        with override_settings(PERFORMANCE_METRICS={'SCRAPE_TOKEN': None, 'SCRAPE_ADDRESSES': ('203.0.113.7',)}):
+            self.assertEqual(client.get('/metrics').status_code, 200)
+
+    def test_loopback_needs_the_token(self):
+        # what a reverse proxy on the same host looks like
+        client = APIClient(REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(client.get('/metrics').status_code, 403)
+
+
+class TokenRevocationTests(TestCase):
+    """
+    Changing the password or closing the account revokes every token issued
+    before, on the claims fast path of safe requests too.
+    """
+    password = 'Old-password-1234'
+
+    def setUp(self):
+        cache.clear()
+        authentication.user_cache.entries.clear()
+        self.user = User.objects.create_user('owner', 'owner@test.local', self.password)
+        self.tokens = self.obtain(self.password)
+
+    def obtain(self, password):
+        response = APIClient().post('/api/auth/token/', {'email': 'owner@test.local', 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def client_for(self, tokens):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(tokens['access']))
+        return client
+
+    def change_password(self):
+        response = self.client_for(self.tokens).put(
+            '/api/auth/password/change/', {'old_password': self.password, 'new_password': 'New-password-5678'}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_password_change_bumps_version_and_returns_working_tokens(self):
+        self.assertEqual(self.client_for(self.tokens).get('/api/chat/inbox/').status_code, 200)
+        tokens = self.change_password()
+        self.assertEqual(User.objects.get(id=self.user.id).token_version, 1)
+        self.assertEqual(self.client_for(tokens).get('/api/chat/inbox/').status_code, 200)
+        self.assertEqual(self.client_for(tokens).patch('/api/users/current/', {'username': 'renamed'}).status_code, 200)
+        self.assertTrue(VersionedTokenRefreshSerializer(data={'refresh': tokens['refresh']}).is_valid())
+
+    def test_old_access_token_is_rejected(self):
+        client = self.client_for(self.tokens)
+        self.assertEqual(client.get('/api/chat/inbox/').status_code, 200)   # caches the version
+        self.change_password()
+        self.assertEqual(client.get('/api/chat/inbox/').status_code, 401)
+        self.assertEqual(client.patch('/api/users/current/', {'username': 'renamed'}).status_code, 401)
+        self.assertEqual(User.objects.get(id=self.user.id).username, 'owner')
+
+    def test_old_refresh_token_is_rejected(self):
+        self.change_password()
+        serializer = VersionedTokenRefreshSerializer(data={'refresh': self.tokens['refresh']})
+        with self.assertRaises(serializers.ValidationError):
+            serializer.is_valid(raise_exception=True)
+        self.assertEqual(APIClient().post('/api/auth/token/refresh/', {'refresh': self.tokens['refresh']}).status_code, 400)
+
+    def test_delete_user_revokes_tokens(self):
+        client = self.client_for(self.tokens)
+        self.assertEqual(client.get('/api/chat/inbox/').status_code, 200)
+        self.assertIn(client.delete('/api/users/close-account/').status_code, (200, 204))
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertEqual(client.get('/api/chat/inbox/').status_code, 401)
+        self.assertIsNone(authentication.user_for_token(self.tokens['access']))
+
+    def test_websocket_rejects_stale_token(self):
+        self.assertEqual(authentication.user_for_token(self.tokens['access']).id, self.user.id)
+        tokens = self.change_password()
+        self.assertIsNone(authentication.user_for_token(self.tokens['access']))
+        self.assertEqual(authentication.user_for_token(tokens['access']).id, self.user.id)
+        self.assertIsNone(authentication.user_for_token('not-a-token'))
+
+    def test_change_in_another_process(self):
+        client = self.client_for(self.tokens)
+        self.assertEqual(client.get('/api/chat/inbox/').status_code, 200)   # caches the version
+        # another process changes the password: the user row and the shared generation
+        User.objects.filter(id=self.user.id).update(token_version=1)
+        generations.get_collection().update_one(
+            {'_id': authentication.GENERATION}, {'$inc': {'value': 1}}, upsert=True
+        )
+        self.assertEqual(client.get('/api/chat/inbox/').status_code, 200)   # within CHECK_INTERVAL
+        with mock.patch.object(generations, 'CHECK_INTERVAL', 0):
+            self.assertEqual(client.get('/api/chat/inbox/').status_code, 401)
+
+
+@override_settings(MAIL_QUEUE={'MAX_ATTEMPTS': 2, 'BACKOFF': 60})
+class MailQueueTests(TestCase):
+    """
+    Queued e-mails are sent by the worker, retried with backoff and given up on.
+    """
+    def setUp(self):
+        self.email = mail_queue.enqueue(
+            'Reset', 'email/user_reset_password',
+            {'username': 'owner', 'email': 'owner@test.local', 'reset_password_url': '/key'},
+            'noreply@somehost.local', ['owner@test.local'],
+        )
+
+    def test_send(self):
+        self.assertEqual(mail_queue.send_batch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['owner@test.local'])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutgoingEmail.SENT, 1))
+        self.assertEqual(mail_queue.send_batch(), (0, 0))
+
+    def test_retry_with_backoff(self):
+        failing = mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=smtplib.SMTPException('down')
+        )
+        with failing:
+            self.assertEqual(mail_queue.send_batch(), (0, 1))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutgoingEmail.QUEUED, 1))
+        self.assertEqual(self.email.last_error, 'down')
+        self.assertGreater(self.email.next_attempt, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(mail_queue.send_batch(), (0, 0))     # not due yet
+
+        OutgoingEmail.objects.filter(pk=self.email.pk).update(next_attempt=timezone.now())
+        with failing:
+            self.assertEqual(mail_queue.send_batch(), (0, 1))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutgoingEmail.DEAD, 2))
+        self.assertEqual(mail.outbox, [])
+
+    def test_crashed_sender_counts_an_attempt(self):
+        # claimed twice by senders that crashed before they could finish
+        for attempts in (1, 2):
+            self.assertEqual(len(mail_queue.claim_batch(50, 300, 2)), 1)
+            OutgoingEmail.objects.filter(pk=self.email.pk).update(next_attempt=timezone.now())  # lease ran out
+            self.email.refresh_from_db()
+            self.assertEqual((self.email.status, self.email.attempts), (OutgoingEmail.SENDING, attempts))
+        self.assertEqual(mail_queue.send_batch(), (0, 0))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutgoingEmail.DEAD)
+        self.assertEqual(mail.outbox, [])
+
+
+@override_settings(RESPONSE_CACHE={'CACHE': 'responses'})
+class ResponseCacheTests(TestCase):
+    """
+    Anonymous list pages come from the response cache until an offer changes.
+    """
+    def setUp(self):
+        seed_marketplace()
+        response_cache.get_cache().clear()
+        self.client = APIClient()
+
+    def get(self):
+        response = self.client.get('/api/offers/', {'limit': 1000})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit_and_miss(self):
+        first = self.get()
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.get()
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get('/api/offers/', {'limit': 10})['X-Cache'], 'MISS')
+
+    def test_offer_save_invalidates(self):
+        self.get()
+        offer = Offer.objects.order_by('id').first()
+        offer.name = 'Zmieniona oferta'
+        offer.save()
+        response = self.get()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(offer.name, {row['name'] for row in response.json()['results']})
+
+    def test_change_in_another_process(self):
+        self.get()
+        generations.get_collection().update_one(
+            {'_id': response_cache.generation_name('offer')}, {'$inc': {'value': 1}}, upsert=True
+        )
+        self.assertEqual(self.get()['X-Cache'], 'HIT')     # within CHECK_INTERVAL
+        with mock.patch.object(generations, 'CHECK_INTERVAL', 0):
+            self.assertEqual(self.get()['X-Cache'], 'MISS')
+
+
+class ReferenceDataTests(TestCase):
+    """
+    Reference data is served with an ETag, answers 304 to it and changes with the data.
+    """
+    def test_etag(self):
+        seed_marketplace()
+        client = APIClient()
+        response = client.get('/api/voivodeships-cities/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(
+            sorted(city['name'] for voivodeship in response.json() for city in voivodeship['cities']),
+            ['Kraków', 'Radom', 'Warszawa'],
+        )
+
+        replay = client.get('/api/voivodeships-cities/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(replay.status_code, 304)
+        self.assertEqual(replay['ETag'], etag)
+
+        city = City.objects.get(name='Radom')
+        city.name = 'Płock'
+        city.save()
+        response = client.get('/api/voivodeships-cities/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Płock', [city['name'] for voivodeship in response.json() for city in voivodeship['cities']])
+
+
+class FacetTests(TestCase):
+    """
+    A selected facet keeps counting its other values, the other facets are narrowed by it.
+    """
+    def test_offer_facets(self):
+        cache.clear()
+        _, ids = seed_marketplace()
+        category = ids['category1']
+        offers = list(Offer.objects.filter(price__gte=250))
+        selected = [offer for offer in offers if offer.category_id == category]
+        voivodeship_of = dict(City.objects.values_list('id', 'voivodeship_id'))
+
+        response = APIClient().get('/api/offers/facets/', {'category_id': category, 'min_price': '250'})
+        self.assertEqual(response.status_code, 200)
+        counts = response.json()
+
+        def keyed(counter):
+            return {str(value): n for value, n in counter.items()}
+
+        self.assertEqual(counts['total'], len(selected))
+        self.assertEqual(counts['category_id'], keyed(Counter(offer.category_id for offer in offers)))
+        self.assertGreater(len(counts['category_id']), 1)
+        self.assertEqual(counts['city_id'], keyed(Counter(offer.city_id for offer in selected)))
+        self.assertEqual(
+            counts['voivodeship_id'], keyed(Counter(voivodeship_of[offer.city_id] for offer in selected))
+        )
+        self.assertNotIn('user_id', counts)
+
 
-# Create your tests here.
+class ChatHistoryFrameTests(TestCase):
+    """
+    A fetch_messages command with a bad cursor or limit gets an error frame.
+    """
+    def test_errors(self):
+        user = User.objects.create_user('user0', 'user0@test.local', 'test-password')
+        contact = Contact.objects.create(user_id=user.id)
+        chat = Chat.objects.create()
+        chat.participants.add(contact)
+        message = Message.objects.create(contact=contact, chat=chat, client_id=uuid.uuid4().hex, content='hej')
+        consumer = MessageJsonMixin()
+        for native in (False, True):
+            with override_settings(NATIVE_READS={'ENABLED': native}):
+                content = consumer.history_to_json(chat.id, {})
+                self.assertEqual(content['command'], 'messages')
+                self.assertEqual([row['id'] for row in content['messages']], [message.id])
+                for data, field in (
+                    ({'limit': 'ten'}, 'limit'), ({'limit': None}, 'limit'),
+                    ({'before': 'abc'}, 'before'), ({'before': message.id + 1000}, 'before'),
+                ):
+                    content = consumer.history_to_json(chat.id, data)
+                    self.assertEqual(content['command'], 'error')
+                    self.assertEqual(content['request'], 'fetch_messages')
+                    self.assertEqual(list(content['errors']), [field])
@@ -1,3 +1,22 @@
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import render
 
-# Create your views here.
+from . import metrics, mongo_pool
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint with the metrics of this process, for the
+    scraper only, see metrics.scrape_allowed().
+    """
+    if not metrics.scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def health_view(request):
+    """
+    Load balancer check: 200 when every database alias answers a ping, 503 otherwise.
+    """
+    healthy, databases = mongo_pool.health()
+    return JsonResponse({'healthy': healthy, 'databases': databases}, status=200 if healthy else 503)
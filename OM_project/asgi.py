@@ -1,17 +1,24 @@
 import os
 
-from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
-from OM_app import routing
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "OM_PROJECT.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "OM_project.settings")
+
+# sets Django up, before the imports below touch models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from OM_app import images, mongo_pool, routing  # noqa: E402
+from OM_app.middleware import JWTAuthMiddlewareStack  # noqa: E402
+
+mongo_pool.warm_up()
+images.requeue_on_startup()
 
 application = ProtocolTypeRouter({
-  "http": get_asgi_application(),
-  "websocket": AuthMiddlewareStack(
+  "http": django_asgi_app,
+  "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from OM_app.views import metrics_view, health_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('OM_app.api.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('health', health_view, name='health'),
 ]
@@ -16,4 +16,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'OM_project.settings')
 
 application = get_wsgi_application()
 
+from OM_app import images, mongo_pool  # noqa: E402
+
+mongo_pool.warm_up()
+images.requeue_on_startup()
+
 application = DjangoWhiteNoise(application)
\ No newline at end of file